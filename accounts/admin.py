@@ -1,4 +1,5 @@
 from django.contrib import admin
+from core import uploads
 from .models import User, VerificationDoc
 
 @admin.register(User)
@@ -6,4 +7,13 @@ class UserAdmin(admin.ModelAdmin):
     list_display = ('username', 'role', 'is_verified')
     list_editable = ('is_verified',) # Allows quick verification
 
-admin.site.register(VerificationDoc)
\ No newline at end of file
+@admin.register(VerificationDoc)
+class VerificationDocAdmin(admin.ModelAdmin):
+    list_display = ('user', 'upload_status', 'upload_attempts', 'uploaded_at')
+    list_filter = ('upload_status',)
+    readonly_fields = ('upload_status', 'upload_attempts', 'upload_error', 'next_upload_at', 'spooled_files')
+    actions = ['retry_uploads']
+
+    def retry_uploads(self, request, queryset):
+        self.message_user(request, f"Requeued {uploads.requeue(queryset)} failed uploads.")
+    retry_uploads.short_description = "Retry failed uploads"
\ No newline at end of file
@@ -0,0 +1,68 @@
+"""
+ModelBackend that serves request.user from the cache.
+
+AuthenticationMiddleware (and the Channels AuthMiddleware) call get_user()
+on every authenticated request. CachedModelBackend keeps the user in the
+default cache, with their BusinessProfile loaded in the same object, so a
+warm request makes no user or profile query.
+
+accounts.signals deletes the entry whenever the User or its BusinessProfile
+is saved or deleted. That covers logins (last_login), password changes, and
+the suspend/verify actions in admin_users. Bulk .update() calls on those
+tables skip the signals, so they must call invalidate_user() themselves.
+The entry is deleted again on commit, so a request reading the old row
+during the transaction can't put it back.
+
+Bump CACHE_VERSION when the fields of User or BusinessProfile change, so
+pickled instances from the previous deploy are ignored.
+
+Invalidation only reaches other processes through a shared cache. Without
+one (AUTH_USER_CACHE_ENABLED is off when REDIS_URL is unset), get_user()
+reads the database like ModelBackend.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+
+from core import metrics
+
+CACHE_VERSION = 1
+
+
+def user_cache_key(user_id):
+    return f"auth:user:v{CACHE_VERSION}:{user_id}"
+
+
+def invalidate_user(user_id):
+    key = user_cache_key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+class CachedModelBackend(ModelBackend):
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user = super().authenticate(request, username=username, password=password, **kwargs)
+        if user is None and password is not None:
+            # ModelBackend follows us in AUTHENTICATION_BACKENDS only to load
+            # sessions from before this backend; don't hash the password twice
+            raise PermissionDenied
+        return user
+
+    def get_user(self, user_id):
+        if not settings.AUTH_USER_CACHE_ENABLED:
+            return super().get_user(user_id)
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            metrics.incr('user_cache_misses')
+            User = get_user_model()
+            try:
+                user = User._default_manager.select_related('business_profile').get(pk=user_id)
+            except User.DoesNotExist:
+                return None
+            cache.set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
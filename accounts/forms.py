@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.conf import settings
+from core import uploads
 from .models import User, VerificationDoc
 
 # --- 1. BUYER FORM ---
@@ -32,12 +33,15 @@ class SellerRegisterForm(UserCreationForm):
         user.is_verified = False
         if commit:
             user.save()
-            # Create the document record using NEW fields
-            VerificationDoc.objects.create(
-                user=user,
+            # Files are spooled, then pushed to Cloudinary after commit or by run_upload_worker
+            doc = VerificationDoc(user=user)
+            uploads.spool(
+                doc,
                 business_license=self.cleaned_data['business_license'],
-                id_card=self.cleaned_data['id_card']
+                id_card=self.cleaned_data['id_card'],
             )
+            doc.save()
+            uploads.schedule(doc)
         return user
 
 # --- 3. ADMIN FORM ---
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:13
+
+import cloudinary.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_user_package_tier'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='verificationdoc',
+            name='next_upload_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='verificationdoc',
+            name='spooled_files',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='verificationdoc',
+            name='upload_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='verificationdoc',
+            name='upload_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='verificationdoc',
+            name='upload_status',
+            field=models.CharField(choices=[('pending', 'Uploading'), ('uploaded', 'Uploaded'), ('failed', 'Upload failed')], db_index=True, default='uploaded', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='verificationdoc',
+            name='business_license',
+            field=cloudinary.models.CloudinaryField(blank=True, max_length=255, null=True, verbose_name='business_license'),
+        ),
+        migrations.AlterField(
+            model_name='verificationdoc',
+            name='id_card',
+            field=cloudinary.models.CloudinaryField(blank=True, max_length=255, null=True, verbose_name='id_card'),
+        ),
+    ]
@@ -2,6 +2,8 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 from cloudinary.models import CloudinaryField
 
+from core.models import SpooledUpload
+
 class User(AbstractUser):
     # Roles
     BUYER = 'buyer'
@@ -32,20 +34,23 @@ class User(AbstractUser):
     def is_seller(self):
         return self.role == self.SELLER
 
-class VerificationDoc(models.Model):
+class VerificationDoc(SpooledUpload):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='verification_doc')
     
-    # Use CloudinaryField with resource_type='auto' to allow PDFs and Images
+    # Use CloudinaryField with resource_type='auto' to allow PDFs and Images.
+    # Empty until the upload worker has pushed the spooled file.
     business_license = CloudinaryField(
         'business_license', 
         resource_type='auto', 
-        folder='legal_docs/licenses'
+        folder='legal_docs/licenses',
+        blank=True, null=True,
     )
     
     id_card = CloudinaryField(
         'id_card', 
         resource_type='auto', 
-        folder='legal_docs/ids'
+        folder='legal_docs/ids',
+        blank=True, null=True,
     )
     
     uploaded_at = models.DateTimeField(auto_now_add=True)
@@ -1,3 +1,61 @@
-from django.test import TestCase
+from django.contrib.auth import authenticate
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from .backends import CachedModelBackend, user_cache_key
+from .models import User
+
+
+@override_settings(AUTH_USER_CACHE_ENABLED=True)
+class CachedUserBackendTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.backend = CachedModelBackend()
+        self.seller = User.objects.create_user('roastery', password='Sidamo-2025!', role='seller')
+
+    def test_warm_user_needs_no_queries(self):
+        with self.assertNumQueries(1):
+            self.backend.get_user(self.seller.id)
+        with self.assertNumQueries(0):
+            user = self.backend.get_user(self.seller.id)
+            self.assertEqual(user.role, 'seller')
+            self.assertEqual(user.business_profile.user_id, self.seller.id)
+
+    def test_saves_invalidate(self):
+        self.backend.get_user(self.seller.id)
+        self.seller.is_verified = True
+        self.seller.save()
+        self.assertIsNone(cache.get(user_cache_key(self.seller.id)))
+        self.assertTrue(self.backend.get_user(self.seller.id).is_verified)
+
+        profile = self.seller.business_profile
+        profile.company_name = "Sidamo Roasters"
+        profile.save()
+        self.assertEqual(self.backend.get_user(self.seller.id).business_profile.company_name, "Sidamo Roasters")
+
+    def test_suspended_user_is_logged_out(self):
+        admin = User.objects.create_user('staff', password='x', is_staff=True)
+        self.client.force_login(self.seller)
+        self.assertEqual(self.client.get(reverse('seller_dashboard')).status_code, 200)
+
+        staff = self.client_class()
+        staff.force_login(admin)
+        staff.post(reverse('admin_users'), {'action': 'suspend', 'user_id': self.seller.id})
+        response = self.client.get(reverse('seller_dashboard'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse('login'), response.url)
+
+    def test_authenticate(self):
+        self.assertEqual(authenticate(username='roastery', password='Sidamo-2025!'), self.seller)
+        self.assertIsNone(authenticate(username='roastery', password='wrong'))
+
+    @override_settings(AUTH_USER_CACHE_ENABLED=False)
+    def test_no_caching_without_a_shared_cache(self):
+        self.backend.get_user(self.seller.id)
+        self.assertIsNone(cache.get(user_cache_key(self.seller.id)))
+
+        # As if another worker suspended them: no invalidation reaches this process
+        User.objects.filter(id=self.seller.id).update(is_active=False)
+        self.assertIsNone(self.backend.get_user(self.seller.id))
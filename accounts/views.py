@@ -1,4 +1,5 @@
 from django.shortcuts import render, redirect
+from django.conf import settings
 from django.contrib.auth import login, authenticate
 from django.contrib import messages
 from .models import User
@@ -29,7 +30,7 @@ def admin_register(request):
         form = AdminRegisterForm(request.POST)
         if form.is_valid():
             user = form.save()
-            login(request, user)
+            login(request, user, backend=settings.AUTHENTICATION_BACKENDS[0])
             return redirect('admin_dashboard')
     else:
         form = AdminRegisterForm()
@@ -44,7 +45,7 @@ def seller_register(request):
         form = SellerRegisterForm(request.POST, request.FILES)
         if form.is_valid():
             user = form.save()
-            login(request, user)
+            login(request, user, backend=settings.AUTHENTICATION_BACKENDS[0])
             messages.success(request, "Account created. Verification pending.")
             return redirect('seller_dashboard')
     else:
@@ -60,7 +61,7 @@ def buyer_register(request):
         form = BuyerRegisterForm(request.POST)
         if form.is_valid():
             user = form.save()
-            login(request, user)
+            login(request, user, backend=settings.AUTHENTICATION_BACKENDS[0])
             return redirect('home')
     else:
         form = BuyerRegisterForm()
@@ -0,0 +1,201 @@
+"""
+Cold storage for old chat messages.
+
+`archive_chat_messages` moves messages older than CHAT_ARCHIVE_AFTER_DAYS
+out of chat_message and into MessageArchiveSegment rows. A segment holds up
+to CHAT_ARCHIVE_SEGMENT_SIZE messages of one room as compressed JSON lines:
+zstd when the zstandard package is installed, gzip otherwise. The payload
+goes in the row itself. If CHAT_ARCHIVE_STORAGE names a storage class, the
+payload goes there instead and the row keeps only its path. Segments are
+append-only, so archived messages can no longer be edited or deleted for
+everyone. "Delete for me" and "clear chat" still apply, because the
+watermarks are checked on read.
+
+history_page() works like keyset_page() for a room. When the hot rows run
+out, it continues into the segments using the same cursors, so the chat
+views don't care where a page came from.
+"""
+import gzip
+import json
+from datetime import datetime
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from core.pagination import decode_cursor, encode_cursor, keyset_page
+from .models import Attachment, Message, MessageArchiveSegment
+
+FIELDS = ('id', 'seq', 'created_seq', 'sender_id', 'content', 'timestamp', 'updated_at', 'is_edited', 'is_deleted_everyone', 'attachment_id')
+DATETIME_FIELDS = ('timestamp', 'updated_at')
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def compress(data, codec):
+    if codec == 'zstd':
+        return _zstd().ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        return _zstd().ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def default_codec():
+    return 'zstd' if settings.CHAT_ARCHIVE_CODEC == 'zstd' and _zstd() else 'gzip'
+
+
+def archive_storage():
+    """The configured file storage, or None to keep payloads in the database."""
+    if not settings.CHAT_ARCHIVE_STORAGE:
+        return None
+    return import_string(settings.CHAT_ARCHIVE_STORAGE)(**settings.CHAT_ARCHIVE_STORAGE_OPTIONS)
+
+
+def encode_rows(rows):
+    lines = []
+    for row in rows:
+        row = dict(row, **{field: row[field].isoformat() for field in DATETIME_FIELDS})
+        lines.append(json.dumps(row, ensure_ascii=False, separators=(',', ':')))
+    return '\n'.join(lines).encode()
+
+
+def decode_rows(data):
+    rows = []
+    for line in data.decode().splitlines():
+        row = json.loads(line)
+        for field in DATETIME_FIELDS:
+            row[field] = datetime.fromisoformat(row[field])
+        # Segments written before created_seq existed
+        row.setdefault('created_seq', row['seq'])
+        rows.append(row)
+    return rows
+
+
+# --- Writing ---
+def archive_room(room_id, cutoff, segment_size=None):
+    """Moves the room's messages older than `cutoff` into segments. Returns how many were moved."""
+    size = segment_size or settings.CHAT_ARCHIVE_SEGMENT_SIZE
+    archived = 0
+    while True:
+        moved = _archive_segment(room_id, cutoff, size)
+        archived += moved
+        if moved < size:
+            return archived
+
+
+def _archive_segment(room_id, cutoff, size):
+    with transaction.atomic():
+        # Locked until commit, so an edit can't land between the copy and the delete
+        rows = list(
+            Message.objects.select_for_update()
+            .filter(room_id=room_id, timestamp__lt=cutoff)
+            .order_by('timestamp', 'id')
+            .values(*FIELDS)[:size]
+        )
+        if not rows:
+            return 0
+
+        ids = [row['id'] for row in rows]
+        codec = default_codec()
+        payload = compress(encode_rows(rows), codec)
+        segment = MessageArchiveSegment(
+            room_id=room_id,
+            first_id=min(ids), last_id=max(ids),
+            first_timestamp=rows[0]['timestamp'], last_timestamp=rows[-1]['timestamp'],
+            message_count=len(rows), codec=codec,
+        )
+        storage = archive_storage()
+        if storage is None:
+            segment.data = payload
+        else:
+            # A rollback leaves an orphaned file behind, never a segment without its payload
+            name = f"chat-archive/{room_id}/{segment.first_id}-{segment.last_id}.jsonl.{'zst' if codec == 'zstd' else 'gz'}"
+            segment.path = storage.save(name, ContentFile(payload))
+        segment.save()
+        Message.objects.filter(id__in=ids).delete()
+    return len(rows)
+
+
+# --- Reading ---
+@lru_cache(maxsize=64)
+def _segment_rows(segment_id, codec, path):
+    # Segments never change once written, so decoded rows are safe to keep
+    if path:
+        with archive_storage().open(path, 'rb') as f:
+            data = f.read()
+    else:
+        data = MessageArchiveSegment.objects.values_list('data', flat=True).get(id=segment_id)
+    return decode_rows(decompress(bytes(data), codec))
+
+
+def archived_messages(participant, before=None, limit=50):
+    """
+    Archived messages of the participant's room that they can see, newest
+    first, older than the `before` cursor. Returns unsaved Message instances
+    with .is_archived set.
+    """
+    position = decode_cursor(before) if before else None
+    segments = MessageArchiveSegment.objects.filter(
+        room_id=participant.room_id, last_id__gte=participant.cleared_before,
+    ).only('id', 'codec', 'path')
+    if position:
+        segments = segments.filter(first_timestamp__lte=position[0])
+
+    hidden = set(participant.hidden_ids)
+    found = []
+    for segment in segments.order_by('-last_timestamp', '-last_id'):
+        for row in reversed(_segment_rows(segment.id, segment.codec, segment.path)):
+            if position and (row['timestamp'], row['id']) >= position:
+                continue
+            if row['id'] < participant.cleared_before or row['id'] in hidden:
+                continue
+            found.append(row)
+            if len(found) == limit:
+                break
+        if len(found) == limit:
+            break
+
+    senders = get_user_model().objects.in_bulk({row['sender_id'] for row in found})
+    attachment_ids = {row['attachment_id'] for row in found if row.get('attachment_id')}
+    attachments = Attachment.objects.in_bulk(attachment_ids) if attachment_ids else {}
+    messages = []
+    for row in found:
+        message = Message(room_id=participant.room_id, **row)
+        message.sender = senders.get(row['sender_id'])
+        if message.attachment_id:
+            message.attachment = attachments.get(message.attachment_id)
+        message.is_archived = True
+        messages.append(message)
+    return messages
+
+
+def history_page(participant, before=None, size=25):
+    """keyset_page() over the participant's visible messages, continuing into the archive."""
+    page, next_cursor = keyset_page(
+        participant.visible(Message.objects.filter(room_id=participant.room_id).select_related('attachment')),
+        'timestamp', before=before, size=size,
+    )
+    if next_cursor:
+        return page, next_cursor
+
+    # Hot rows are exhausted; everything older than them is archived
+    boundary = encode_cursor(page[-1].timestamp, page[-1].id) if page else before
+    room_for = size - len(page)
+    older = archived_messages(participant, before=boundary, limit=room_for + 1)
+    if len(older) > room_for:
+        page = page + older[:room_for]
+        return page, encode_cursor(page[-1].timestamp, page[-1].id)
+    return page + older, None
@@ -0,0 +1,225 @@
+"""
+Chunked, resumable chat attachments.
+
+1. start_upload() checks the file name, type and size and opens an
+   AttachmentUpload.
+2. The client PUTs chunks of at most CHAT_ATTACHMENT_CHUNK_SIZE, each with an
+   Upload-Offset header. write_chunk() streams the request body onto the
+   spool file at that offset in READ_BLOCK pieces, so a worker never holds a
+   whole file in memory, and no transaction is open while the body arrives.
+   A chunk sent at the wrong offset is refused and the current offset is
+   returned. The client resumes from there, also after a reload, since GET
+   on the upload returns the offset. If the spool file is gone (expired, or
+   a redeploy wiped the disk), the upload is dropped with a 410 and the
+   client starts over.
+3. After the last byte arrives, finish_upload() hashes the spool file. It
+   reuses the Attachment with the same sha256, or streams the file into
+   attachment storage, and then posts the message.
+
+Previews are made later by `run_attachment_worker` (make_previews()).
+"""
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from core import metrics
+from . import services
+from .models import Attachment, AttachmentUpload
+
+logger = logging.getLogger(__name__)
+
+READ_BLOCK = 64 * 1024
+
+
+class UploadError(Exception):
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class OffsetMismatch(UploadError):
+    """The chunk does not start where the upload stands; resume from `offset`."""
+
+    def __init__(self, offset):
+        super().__init__("Upload offset mismatch.", status=409)
+        self.offset = offset
+
+
+def spool_path(upload):
+    return os.path.join(settings.CHAT_ATTACHMENT_SPOOL_DIR, f"{upload.id}.part")
+
+
+def start_upload(room, user, filename, size):
+    filename = os.path.basename((filename or '').strip())[:255]
+    # The type comes from the name, not from what the client claims
+    content_type = mimetypes.guess_type(filename)[0]
+    if not filename or content_type not in settings.CHAT_ATTACHMENT_TYPES:
+        raise UploadError("This file type can't be attached.", status=415)
+    if not isinstance(size, int) or size <= 0:
+        raise UploadError("Invalid file size.")
+    if size > settings.CHAT_ATTACHMENT_MAX_BYTES:
+        raise UploadError("File is too large.", status=413)
+
+    upload = AttachmentUpload.objects.create(
+        room=room, user=user, filename=filename, content_type=content_type, size=size,
+    )
+    os.makedirs(settings.CHAT_ATTACHMENT_SPOOL_DIR, exist_ok=True)
+    open(spool_path(upload), 'wb').close()
+    return upload
+
+
+def write_chunk(upload, offset, stream, length):
+    """
+    Copies `length` bytes from `stream` into the spool file at `offset` and
+    returns the refreshed upload. Resending a chunk overwrites whatever part
+    of it landed before, so retries are safe.
+
+    The row lock is only held to check the offset. The body is read after
+    commit, so a slow client doesn't keep a connection in a transaction, and
+    `received` moves with an UPDATE conditional on the offset still being
+    current: of two retries of one chunk, the second gets OffsetMismatch.
+    """
+    if length > settings.CHAT_ATTACHMENT_CHUNK_SIZE:
+        raise UploadError("Chunk is too large.", status=413)
+
+    with transaction.atomic():
+        upload = AttachmentUpload.objects.select_for_update().get(id=upload.id)
+        if offset != upload.received:
+            raise OffsetMismatch(upload.received)
+        if offset + length > upload.size:
+            raise UploadError("Chunk goes past the end of the file.")
+
+    try:
+        f = open(spool_path(upload), 'r+b')
+    except FileNotFoundError:
+        upload.delete()
+        raise UploadError("This upload has expired. Please start again.", status=410)
+
+    written = 0
+    with f:
+        # No truncate: a racing retry of the same chunk may be writing too
+        f.seek(offset)
+        while written < length:
+            block = stream.read(min(READ_BLOCK, length - written))
+            if not block:
+                break
+            f.write(block)
+            written += len(block)
+    if written != length:
+        raise UploadError("Chunk ended early.")
+
+    moved = AttachmentUpload.objects.filter(id=upload.id, received=offset).update(
+        received=offset + written, updated_at=timezone.now(),
+    )
+    if not moved:
+        current = AttachmentUpload.objects.filter(id=upload.id).values_list('received', flat=True).first()
+        if current is None:
+            raise UploadError("This upload has expired. Please start again.", status=410)
+        raise OffsetMismatch(current)
+    upload.received = offset + written
+    return upload
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def store_attachment(path, size, content_type, filename):
+    """The Attachment for the bytes at `path`, stored only if nobody sent them before."""
+    sha256 = file_sha256(path)
+    attachment = Attachment.objects.filter(sha256=sha256).first()
+    if attachment is not None:
+        metrics.incr('chat_attachments_deduplicated')
+        return attachment
+
+    attachment = Attachment(sha256=sha256, size=size, content_type=content_type)
+    extension = os.path.splitext(filename)[1].lower()
+    with open(path, 'rb') as f:
+        attachment.file.save(f"{sha256}{extension}", File(f), save=False)
+    try:
+        with transaction.atomic():
+            attachment.save()
+    except IntegrityError:
+        # The same file finished at the same moment elsewhere; keep that copy
+        attachment.file.delete(save=False)
+        return Attachment.objects.get(sha256=sha256)
+    metrics.incr('chat_attachments_stored')
+    return attachment
+
+
+def finish_upload(upload):
+    """Stores the completed upload and posts it to the room. Returns the message."""
+    path = spool_path(upload)
+    attachment = store_attachment(path, upload.size, upload.content_type, upload.filename)
+    with transaction.atomic():
+        msg = services.post_message(upload.room, upload.user, upload.filename, attachment=attachment)
+        upload.delete()
+    os.remove(path)
+    return msg
+
+
+def expire_uploads():
+    """Drops uploads nobody has touched for CHAT_ATTACHMENT_UPLOAD_TTL_HOURS. Returns how many."""
+    cutoff = timezone.now() - timedelta(hours=settings.CHAT_ATTACHMENT_UPLOAD_TTL_HOURS)
+    stale = list(AttachmentUpload.objects.filter(updated_at__lt=cutoff))
+    for upload in stale:
+        try:
+            os.remove(spool_path(upload))
+        except FileNotFoundError:
+            pass
+    AttachmentUpload.objects.filter(id__in=[upload.id for upload in stale]).delete()
+    return len(stale)
+
+
+# --- Previews ---
+def render_preview(attachment):
+    from PIL import Image, ImageOps
+
+    with attachment.file.open('rb') as f:
+        image = ImageOps.exif_transpose(Image.open(f))
+        image.thumbnail((settings.CHAT_ATTACHMENT_PREVIEW_SIZE, settings.CHAT_ATTACHMENT_PREVIEW_SIZE))
+        output = io.BytesIO()
+        image.convert('RGB').save(output, 'JPEG', quality=80, optimize=True)
+    return output.getvalue()
+
+
+def make_previews(batch_size=20):
+    """
+    Makes previews for pending attachments and pushes the updated messages to
+    open rooms. Returns how many attachments were processed. Rows are locked
+    with SKIP LOCKED, so several workers can run side by side.
+    """
+    with transaction.atomic():
+        pending = list(
+            Attachment.objects.select_for_update(skip_locked=True).filter(preview_status='pending').order_by('id')[:batch_size]
+        )
+        for attachment in pending:
+            if not attachment.is_image:
+                attachment.preview_status = 'none'
+            else:
+                try:
+                    attachment.preview.save(f"{attachment.sha256}.jpg", ContentFile(render_preview(attachment)), save=False)
+                    attachment.preview_status = 'ready'
+                except Exception:
+                    logger.exception("Preview failed for attachment %s", attachment.id)
+                    attachment.preview_status = 'failed'
+            attachment.save(update_fields=['preview', 'preview_status'])
+
+            if attachment.preview_status == 'ready':
+                for msg in attachment.messages.select_related('attachment'):
+                    services.broadcast(msg.room_id, dict(services.message_payload(msg), type='chat.update'))
+    return len(pending)
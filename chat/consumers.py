@@ -1,32 +1,217 @@
+import asyncio
 import json
+import logging
+
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+
+from core.consumers import PresenceMixin
+from core.instrumentation import InstrumentedConsumerMixin
+from core.ratelimit import aconsume, arefund
+from . import services
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 5000
+
+
+class ChatConsumer(InstrumentedConsumerMixin, PresenceMixin, AsyncWebsocketConsumer):
+    """
+    Primary chat transport. The user comes from the session (scope['user']),
+    never from the client, and must be a participant of the room.
+
+    Client -> server: {"action": "send", "content": ..., "client_id": ...}
+                      {"action": "edit", "message_id": ..., "content": ...}
+                      {"action": "delete", "message_id": ...}
+                      {"action": "read"}
+                      {"action": "typing", "is_typing": true | false}
+                      {"action": "heartbeat"}
+    Server -> client: {"type": "message" | "update", ...message fields}
+                      {"type": "typing", "user_id": ..., "is_typing": ...}
+                      {"type": "presence", "user_id": ..., "online": ...}
+                      {"type": "rate_limited", "retry_after": seconds, "client_id": ...}
+                      {"type": "error", "error": ..., "client_ids": [...]}
+
+    Sends are buffered for CHAT_WS_FLUSH_MS and written in one batch. They
+    draw from the same per-user and per-room buckets as the HTTP API; after
+    RATELIMIT_WS_MAX_STRIKES rejected sends in a row the socket is closed
+    with 4029 (the client falls back to polling and reconnects later).
+    """
 
-class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        self.room_name = self.scope['url_route']['kwargs']['room_name']
-        self.room_group_name = 'chat_%s' % self.room_name
+        self.user = self.scope.get('user')
+        if self.user is None or not self.user.is_authenticated:
+            await self.close(code=4401)
+            return
+
+        self.participant = await self.get_participant(int(self.scope['url_route']['kwargs']['room_id']))
+        if self.participant is None:
+            self.room = None
+            await self.close(code=4403)
+            return
+        self.room = self.participant.room
+
+        self.room_group_name = services.room_group(self.room.id)
+        self.other_user_id = services.other_participant_id(self.room, self.user.id)
+        self.pending = []
+        self.flush_handle = None
+        self.strikes = 0
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
 
+        await self.presence_connect(self.user.id)
+        await self.send_presence()
+        await self.announce_presence(True)
+
     async def disconnect(self, close_code):
+        if getattr(self, 'room', None) is None:
+            return
+        if self.flush_handle:
+            self.flush_handle.cancel()
+        await self.flush()
+        await self.presence_disconnect()
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        # Other tabs or the notification socket may still keep this user online
+        await self.announce_presence(await self.is_online(self.user.id))
 
     async def receive(self, text_data):
-        data = json.loads(text_data)
-        message = data['message']
-        username = data['username']
-
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': message,
-                'username': username
-            }
-        )
+        try:
+            data = json.loads(text_data)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            await self.send_error("Expected a JSON object.")
+            return
+        action = data.get('action', 'send')
+
+        if action == 'send':
+            content = (data.get('content') or '').strip()[:MAX_MESSAGE_LENGTH]
+            if content and await self.allow_send(data.get('client_id')):
+                self.pending.append((content, data.get('client_id')))
+                if len(self.pending) >= settings.CHAT_WS_BATCH_SIZE:
+                    await self.flush()
+                elif self.flush_handle is None:
+                    self.flush_handle = asyncio.ensure_future(self.flush_later())
+
+        elif action == 'edit':
+            content = (data.get('content') or '').strip()[:MAX_MESSAGE_LENGTH]
+            message_id = await self.message_id(data)
+            if content and message_id is not None:
+                await self.update_message(message_id, content)
+
+        elif action == 'delete':
+            message_id = await self.message_id(data)
+            if message_id is not None:
+                await self.update_message(message_id, None)
+
+        elif action == 'read':
+            await database_sync_to_async(services.mark_read)(self.room, self.user)
 
+        elif action == 'typing':
+            if not (await aconsume('chat_typing', self.user.id))[0]:
+                return
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'chat.typing', 'user_id': self.user.id, 'is_typing': bool(data.get('is_typing', True)),
+            })
+
+        elif action == 'heartbeat':
+            # The reply doubles as a presence refresh for the other participant
+            await self.presence_heartbeat()
+            await self.send_presence()
+
+    async def allow_send(self, client_id=None):
+        allowed, retry_after = await aconsume('chat_send_user', self.user.id)
+        if allowed:
+            allowed, retry_after = await aconsume('chat_send_room', self.room.id)
+            if not allowed:
+                # The send is dropped, so it doesn't count against the user
+                await arefund('chat_send_user', self.user.id)
+        if allowed:
+            self.strikes = 0
+            return True
+
+        self.strikes += 1
+        if self.strikes >= settings.RATELIMIT_WS_MAX_STRIKES:
+            await self.close(code=4029)
+        else:
+            # The client puts the rejected text back in its input
+            await self.send(text_data=json.dumps({
+                'type': 'rate_limited', 'retry_after': round(retry_after, 1), 'client_id': client_id,
+            }))
+        return False
+
+    async def message_id(self, data):
+        try:
+            return int(data.get('message_id'))
+        except (TypeError, ValueError):
+            await self.send_error("message_id must be a number.")
+            return None
+
+    async def send_error(self, error, **extra):
+        await self.send(text_data=json.dumps(dict(extra, type='error', error=error)))
+
+    async def flush_later(self):
+        # Runs as a detached task: nothing awaits it, so errors must not escape
+        try:
+            await asyncio.sleep(settings.CHAT_WS_FLUSH_MS / 1000)
+            self.flush_handle = None
+            await self.flush()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Delayed chat flush failed in room %s", self.room.id)
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        contents = [content for content, _ in batch]
+        client_ids = [client_id for _, client_id in batch]
+        try:
+            await database_sync_to_async(services.post_messages)(self.room, self.user, contents, client_ids)
+        except Exception:
+            logger.exception("Failed to store %d chat messages in room %s", len(batch), self.room.id)
+            # Tells the client which sends to retry (over HTTP if the socket is going away)
+            await self.send_error("Messages could not be sent.", client_ids=client_ids)
+
+    # --- Group events ---
     async def chat_message(self, event):
-        message = event['message']
-        username = event['username']
-        await self.send(text_data=json.dumps({'message': message, 'username': username}))
\ No newline at end of file
+        await self.send(text_data=json.dumps(dict(event, type='message')))
+
+    async def chat_update(self, event):
+        await self.send(text_data=json.dumps(dict(event, type='update')))
+
+    async def chat_typing(self, event):
+        if event['user_id'] != self.user.id:
+            await self.send(text_data=json.dumps(dict(event, type='typing')))
+
+    async def chat_presence(self, event):
+        if event['user_id'] != self.user.id:
+            await self.send(text_data=json.dumps(dict(event, type='presence')))
+
+    # --- Presence ---
+    async def send_presence(self):
+        online = await self.is_online(self.other_user_id)
+        await self.send(text_data=json.dumps({'type': 'presence', 'user_id': self.other_user_id, 'online': online}))
+
+    async def announce_presence(self, online):
+        await self.channel_layer.group_send(self.room_group_name, {
+            'type': 'chat.presence', 'user_id': self.user.id, 'online': online,
+        })
+
+    # --- DB helpers ---
+    @database_sync_to_async
+    def get_participant(self, room_id):
+        return services.get_participant(room_id, self.user)
+
+    @database_sync_to_async
+    def update_message(self, message_id, content):
+        msg = self.room.messages.filter(id=message_id, sender=self.user).first()
+        if msg is None or msg.is_deleted_everyone:
+            return
+        if content is None:
+            services.delete_for_everyone(msg)
+        else:
+            services.edit_message(msg, content)
@@ -0,0 +1,45 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.archive import archive_room, default_codec
+from chat.models import Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves chat messages older than CHAT_ARCHIVE_AFTER_DAYS into compressed per-room "
+        "segments (see chat.archive). Safe to re-run; each run appends new segments."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CHAT_ARCHIVE_AFTER_DAYS,
+                            help="Archive messages older than this many days.")
+        parser.add_argument('--segment-size', type=int, default=settings.CHAT_ARCHIVE_SEGMENT_SIZE)
+        parser.add_argument('--pause', type=float, default=0, help="Seconds to sleep between rooms.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be archived.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        cold = Message.objects.filter(timestamp__lt=cutoff)
+        self.stdout.write(f"Archiving messages older than {cutoff:%Y-%m-%d %H:%M} ({default_codec()})")
+
+        if options['dry_run']:
+            rooms = cold.values('room_id').distinct().count()
+            self.stdout.write(f"Dry run: {cold.count()} messages in {rooms} rooms would be archived.")
+            return
+
+        started = time.monotonic()
+        room_ids = list(cold.values_list('room_id', flat=True).distinct().order_by('room_id'))
+        archived = 0
+        for room_id in room_ids:
+            archived += archive_room(room_id, cutoff, segment_size=options['segment_size'])
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} messages from {len(room_ids)} rooms in {time.monotonic() - started:.1f}s."
+        ))
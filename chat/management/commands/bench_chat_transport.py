@@ -0,0 +1,115 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from chat import services
+from chat.models import ChatParticipant, ChatRoom, Message
+from chat.views import sync_messages
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Estimates database queries per second for N open chat rooms: HTTP polling "
+        "(sync endpoint every interval) versus the WebSocket consumer. Runs inside a "
+        "transaction that is rolled back, so it is safe against a dev database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=1000)
+        parser.add_argument('--tabs-per-room', type=int, default=2, help="Open chat tabs per room (both participants).")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds between polls (room.html fallback).")
+        parser.add_argument('--messages-per-minute', type=float, default=1.0, help="Messages sent per room per minute.")
+        parser.add_argument('--history', type=int, default=20, help="Messages pre-loaded per room.")
+        parser.add_argument('--samples', type=int, default=200, help="Polls/sends actually executed to measure cost.")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic(), override_settings(NOTIFICATION_OUTBOX_SYNC=False):
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        n_rooms = options['rooms']
+        self.stdout.write(f"Creating {n_rooms} rooms with {options['history']} messages each...")
+
+        users = User.objects.bulk_create([User(username=f"bench_{i}_{rng.random():.8f}") for i in range(n_rooms * 2)])
+        rooms = ChatRoom.objects.bulk_create([
+            ChatRoom(participant_1=users[2 * i], participant_2=users[2 * i + 1]) for i in range(n_rooms)
+        ])
+        ChatParticipant.objects.bulk_create([
+            ChatParticipant(room=room, user_id=user_id)
+            for room in rooms for user_id in (room.participant_1_id, room.participant_2_id)
+        ])
+        old = timezone.now() - timedelta(hours=1)
+        Message.objects.bulk_create([
+            Message(room=room, sender_id=rng.choice([room.participant_1_id, room.participant_2_id]), content="Price per kg?", seq=seq, created_seq=seq)
+            for room in rooms for seq in range(1, options['history'] + 1)
+        ], batch_size=5000)
+        ChatRoom.objects.filter(id__in=[room.id for room in rooms]).update(last_seq=options['history'])
+        Message.objects.filter(room__in=rooms).update(timestamp=old, updated_at=old)
+
+        sample_rooms = rng.sample(rooms, min(options['samples'], n_rooms))
+        factory = RequestFactory()
+
+        # --- Polling: idle polls and polls that pick up one new message ---
+        poll_queries, poll_seconds = [], []
+        for room in sample_rooms:
+            sender = User(id=room.participant_1_id, username='sender')
+            reader = User(id=room.participant_2_id, username='reader')
+            cursor = ChatRoom.objects.filter(id=room.id).values_list('last_seq', flat=True).get()
+            if rng.random() < options['messages_per_minute'] * options['poll_interval'] / 60:
+                services.post_message(room, sender, "New offer")
+
+            request = factory.get('/', {'after': cursor})
+            request.user = reader
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as ctx:
+                sync_messages(request, room.id)
+            poll_seconds.append(time.perf_counter() - started)
+            poll_queries.append(len(ctx))
+
+        # --- WebSocket: idle sockets cost nothing; each send is one batched write + a read receipt ---
+        send_queries = []
+        for room in sample_rooms:
+            sender = User(id=room.participant_1_id, username='sender')
+            reader = User(id=room.participant_2_id, username='reader')
+            with CaptureQueriesContext(connection) as ctx:
+                services.post_messages(room, sender, ["Can ship in March"])
+                services.mark_read(room, reader)
+            send_queries.append(len(ctx))
+
+        avg_poll_q = sum(poll_queries) / len(poll_queries)
+        avg_poll_ms = 1000 * sum(poll_seconds) / len(poll_seconds)
+        avg_send_q = sum(send_queries) / len(send_queries)
+
+        polls_per_sec = n_rooms * options['tabs_per_room'] / options['poll_interval']
+        sends_per_sec = n_rooms * options['messages_per_minute'] / 60
+
+        poll_qps = polls_per_sec * avg_poll_q
+        ws_qps = sends_per_sec * avg_send_q
+
+        self.stdout.write("")
+        self.stdout.write(f"Rooms: {n_rooms}, tabs/room: {options['tabs_per_room']}, "
+                          f"poll every {options['poll_interval']}s, {options['messages_per_minute']} msg/room/min")
+        self.stdout.write(f"  Polling   : {polls_per_sec:8.0f} req/s x {avg_poll_q:.2f} queries = {poll_qps:8.0f} queries/s "
+                          f"({avg_poll_ms:.1f} ms/poll, {polls_per_sec * avg_poll_ms / 1000:.1f} worker-seconds/s)")
+        self.stdout.write(f"  WebSocket : {sends_per_sec:8.1f} msg/s x {avg_send_q:.2f} queries = {ws_qps:8.1f} queries/s")
+        if ws_qps:
+            self.stdout.write(self.style.SUCCESS(f"  WebSocket issues {poll_qps / ws_qps:.0f}x fewer queries."))
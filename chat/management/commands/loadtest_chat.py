@@ -0,0 +1,308 @@
+import asyncio
+import gc
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from channels.layers import channel_layers
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from chat.models import ChatParticipant, ChatRoom
+
+User = get_user_model()
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def redis_layer(url):
+    return {'default': {'BACKEND': 'channels_redis.core.RedisChannelLayer', 'CONFIG': {'hosts': [url]}}}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class InProcessClient:
+    """ChatConsumer driven through coffee_core.asgi.application, no network."""
+
+    def __init__(self, room_id, user):
+        from coffee_core.asgi import application
+        self.communicator = WebsocketCommunicator(application, f'/ws/chat/{room_id}/')
+        self.communicator.scope['user'] = user
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=10)
+        return connected
+
+    async def send_json(self, data):
+        await self.communicator.send_json_to(data)
+
+    async def receive_json(self, timeout):
+        return await self.communicator.receive_json_from(timeout=timeout)
+
+    async def disconnect(self):
+        await self.communicator.disconnect()
+
+
+class SocketClient:
+    """Real WebSocket against a running server (daphne/uvicorn), authenticated by a session cookie."""
+
+    def __init__(self, base_url, room_id, cookie):
+        self.url = f"{base_url.rstrip('/')}/ws/chat/{room_id}/"
+        self.cookie = cookie
+        self.socket = None
+
+    async def connect(self):
+        import websockets
+        headers = {'Cookie': self.cookie}
+        try:
+            self.socket = await websockets.connect(self.url, additional_headers=headers)
+        except TypeError:  # websockets < 14
+            self.socket = await websockets.connect(self.url, extra_headers=headers)
+        return True
+
+    async def send_json(self, data):
+        await self.socket.send(json.dumps(data))
+
+    async def receive_json(self, timeout):
+        return json.loads(await asyncio.wait_for(self.socket.recv(), timeout))
+
+    async def disconnect(self):
+        await self.socket.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "WebSocket load test: opens N rooms x M sockets against ChatConsumer and reports "
+        "connect rate, fan-out latency percentiles and memory per connection. Runs in process "
+        "through the ASGI app (WebsocketCommunicator) by default, or against a running server "
+        "with --url. Users and rooms are created with a unique prefix and deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=100)
+        parser.add_argument('--clients-per-room', type=int, default=2,
+                            help="Sockets per room, alternating between the two participants (extra = more tabs).")
+        parser.add_argument('--messages', type=int, default=20, help="Messages sent per room during the fan-out phase.")
+        parser.add_argument('--concurrency', type=int, default=200, help="Connects in flight at once.")
+        parser.add_argument('--timeout', type=float, default=10.0, help="Seconds to wait for each fan-out frame.")
+        parser.add_argument('--layer', choices=['memory', 'redis', 'both'], default='memory',
+                            help="Channel layer for in-process runs.")
+        parser.add_argument('--redis-url', default=None,
+                            help="Redis for the redis layer (default: REDIS_URL, else launch a local redis-server).")
+        parser.add_argument('--url', default=None,
+                            help="ws://host:port of a running server; uses real sockets (needs the websockets package).")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if options['rooms'] < 1 or options['clients_per_room'] < 1:
+            raise CommandError("--rooms and --clients-per-room must be positive.")
+        if options['url']:
+            try:
+                import websockets  # noqa: F401
+            except ImportError:
+                raise CommandError("--url needs the websockets package (pip install websockets).")
+
+        prefix = f"loadtest_{random.Random(options['seed']).randrange(16 ** 8):08x}_"
+        self.stdout.write(f"Creating {options['rooms']} rooms ({prefix}*)...")
+        rooms = self.create_rooms(prefix, options['rooms'])
+        try:
+            if options['url']:
+                result = asyncio.run(self.run(self.socket_clients(rooms, options), options, measure_memory=False))
+                self.report(f"sockets @ {options['url']}", result, options)
+                return
+
+            layers = ['memory', 'redis'] if options['layer'] == 'both' else [options['layer']]
+            for layer in layers:
+                with self.channel_layer(layer, options) as config, override_settings(
+                    CHANNEL_LAYERS=config,
+                    PRESENCE_BACKEND='core.presence.MemoryPresence',
+                    RATELIMIT_ENABLED=False,
+                    NOTIFICATION_OUTBOX_SYNC=False,
+                ):
+                    channel_layers.backends.clear()
+                    try:
+                        result = asyncio.run(self.run(self.in_process_clients(rooms, options), options))
+                    finally:
+                        channel_layers.backends.clear()
+                self.report(layer, result, options)
+        finally:
+            User.objects.filter(username__startswith=prefix).delete()
+
+    # --- Fixtures ---
+    def create_rooms(self, prefix, n_rooms):
+        # Ascending ids, so (2i, 2i+1) is already the canonical pair order
+        users = User.objects.bulk_create([User(username=f"{prefix}{i}") for i in range(n_rooms * 2)])
+        rooms = ChatRoom.objects.bulk_create([
+            ChatRoom(participant_1=users[2 * i], participant_2=users[2 * i + 1]) for i in range(n_rooms)
+        ])
+        ChatParticipant.objects.bulk_create([
+            ChatParticipant(room=room, user_id=user_id)
+            for room in rooms for user_id in (room.participant_1_id, room.participant_2_id)
+        ])
+        return rooms
+
+    def in_process_clients(self, rooms, options):
+        return [
+            [InProcessClient(room.id, (room.participant_1, room.participant_2)[j % 2])
+             for j in range(options['clients_per_room'])]
+            for room in rooms
+        ]
+
+    def socket_clients(self, rooms, options):
+        cookies = {}
+        for room in rooms:
+            for user in (room.participant_1, room.participant_2):
+                session = SessionStore()
+                session[SESSION_KEY] = str(user.pk)
+                session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+                session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+                session.create()
+                cookies[user.pk] = f"{settings.SESSION_COOKIE_NAME}={session.session_key}"
+        return [
+            [SocketClient(options['url'], room.id, cookies[(room.participant_1_id, room.participant_2_id)[j % 2]])
+             for j in range(options['clients_per_room'])]
+            for room in rooms
+        ]
+
+    @contextmanager
+    def channel_layer(self, layer, options):
+        if layer == 'memory':
+            yield IN_MEMORY_LAYER
+            return
+        url = options['redis_url'] or os.environ.get('REDIS_URL')
+        if url:
+            yield redis_layer(url)
+            return
+        with self.launch_redis() as url:
+            yield redis_layer(url)
+
+    @contextmanager
+    def launch_redis(self):
+        binary = shutil.which('redis-server')
+        if binary is None:
+            raise CommandError("No redis-server on PATH; pass --redis-url or set REDIS_URL.")
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        process = subprocess.Popen(
+            [binary, '--port', str(port), '--bind', '127.0.0.1', '--save', '', '--appendonly', 'no'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            import redis
+            client = redis.Redis(port=port)
+            for _ in range(50):
+                try:
+                    client.ping()
+                    break
+                except redis.ConnectionError:
+                    time.sleep(0.1)
+            else:
+                raise CommandError("redis-server did not start.")
+            self.stdout.write(f"Launched redis-server on port {port}")
+            yield f"redis://127.0.0.1:{port}/0"
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+    # --- Run ---
+    async def run(self, room_clients, options, measure_memory=True):
+        clients = [client for group in room_clients for client in group]
+        gate = asyncio.Semaphore(options['concurrency'])
+
+        async def connect(client):
+            async with gate:
+                try:
+                    return await client.connect()
+                except Exception:
+                    return False
+
+        if measure_memory:
+            gc.collect()
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+
+        started = time.perf_counter()
+        connected = await asyncio.gather(*(connect(client) for client in clients))
+        connect_seconds = time.perf_counter() - started
+
+        memory_per_connection = None
+        if measure_memory:
+            gc.collect()
+            memory_per_connection = (tracemalloc.get_traced_memory()[0] - baseline) / max(1, sum(connected))
+            tracemalloc.stop()  # Tracing would inflate the latencies below
+
+        failed = len(connected) - sum(connected)
+        if failed:
+            raise CommandError(f"{failed} of {len(clients)} sockets failed to connect.")
+
+        # Presence frames from the connect phase are skipped by wait_for()
+        latencies, timeouts = [], 0
+        fanout_started = time.perf_counter()
+        for n in range(options['messages']):
+            rounds = await asyncio.gather(*(
+                self.fan_out(group, n, options['timeout']) for group in room_clients
+            ))
+            for room_latencies, room_timeouts in rounds:
+                latencies.extend(room_latencies)
+                timeouts += room_timeouts
+        fanout_seconds = time.perf_counter() - fanout_started
+
+        await asyncio.gather(*(client.disconnect() for client in clients), return_exceptions=True)
+        return {
+            'connections': len(clients),
+            'connect_seconds': connect_seconds,
+            'memory_per_connection': memory_per_connection,
+            'latencies': latencies,
+            'timeouts': timeouts,
+            'fanout_seconds': fanout_seconds,
+        }
+
+    async def fan_out(self, group, n, timeout):
+        """One message from a rotating sender; time until every socket in the room has it."""
+        token = f"lt-{id(group)}-{n}"
+        sender = group[n % len(group)]
+        started = time.perf_counter()
+        await sender.send_json({'action': 'send', 'content': f"Load test {n}", 'client_id': token})
+
+        async def wait_for(client):
+            while True:
+                event = await client.receive_json(timeout)
+                if event.get('type') == 'message' and event.get('client_id') == token:
+                    return time.perf_counter() - started
+
+        results = await asyncio.gather(*(wait_for(client) for client in group), return_exceptions=True)
+        latencies = [result for result in results if isinstance(result, float)]
+        return latencies, len(results) - len(latencies)
+
+    def report(self, label, result, options):
+        latencies = [1000 * seconds for seconds in result['latencies']]
+        deliveries = len(latencies)
+        self.stdout.write("")
+        self.stdout.write(f"[{label}] {options['rooms']} rooms x {options['clients_per_room']} clients "
+                          f"= {result['connections']} sockets, {options['messages']} msg/room")
+        self.stdout.write(f"  Connect   : {result['connections'] / result['connect_seconds']:8.0f} conn/s "
+                          f"({result['connect_seconds']:.2f}s total)")
+        if result['memory_per_connection'] is not None:
+            self.stdout.write(f"  Memory    : {result['memory_per_connection'] / 1024:8.1f} KiB/connection (tracemalloc)")
+        self.stdout.write(f"  Fan-out   : {deliveries} deliveries, {deliveries / result['fanout_seconds']:.0f}/s, "
+                          f"p50 {percentile(latencies, 50):.1f} ms, p95 {percentile(latencies, 95):.1f} ms, "
+                          f"p99 {percentile(latencies, 99):.1f} ms, max {max(latencies, default=0):.1f} ms "
+                          f"(includes CHAT_WS_FLUSH_MS={settings.CHAT_WS_FLUSH_MS})")
+        if result['timeouts']:
+            self.stdout.write(self.style.WARNING(f"  {result['timeouts']} deliveries timed out after {options['timeout']}s"))
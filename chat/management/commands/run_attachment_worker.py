@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.attachments import expire_uploads, make_previews
+
+
+class Command(BaseCommand):
+    help = "Generates chat attachment previews and drops abandoned uploads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds to sleep when nothing is pending.")
+        parser.add_argument('--once', action='store_true', help="Process what is pending now, then exit.")
+
+    def handle(self, *args, **options):
+        processed_total = 0
+        expired = expire_uploads()
+        self.stdout.write(f"Attachment worker started; dropped {expired} abandoned uploads.")
+        last_expiry = time.monotonic()
+
+        try:
+            while True:
+                processed = make_previews(options['batch_size'])
+                processed_total += processed
+                if processed:
+                    continue
+
+                if time.monotonic() - last_expiry > 3600:
+                    expire_uploads()
+                    last_expiry = time.monotonic()
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f"Worker stopped. Processed {processed_total} attachments."))
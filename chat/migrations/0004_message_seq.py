@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_seq(apps, schema_editor):
+    # Existing messages get 1..n per room in send order
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    for room in ChatRoom.objects.all().iterator():
+        batch = []
+        seq = 0
+        for msg in Message.objects.filter(room=room).order_by('timestamp', 'id').only('id').iterator():
+            seq += 1
+            msg.seq = seq
+            batch.append(msg)
+        Message.objects.bulk_update(batch, ['seq'], batch_size=1000)
+        ChatRoom.objects.filter(id=room.id).update(last_seq=seq)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_message_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_seq, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('room', 'seq'), name='unique_message_room_seq'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:51
+
+import django.db.models.deletion
+from collections import defaultdict
+from django.conf import settings
+from django.db import migrations, models
+
+
+def hidden_by_to_watermarks(apps, schema_editor):
+    """
+    One ChatParticipant per (room, user). The longest run of hidden messages
+    from the start of a room becomes the cleared_before watermark; any other
+    hidden message ids go into hidden_ids.
+    """
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    ChatParticipant = apps.get_model('chat', 'ChatParticipant')
+    Message = apps.get_model('chat', 'Message')
+    Hidden = Message.hidden_by.through
+
+    hidden = defaultdict(set)
+    for room_id, user_id, message_id in Hidden.objects.values_list('message__room_id', 'user_id', 'message_id').iterator():
+        hidden[(room_id, user_id)].add(message_id)
+
+    participants = []
+    for room in ChatRoom.objects.all().iterator():
+        user_ids = {room.participant_1_id, room.participant_2_id}
+        hidden_here = {user_id: hidden.get((room.id, user_id)) for user_id in user_ids}
+        message_ids = None
+
+        for user_id in user_ids:
+            hidden_ids = hidden_here[user_id]
+            cleared_before = 0
+            if hidden_ids:
+                if message_ids is None:
+                    message_ids = list(Message.objects.filter(room_id=room.id).order_by('id').values_list('id', flat=True))
+                cleared_before = message_ids[-1] + 1
+                for message_id in message_ids:
+                    if message_id not in hidden_ids:
+                        cleared_before = message_id
+                        break
+                hidden_ids = sorted(i for i in hidden_ids if i >= cleared_before)
+            participants.append(ChatParticipant(
+                room_id=room.id, user_id=user_id, cleared_before=cleared_before, hidden_ids=hidden_ids or [],
+            ))
+
+        if len(participants) >= 1000:
+            ChatParticipant.objects.bulk_create(participants)
+            participants = []
+    ChatParticipant.objects.bulk_create(participants)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_message_seq'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatParticipant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cleared_before', models.BigIntegerField(default=0)),
+                ('hidden_ids', models.JSONField(blank=True, default=list)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participants', to='chat.chatroom')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_participations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('room', 'user'), name='unique_chat_participant')],
+            },
+        ),
+        migrations.RunPython(hidden_by_to_watermarks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='message',
+            name='hidden_by',
+        ),
+    ]
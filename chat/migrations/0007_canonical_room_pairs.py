@@ -0,0 +1,109 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:54
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def merge_duplicate_rooms(apps, schema_editor):
+    """
+    Folds every duplicate room for a pair into the oldest one, then stores all
+    pairs as (low id, high id). Per merged room:
+    - messages move over and are renumbered 1..n in (timestamp, id) order;
+    - participant rows merge: the lowest clear watermark wins, and messages
+      that were below a higher watermark in their old room go into hidden_ids;
+    - coalesced notifications (one per recipient and room) are summed.
+    """
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    ChatParticipant = apps.get_model('chat', 'ChatParticipant')
+    Message = apps.get_model('chat', 'Message')
+    Notification = apps.get_model('core', 'Notification')
+    NotificationOutbox = apps.get_model('core', 'NotificationOutbox')
+
+    pairs = defaultdict(list)
+    for room in ChatRoom.objects.order_by('id').iterator():
+        pairs[tuple(sorted([room.participant_1_id, room.participant_2_id]))].append(room)
+
+    for (low, high), rooms in pairs.items():
+        keep, duplicates = rooms[0], rooms[1:]
+        if duplicates:
+            merge_rooms(keep, duplicates, ChatRoom, ChatParticipant, Message, Notification, NotificationOutbox)
+        if (keep.participant_1_id, keep.participant_2_id) != (low, high):
+            ChatRoom.objects.filter(id=keep.id).update(participant_1_id=low, participant_2_id=high)
+
+
+def merge_rooms(keep, duplicates, ChatRoom, ChatParticipant, Message, Notification, NotificationOutbox):
+    room_ids = [keep.id] + [room.id for room in duplicates]
+    dup_ids = room_ids[1:]
+
+    # Participants: remember each old room's watermark before the messages move
+    by_user = defaultdict(list)
+    for participant in ChatParticipant.objects.filter(room_id__in=room_ids):
+        by_user[participant.user_id].append(participant)
+
+    merged = []
+    for user_id, rows in by_user.items():
+        cleared_before = min(row.cleared_before for row in rows)
+        hidden = set()
+        for row in rows:
+            hidden.update(row.hidden_ids)
+            if row.cleared_before > cleared_before:
+                hidden.update(Message.objects.filter(
+                    room_id=row.room_id, id__gte=cleared_before, id__lt=row.cleared_before,
+                ).values_list('id', flat=True))
+        merged.append(ChatParticipant(
+            room_id=keep.id, user_id=user_id, cleared_before=cleared_before,
+            hidden_ids=sorted(i for i in hidden if i >= cleared_before),
+        ))
+    ChatParticipant.objects.filter(room_id__in=room_ids).delete()
+    ChatParticipant.objects.bulk_create(merged)
+
+    # Messages: park seqs on -id so the move cannot collide, then renumber
+    Message.objects.filter(room_id__in=room_ids).update(seq=-models.F('id'), room_id=keep.id)
+    batch = []
+    for seq, msg in enumerate(Message.objects.filter(room_id=keep.id).order_by('timestamp', 'id').only('id').iterator(), 1):
+        msg.seq = seq
+        batch.append(msg)
+    Message.objects.bulk_update(batch, ['seq'], batch_size=1000)
+    updated_at = max(room.updated_at for room in [keep] + duplicates)
+    ChatRoom.objects.filter(id=keep.id).update(last_seq=len(batch), updated_at=updated_at)
+
+    # Notifications: at most one per (recipient, room)
+    for notification in Notification.objects.filter(room_id__in=dup_ids).order_by('created_at'):
+        existing = Notification.objects.filter(recipient_id=notification.recipient_id, room_id=keep.id).first()
+        if existing is None:
+            notification.room_id = keep.id
+            notification.save(update_fields=['room'])
+            continue
+        if notification.created_at > existing.created_at:
+            existing.created_at = notification.created_at
+            existing.message = notification.message
+        existing.event_count += notification.event_count
+        existing.is_read = existing.is_read and notification.is_read
+        existing.save(update_fields=['created_at', 'message', 'event_count', 'is_read'])
+        notification.delete()
+    NotificationOutbox.objects.filter(room_id__in=dup_ids).update(room_id=keep.id)
+
+    ChatRoom.objects.filter(id__in=dup_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_history_index'),
+        ('core', '0004_coalesced_room_notifications'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_rooms, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(fields=('participant_1', 'participant_2'), name='unique_chat_pair'),
+        ),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.CheckConstraint(condition=models.Q(('participant_1__lte', models.F('participant_2'))), name='chat_pair_canonical_order'),
+        ),
+    ]
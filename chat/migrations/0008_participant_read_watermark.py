@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:56
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def is_read_to_watermarks(apps, schema_editor):
+    # A reader has seen everything before the first unread message the other side sent
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    ChatParticipant = apps.get_model('chat', 'ChatParticipant')
+    Message = apps.get_model('chat', 'Message')
+    for room in ChatRoom.objects.all().iterator():
+        for participant in ChatParticipant.objects.filter(room_id=room.id):
+            first_unread = Message.objects.filter(room_id=room.id, is_read=False).exclude(
+                sender_id=participant.user_id,
+            ).aggregate(seq=Min('seq'))['seq']
+            last_read_seq = room.last_seq if first_unread is None else first_unread - 1
+            ChatParticipant.objects.filter(id=participant.id).update(last_read_seq=last_read_seq)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_canonical_room_pairs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='last_read_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(is_read_to_watermarks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:05
+
+from django.db import migrations
+
+# PostgreSQL only (see chat/search.py). The column lives outside the model
+# state, so SQLite and other backends keep the plain table.
+FORWARD = [
+    "ALTER TABLE chat_message ADD COLUMN search_vector tsvector",
+    "UPDATE chat_message SET search_vector = to_tsvector('pg_catalog.english', content)",
+    "CREATE INDEX chat_message_search_idx ON chat_message USING GIN (search_vector)",
+    """
+    CREATE TRIGGER chat_message_search_update
+    BEFORE INSERT OR UPDATE OF content ON chat_message
+    FOR EACH ROW EXECUTE FUNCTION tsvector_update_trigger(search_vector, 'pg_catalog.english', content)
+    """,
+]
+BACKWARD = [
+    "DROP TRIGGER IF EXISTS chat_message_search_update ON chat_message",
+    "ALTER TABLE chat_message DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def run(statements):
+    def apply(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_participant_read_watermark'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(FORWARD), run(BACKWARD)),
+    ]
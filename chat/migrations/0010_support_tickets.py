@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_message_search_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SupportTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('guest_name', models.CharField(blank=True, max_length=150)),
+                ('guest_email', models.CharField(blank=True, max_length=254)),
+                ('guest_phone', models.CharField(blank=True, max_length=50)),
+                ('source', models.CharField(default='contact_form', max_length=20)),
+                ('status', models.CharField(choices=[('open', 'Open'), ('closed', 'Closed')], default='open', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RemoveConstraint(
+            model_name='chatroom',
+            name='unique_chat_pair',
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='kind',
+            field=models.CharField(choices=[('direct', 'Direct'), ('ticket', 'Support Ticket')], default='direct', max_length=10),
+        ),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(condition=models.Q(('kind', 'direct')), fields=('participant_1', 'participant_2'), name='unique_chat_pair'),
+        ),
+        migrations.AddField(
+            model_name='supportticket',
+            name='agent',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='support_tickets', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='supportticket',
+            name='room',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='ticket', to='chat.chatroom'),
+        ),
+        migrations.AddIndex(
+            model_name='supportticket',
+            index=models.Index(fields=['agent', 'status'], name='ticket_agent_status_idx'),
+        ),
+    ]
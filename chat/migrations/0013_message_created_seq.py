@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_seq(apps, schema_editor):
+    # The original seq of messages edited before this migration is gone; their
+    # current seq is the best guess (at worst they show as unread once more)
+    Message = apps.get_model('chat', 'Message')
+    Message.objects.update(created_seq=models.F('seq'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_message_attachments'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='created_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(copy_seq, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'created_seq'], name='msg_room_created_seq_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+from django.db.models import F, Q
+
+
+def remove_viewer_participants(apps, schema_editor):
+    # Staff who opened a ticket they don't handle used to get a participant row
+    ChatParticipant = apps.get_model('chat', 'ChatParticipant')
+    ChatParticipant.objects.exclude(
+        Q(user_id=F('room__participant_1_id')) | Q(user_id=F('room__participant_2_id')),
+    ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_message_created_seq'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_viewer_participants, migrations.RunPython.noop),
+    ]
@@ -1,24 +1,243 @@
+import uuid
+
 from django.db import models
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+
+from .storage import attachment_storage
 
 class ChatRoom(models.Model):
+    DIRECT = 'direct'
+    TICKET = 'ticket'
+    KINDS = [
+        (DIRECT, 'Direct'),
+        (TICKET, 'Support Ticket'),
+    ]
+
+    # Stored in canonical order: participant_1 has the lower user id
     participant_1 = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chats_1')
     participant_2 = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chats_2')
     updated_at = models.DateTimeField(auto_now=True)
+    # Direct rooms are unique per pair; every support ticket gets its own room
+    kind = models.CharField(max_length=10, choices=KINDS, default=DIRECT)
+
+    # Highest sequence number handed out in this room (see Message.seq)
+    last_seq = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['participant_1', 'participant_2'], condition=Q(kind='direct'), name='unique_chat_pair',
+            ),
+            models.CheckConstraint(condition=Q(participant_1__lte=F('participant_2')), name='chat_pair_canonical_order'),
+        ]
+
+    @classmethod
+    def between(cls, user_a, user_b):
+        """
+        Returns (room, created) for the conversation between two users. Safe
+        under concurrent first messages: the loser of the INSERT race hits
+        unique_chat_pair and get_or_create falls back to reading the winner's row.
+        """
+        low, high = sorted([user_a.pk, user_b.pk])
+        return cls.objects.get_or_create(participant_1_id=low, participant_2_id=high, kind=cls.DIRECT)
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        if adding and self.participant_1_id > self.participant_2_id:
+            self.participant_1_id, self.participant_2_id = self.participant_2_id, self.participant_1_id
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                # Rooms created with bulk_create must add these rows themselves
+                ChatParticipant.objects.bulk_create([
+                    ChatParticipant(room=self, user_id=user_id)
+                    for user_id in {self.participant_1_id, self.participant_2_id}
+                ])
+
+    @classmethod
+    def allocate_seq(cls, room_id, count=1, **extra):
+        """
+        Reserves `count` consecutive sequence numbers and returns the first.
+        Must run inside a transaction: the UPDATE locks the room row until
+        commit, so concurrent writers get disjoint, increasing ranges.
+        `extra` fields are written in the same UPDATE.
+        """
+        cls.objects.filter(id=room_id).update(last_seq=F('last_seq') + count, **extra)
+        last_seq = cls.objects.filter(id=room_id).values_list('last_seq', flat=True).get()
+        return last_seq - count + 1
 
 class Message(models.Model):
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
     
     is_edited = models.BooleanField(default=False)
     is_deleted_everyone = models.BooleanField(default=False)
-    hidden_by = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='hidden_messages', blank=True)
     
     # NEW FIELD TO TRACK EDITS
     updated_at = models.DateTimeField(auto_now=True) 
 
+    # Per-room change sequence: a new value on create, edit and delete, so
+    # "everything after seq N" is one range scan on (room, seq)
+    seq = models.BigIntegerField(default=0)
+    # The seq the message was sent with; never changes. Unread counts and read
+    # ticks compare against this, so edits and deletes don't look like new messages
+    created_seq = models.BigIntegerField(default=0)
+
+    # Optional file; `content` holds its original name
+    attachment = models.ForeignKey('Attachment', on_delete=models.SET_NULL, null=True, blank=True, related_name='messages')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'seq'], name='unique_message_room_seq'),
+        ]
+        indexes = [
+            # History pages: keyset on (timestamp, id) within a room
+            models.Index(fields=['room', '-timestamp', '-id'], name='msg_room_history_idx'),
+            # Unread counts: messages sent after a reader's last_read_seq
+            models.Index(fields=['room', 'created_seq'], name='msg_room_created_seq_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # post_save queues the notification in the outbox; keep both in one transaction
+        with transaction.atomic():
+            self.seq = ChatRoom.allocate_seq(self.room_id)
+            if self._state.adding:
+                self.created_seq = self.seq
+            super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Message {self.id} from {self.sender}"
+
+
+class Attachment(models.Model):
+    """
+    A stored file, shared by every message that sent the same bytes (content
+    addressed by sha256). Previews are made by `run_attachment_worker`.
+    """
+    PREVIEW_STATUS = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('none', 'No preview'),
+        ('failed', 'Failed'),
+    ]
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='chat-attachments/', storage=attachment_storage, max_length=255)
+    size = models.BigIntegerField()
+    content_type = models.CharField(max_length=100)
+    preview = models.FileField(upload_to='chat-previews/', storage=attachment_storage, max_length=255, blank=True)
+    preview_status = models.CharField(max_length=10, choices=PREVIEW_STATUS, default='pending', db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def is_image(self):
+        return self.content_type.startswith('image/')
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes)"
+
+
+class AttachmentUpload(models.Model):
+    """
+    A resumable upload in progress. Chunks are appended to a spool file under
+    CHAT_ATTACHMENT_SPOOL_DIR; `received` is the committed offset the client
+    resumes from.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='uploads')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chat_uploads')
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} {self.received}/{self.size}"
+
+
+class ChatParticipant(models.Model):
+    """Per-user state for a room: what this participant has cleared, hidden and read."""
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='participants')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chat_participations')
+
+    # "Clear chat": messages with id < cleared_before are hidden for this user
+    cleared_before = models.BigIntegerField(default=0)
+    # "Delete for me": individual message ids at or above the watermark
+    hidden_ids = models.JSONField(default=list, blank=True)
+    # Read receipts: everything the other side sent up to this room seq has been seen
+    last_read_seq = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'user'], name='unique_chat_participant'),
+        ]
+
+    def visible(self, messages):
+        """Filters a message queryset of this room down to what the user can see."""
+        messages = messages.filter(id__gte=self.cleared_before)
+        if self.hidden_ids:
+            messages = messages.exclude(id__in=self.hidden_ids)
+        return messages
+
+    def __str__(self):
+        return f"{self.user_id} in room {self.room_id}"
+
+
+class SupportTicket(models.Model):
+    """One guest inquiry, answered by one agent in its own ticket room."""
+    STATUS = [
+        ('open', 'Open'),
+        ('closed', 'Closed'),
+    ]
+
+    room = models.OneToOneField(ChatRoom, on_delete=models.CASCADE, related_name='ticket')
+    agent = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='support_tickets')
+    guest_name = models.CharField(max_length=150, blank=True)
+    guest_email = models.CharField(max_length=254, blank=True)
+    guest_phone = models.CharField(max_length=50, blank=True)
+    source = models.CharField(max_length=20, default='contact_form')
+    status = models.CharField(max_length=10, choices=STATUS, default='open')
+    created_at = models.DateTimeField(auto_now_add=True)
+    closed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Open-ticket counts per agent (support routing)
+            models.Index(fields=['agent', 'status'], name='ticket_agent_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Ticket #{self.id} ({self.guest_name or 'guest'}) -> {self.agent_id}"
+
+
+class MessageArchiveSegment(models.Model):
+    """
+    Up to CHAT_ARCHIVE_SEGMENT_SIZE old messages of one room, compressed as
+    JSON lines (see chat.archive). Append-only. The range columns let history
+    pages find the segments they need without decompressing anything.
+    """
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='archive_segments')
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    message_count = models.PositiveIntegerField()
+    codec = models.CharField(max_length=10)
+    # Payload lives in the row, or in CHAT_ARCHIVE_STORAGE under `path`
+    data = models.BinaryField(blank=True, default=b'')
+    path = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', '-last_timestamp', '-last_id'], name='archive_room_range_idx'),
+        ]
+
     def __str__(self):
-        return f"Message {self.id} from {self.sender}"
\ No newline at end of file
+        return f"Room {self.room_id} messages {self.first_id}-{self.last_id} ({self.codec})"
@@ -0,0 +1,128 @@
+"""
+Full-text search over the messages a user can see.
+
+On PostgreSQL, Message has a `search_vector` tsvector column. It is kept
+current by a trigger on insert and on content edits, and it is GIN-indexed
+(migration 0009). The column is not declared on the model, so other
+databases never see it. Those databases fall back to icontains, newest first.
+
+Results are keyset-paginated with opaque cursors: "<rank>_<id>" for ranked
+Postgres results, and core.pagination's "<micros>_<id>" for the fallback.
+ts_rank returns a float4, which does not survive a round trip through a
+Python float and back. The rank is therefore scaled to an integer in SQL
+(RANK_SCALE), and both the cursor and the next page's filter compare that
+integer exactly, so tied ranks still page by id.
+"""
+from django.db import connection
+from django.db.models import BigIntegerField, F, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from core.pagination import encode_cursor, keyset_page
+from .models import ChatParticipant, Message
+
+SEARCH_CONFIG = 'english'
+MIN_QUERY_LENGTH = 2
+# Ranks are compared as round(ts_rank * RANK_SCALE)
+RANK_SCALE = 1_000_000
+
+# Highlight markers; the snippet is escaped first and these become <mark> tags
+START, STOP = '\x02', '\x03'
+
+
+def uses_tsvector():
+    return connection.vendor == 'postgresql'
+
+
+def searchable_messages(user):
+    """
+    Messages in the user's rooms that they can still see: above their clear
+    watermark, not hidden and not deleted for everyone.
+    """
+    hidden = set()
+    for hidden_ids in ChatParticipant.objects.filter(user=user).values_list('hidden_ids', flat=True):
+        hidden.update(hidden_ids)
+    messages = Message.objects.filter(
+        room__participants__user=user,
+        id__gte=F('room__participants__cleared_before'),
+        is_deleted_everyone=False,
+    )
+    if hidden:
+        messages = messages.exclude(id__in=hidden)
+    return messages
+
+
+def search_messages(user, query, after=None, size=20):
+    """
+    Returns (hits, next_cursor). Each hit gets .other_user, .snippet (safe HTML)
+    and .jump_cursor (pass as ?at= to chat_room to open the room at that message).
+    """
+    query = (query or '').strip()
+    if len(query) < MIN_QUERY_LENGTH:
+        return [], None
+    messages = searchable_messages(user).select_related('room__participant_1', 'room__participant_2')
+
+    if uses_tsvector():
+        hits, next_cursor = _ranked_page(messages, query, after, size)
+    else:
+        hits, next_cursor = keyset_page(messages.filter(content__icontains=query), 'timestamp', before=after, size=size)
+        for hit in hits:
+            hit.headline = _plain_headline(hit.content, query)
+
+    for hit in hits:
+        room = hit.room
+        hit.other_user = room.participant_2 if room.participant_1_id == user.id else room.participant_1
+        hit.snippet = _render_headline(hit.headline)
+        # History cursor that starts the room page at this message (inclusive)
+        hit.jump_cursor = encode_cursor(hit.timestamp, hit.id + 1)
+    return hits, next_cursor
+
+
+def _ranked_page(messages, query, after, size):
+    from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVectorField
+
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+    vector = RawSQL(f'{Message._meta.db_table}.search_vector', [], output_field=SearchVectorField())
+    messages = messages.alias(document=vector).filter(document=search_query).annotate(
+        rank=Cast(SearchRank(vector, search_query) * Value(RANK_SCALE), output_field=BigIntegerField()),
+        headline=SearchHeadline(
+            'content', search_query, config=SEARCH_CONFIG,
+            start_sel=START, stop_sel=STOP, max_words=30, min_words=10,
+        ),
+    )
+
+    position = _decode_rank_cursor(after)
+    if position:
+        rank, pk = position
+        messages = messages.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=pk))
+
+    hits = list(messages.order_by('-rank', '-id')[:size + 1])
+    next_cursor = None
+    if len(hits) > size:
+        hits = hits[:size]
+        next_cursor = f"{hits[-1].rank}_{hits[-1].id}"
+    return hits, next_cursor
+
+
+def _decode_rank_cursor(cursor):
+    try:
+        rank, pk = cursor.split('_', 1)
+        return int(rank), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _plain_headline(content, query, radius=60):
+    at = content.lower().find(query.lower())
+    if at < 0:
+        return content[:radius * 2]
+    start, end = max(at - radius, 0), at + len(query) + radius
+    stop = at + len(query)
+    headline = content[start:at] + START + content[at:stop] + STOP + content[stop:end]
+    return ('…' if start else '') + headline + ('…' if end < len(content) else '')
+
+
+def _render_headline(headline):
+    return mark_safe(escape(headline or '').replace(START, '<mark>').replace(STOP, '</mark>'))
@@ -0,0 +1,246 @@
+"""
+Chat write paths shared by the HTTP API and the WebSocket consumer.
+
+Every change is broadcast to the room's channel-layer group after commit, so
+open sockets see messages/edits/deletes no matter which transport made them.
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.urls import reverse
+from django.utils import timezone
+
+from core.outbox import enqueue_notifications
+from core.presence import online_user_ids
+from .models import ChatParticipant, ChatRoom, Message, MessageArchiveSegment
+
+logger = logging.getLogger(__name__)
+
+DELETED_TEXT = "🚫 This message was deleted."
+
+
+def room_group(room_id):
+    return f"chat_{room_id}"
+
+
+def get_participant(room_id, user):
+    """
+    The user's ChatParticipant row (with .room loaded) if they belong to the
+    room, else None. Doubles as the membership check: one query.
+    """
+    return ChatParticipant.objects.select_related('room').filter(room_id=room_id, user=user).first()
+
+
+def inbox(user):
+    """
+    The user's conversations, newest first, from one query: both participants
+    joined, the latest visible message via subqueries and the unread count via
+    a conditional COUNT. Messages the user hid ("delete for me") are left out
+    of both; their ids come from one small query first. Each row gets
+    `.other_user` and `.is_online` (one presence round trip for all partners,
+    no database query).
+    """
+    hidden = set()
+    for hidden_ids in ChatParticipant.objects.filter(user=user).values_list('hidden_ids', flat=True):
+        hidden.update(hidden_ids)
+
+    last = Message.objects.filter(
+        room_id=OuterRef('room_id'), id__gte=OuterRef('cleared_before'),
+    ).exclude(id__in=hidden).order_by('-id')
+    unread = Q(
+        room__messages__created_seq__gt=F('last_read_seq'),
+        room__messages__is_deleted_everyone=False,
+        room__messages__id__gte=F('cleared_before'),
+    ) & ~Q(room__messages__sender=user) & ~Q(room__messages__id__in=hidden)
+
+    rows = list(
+        ChatParticipant.objects.filter(user=user)
+        .select_related('room__participant_1', 'room__participant_2', 'room__ticket')
+        .annotate(
+            last_content=Subquery(last.values('content')[:1]),
+            last_sender_id=Subquery(last.values('sender_id')[:1]),
+            last_timestamp=Subquery(last.values('timestamp')[:1]),
+            unread_count=Count('room__messages', filter=unread),
+        )
+        .order_by('-room__updated_at')
+    )
+    for row in rows:
+        room = row.room
+        row.other_user = room.participant_2 if room.participant_1_id == user.id else room.participant_1
+    online = online_user_ids([row.other_user.id for row in rows])
+    for row in rows:
+        row.is_online = row.other_user.id in online
+    return rows
+
+
+def other_participant_id(room, user_id):
+    return room.participant_2_id if user_id == room.participant_1_id else room.participant_1_id
+
+
+def message_payload(msg):
+    return {
+        'id': msg.id,
+        'seq': msg.seq,
+        'sender_id': msg.sender_id,
+        'content': msg.content,
+        'time': timezone.localtime(msg.timestamp).strftime("%H:%M"),
+        'is_deleted': msg.is_deleted_everyone,
+        'is_edited': msg.is_edited,
+        'attachment': attachment_payload(msg.attachment) if msg.attachment_id else None,
+    }
+
+
+def attachment_payload(attachment):
+    return {
+        'url': attachment.file.url,
+        'size': attachment.size,
+        'content_type': attachment.content_type,
+        'preview_url': attachment.preview.url if attachment.preview_status == 'ready' else None,
+    }
+
+
+def broadcast(room_id, event):
+    """Sends `event` to the room group once the current transaction commits."""
+    def send():
+        layer = get_channel_layer()
+        if layer is None:
+            return
+        try:
+            async_to_sync(layer.group_send)(room_group(room_id), event)
+        except Exception:
+            # Sockets are best effort; polling clients still get the change
+            logger.exception("Failed to broadcast to room %s", room_id)
+
+    transaction.on_commit(send)
+
+
+def room_link(room, sender_id):
+    """Where a notification about a message in `room` should take the recipient."""
+    if room.kind == ChatRoom.TICKET:
+        return reverse('support_ticket', args=[room.id])
+    return reverse('chat_room', args=[sender_id])
+
+
+def message_notification(msg, room, sender):
+    """Outbox item for a new chat message (coalesced per recipient and room)."""
+    return {
+        'recipient_id': other_participant_id(room, sender.id),
+        'sender_id': sender.id,
+        'notification_type': 'message',
+        'message': f"New message from {sender.username}",
+        'link': room_link(room, sender.id),
+        'room_id': room.id,
+    }
+
+
+def post_messages(room, sender, contents, client_ids=None, attachments=None):
+    """
+    Stores several messages from one sender in one transaction (one INSERT for
+    the messages, one for their notifications) and broadcasts them.
+    """
+    client_ids = client_ids or [None] * len(contents)
+    attachments = attachments or [None] * len(contents)
+    with transaction.atomic():
+        # One UPDATE reserves the seq range and bumps the inbox ordering
+        first_seq = ChatRoom.allocate_seq(room.id, len(contents), updated_at=timezone.now())
+        msgs = Message.objects.bulk_create([
+            Message(
+                room=room, sender=sender, content=content, seq=first_seq + i, created_seq=first_seq + i,
+                attachment=attachment,
+            )
+            for i, (content, attachment) in enumerate(zip(contents, attachments))
+        ])
+        # bulk_create skips post_save, so queue the notifications here
+        enqueue_notifications([message_notification(msg, room, sender) for msg in msgs])
+
+        for msg, client_id in zip(msgs, client_ids):
+            broadcast(room.id, dict(message_payload(msg), type='chat.message', client_id=client_id))
+    return msgs
+
+
+def post_message(room, sender, content, client_id=None, attachment=None):
+    return post_messages(room, sender, [content], [client_id], [attachment])[0]
+
+
+def edit_message(msg, content):
+    msg.content = content
+    msg.is_edited = True
+    msg.save()  # This updates 'updated_at' automatically
+    broadcast(msg.room_id, dict(message_payload(msg), type='chat.update'))
+    return msg
+
+
+def delete_for_everyone(msg):
+    msg.is_deleted_everyone = True
+    msg.content = DELETED_TEXT
+    msg.save()
+    broadcast(msg.room_id, dict(message_payload(msg), type='chat.update'))
+    return msg
+
+
+def changes_since(participant, after, limit):
+    """
+    Messages created, edited or deleted after sequence `after`, oldest first,
+    from one range scan on (room, seq). Returns (messages, has_more).
+    """
+    msgs = list(
+        participant.visible(participant.room.messages.filter(seq__gt=after))
+        .select_related('attachment').order_by('seq')[:limit + 1]
+    )
+    return msgs[:limit], len(msgs) > limit
+
+
+def clear_history(participant):
+    """
+    Hides everything currently in the room for this participant with one
+    UPDATE. The newest message may only exist in the archive, so the
+    watermark goes past both the live rows and the archive segments.
+    """
+    newest = Message.objects.filter(room_id=participant.room_id).order_by('-id').values('id')[:1]
+    newest_archived = MessageArchiveSegment.objects.filter(
+        room_id=participant.room_id,
+    ).order_by('-last_id').values('last_id')[:1]
+    ChatParticipant.objects.filter(id=participant.id).update(
+        # Coalesce each side: GREATEST with a NULL is NULL on SQLite
+        cleared_before=Greatest(
+            Coalesce(Subquery(newest), Value(0)), Coalesce(Subquery(newest_archived), Value(0)),
+        ) + 1,
+        hidden_ids=[],
+    )
+
+
+def hide_message(participant, msg):
+    """"Delete for me": remembers one message id on the participant row."""
+    if msg.id < participant.cleared_before or msg.id in participant.hidden_ids:
+        return
+    participant.hidden_ids = sorted(participant.hidden_ids + [msg.id])
+    participant.save(update_fields=['hidden_ids'])
+
+
+def mark_read(room, reader, seq=None):
+    """
+    Moves the reader's watermark up to `seq` (default: the room's latest seq).
+    One single-row UPDATE; the watermark never moves backwards.
+    """
+    if seq is None:
+        seq = Subquery(ChatRoom.objects.filter(id=room.id).values('last_seq')[:1])
+    return ChatParticipant.objects.filter(room_id=room.id, user=reader).update(
+        last_read_seq=Greatest(F('last_read_seq'), seq),
+    )
+
+
+def other_read_seq(room, user_id):
+    """How far the other participant has read; drives the sender's read ticks."""
+    seq = ChatParticipant.objects.filter(
+        room_id=room.id, user_id=other_participant_id(room, user_id),
+    ).values_list('last_read_seq', flat=True).first()
+    return seq or 0
+
+
+def has_unread(participant, msgs):
+    """True if any of `msgs` was sent by the other side after the reader's watermark (edits don't count)."""
+    return any(msg.sender_id != participant.user_id and msg.created_seq > participant.last_read_seq for msg in msgs)
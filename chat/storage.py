@@ -0,0 +1,33 @@
+"""
+Where chat attachments are stored.
+
+CHAT_ATTACHMENT_STORAGE is a dotted storage class: Cloudinary raw uploads in
+production, FileSystemStorage locally and in tests. The instance is built on
+first use and rebuilt when the settings change, so tests can point it at a
+temporary directory with override_settings.
+"""
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.functional import LazyObject, empty
+from django.utils.module_loading import import_string
+
+
+class AttachmentStorage(LazyObject):
+
+    def _setup(self):
+        self._wrapped = import_string(settings.CHAT_ATTACHMENT_STORAGE)(**settings.CHAT_ATTACHMENT_STORAGE_OPTIONS)
+
+
+storage = AttachmentStorage()
+
+
+def attachment_storage():
+    # FileField(storage=...) callable; keeps the concrete backend out of migrations
+    return storage
+
+
+@receiver(setting_changed)
+def _storage_setting_changed(setting, **kwargs):
+    if setting.startswith('CHAT_ATTACHMENT_STORAGE'):
+        storage._wrapped = empty
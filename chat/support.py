@@ -0,0 +1,142 @@
+"""
+Support routing: guest inquiries become tickets assigned to the least-loaded
+agent.
+
+Agent ids and open-ticket counts come from the cache. Routing a request
+therefore costs a get_many, plus one grouped COUNT for any counts that have
+expired. Counts are bumped on assignment and dropped on close. They are
+refreshed from the database every SUPPORT_LOAD_CACHE_SECONDS, which corrects
+any drift from concurrent updates.
+"""
+import random
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from core import metrics
+from . import services
+from .models import ChatRoom, SupportTicket
+
+User = get_user_model()
+
+AGENTS_KEY = 'support:agents'
+GUEST_USERNAME = 'Website_Guest'
+
+
+def load_key(agent_id):
+    return f'support:open:{agent_id}'
+
+
+def agent_ids():
+    """Active admins, or active superusers when there are no admins."""
+    ids = cache.get(AGENTS_KEY)
+    if ids is None:
+        ids = list(User.objects.filter(role='admin', is_active=True).values_list('id', flat=True))
+        if not ids:
+            ids = list(User.objects.filter(is_superuser=True, is_active=True).values_list('id', flat=True))
+        cache.set(AGENTS_KEY, ids, settings.SUPPORT_AGENTS_CACHE_SECONDS)
+    return ids
+
+
+def forget_agents():
+    cache.delete(AGENTS_KEY)
+
+
+def user_changed(user):
+    """Drops the cached agent list if `user` is, or just stopped being, an agent."""
+    if user.role == 'admin' or user.is_superuser or user.id in (cache.get(AGENTS_KEY) or ()):
+        forget_agents()
+
+
+def agent_loads(ids=None):
+    """{agent_id: open ticket count}; misses are filled with one grouped COUNT."""
+    ids = agent_ids() if ids is None else ids
+    cached = cache.get_many([load_key(agent_id) for agent_id in ids])
+    loads = {agent_id: cached[load_key(agent_id)] for agent_id in ids if load_key(agent_id) in cached}
+
+    missing = [agent_id for agent_id in ids if agent_id not in loads]
+    if missing:
+        counts = dict(
+            SupportTicket.objects.filter(agent_id__in=missing, status='open')
+            .values_list('agent_id').annotate(open=Count('id'))
+        )
+        fresh = {agent_id: counts.get(agent_id, 0) for agent_id in missing}
+        cache.set_many({load_key(agent_id): count for agent_id, count in fresh.items()},
+                       settings.SUPPORT_LOAD_CACHE_SECONDS)
+        loads.update(fresh)
+
+    for agent_id, count in loads.items():
+        metrics.set_gauge('support_open_tickets', count, agent=agent_id)
+    return loads
+
+
+def pick_agent():
+    """Least-loaded agent id (random among ties), or None if there are no agents."""
+    loads = agent_loads()
+    if not loads:
+        return None
+    return min(loads, key=lambda agent_id: (loads[agent_id], random.random()))
+
+
+def _adjust_load(agent_id, delta):
+    try:
+        count = cache.incr(load_key(agent_id), delta)
+    except ValueError:
+        return  # Not cached; the next agent_loads() recounts
+    metrics.set_gauge('support_open_tickets', count, agent=agent_id)
+
+
+def guest_user():
+    guest, created = User.objects.get_or_create(username=GUEST_USERNAME)
+    if created:
+        guest.email = "guest@system.local"
+        guest.set_unusable_password()
+        guest.save()
+    return guest
+
+
+def open_ticket(content, guest_name='', guest_email='', guest_phone='', source='contact_form'):
+    """
+    Creates a ticket room between the guest account and the least-loaded
+    agent and posts the inquiry in it. Returns the ticket, or None when no
+    agent is available.
+    """
+    agent_id = pick_agent()
+    if agent_id is None:
+        return None
+    guest = guest_user()
+    low, high = sorted([guest.id, agent_id])
+
+    with transaction.atomic():
+        room = ChatRoom.objects.create(participant_1_id=low, participant_2_id=high, kind=ChatRoom.TICKET)
+        ticket = SupportTicket.objects.create(
+            room=room, agent_id=agent_id, source=source,
+            guest_name=(guest_name or '')[:150], guest_email=(guest_email or '')[:254], guest_phone=(guest_phone or '')[:50],
+        )
+        services.post_message(room, guest, content)
+        transaction.on_commit(lambda: _adjust_load(agent_id, 1))
+
+    metrics.incr('support_tickets_opened', source=source)
+    return ticket
+
+
+def close_ticket(ticket):
+    updated = SupportTicket.objects.filter(id=ticket.id, status='open').update(status='closed', closed_at=timezone.now())
+    if updated:
+        _adjust_load(ticket.agent_id, -1)
+    return bool(updated)
+
+
+def can_view(ticket, user):
+    return user.id == ticket.agent_id or user.is_staff
+
+
+def queue_depths():
+    """[(agent, open_count)] busiest first, for the admin dashboard."""
+    loads = agent_loads()
+    agents = User.objects.filter(id__in=loads).only('id', 'username')
+    return sorted(((agent, loads[agent.id]) for agent in agents), key=lambda row: -row[1])
@@ -1,3 +1,880 @@
-from django.test import TestCase
+from channels.db import database_sync_to_async
+from channels.layers import channel_layers
+from channels.testing import WebsocketCommunicator
+import io
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from coffee_core.asgi import application
+from core import metrics
+from core.models import Notification
+from core.presence import get_presence, online_user_ids
+from core.ratelimit import consume
+from . import archive, attachments, services, support
+from .models import Attachment, AttachmentUpload, ChatRoom, Message, MessageArchiveSegment, SupportTicket
+from .search import search_messages
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+class InboxTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='buyer')
+        self.client.force_login(self.user)
+
+    def add_conversation(self, n):
+        seller = User.objects.create(username=f'seller_{n}')
+        room = ChatRoom.objects.create(participant_1=self.user, participant_2=seller)
+        services.post_messages(room, seller, ["Hello", f"Fresh harvest #{n}"])
+        services.post_message(room, self.user, "Price per kg?")
+        services.post_message(room, seller, "12 USD")
+        return room
+
+    def inbox_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('chat_inbox'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx), response
+
+    def test_query_count_does_not_grow_with_rooms(self):
+        self.add_conversation(1)
+        self.inbox_queries()  # Warms the cached request.user
+        few, _ = self.inbox_queries()
+
+        for n in range(2, 8):
+            self.add_conversation(n)
+        many, response = self.inbox_queries()
+
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.context['conversations']), 7)
+
+    def test_preview_and_unread_count(self):
+        room = self.add_conversation(1)
+        _, response = self.inbox_queries()
+        conversation = response.context['conversations'][0]
+
+        self.assertEqual(conversation.other_user.username, 'seller_1')
+        self.assertEqual(conversation.last_content, "12 USD")
+        self.assertEqual(conversation.unread_count, 3)
+
+        services.mark_read(room, self.user)
+        _, response = self.inbox_queries()
+        self.assertEqual(response.context['conversations'][0].unread_count, 0)
+
+    def test_hidden_messages_are_left_out(self):
+        room = self.add_conversation(1)
+        participant = services.get_participant(room.id, self.user)
+        services.hide_message(participant, room.messages.latest('id'))
+
+        _, response = self.inbox_queries()
+        conversation = response.context['conversations'][0]
+        self.assertEqual(conversation.last_content, "Price per kg?")
+        self.assertEqual(conversation.unread_count, 2)
+
+    def test_edits_keep_read_state(self):
+        room = self.add_conversation(1)
+        seller = room.participant_2
+        services.mark_read(room, self.user)
+        first = room.messages.order_by('id').first()
+        mine = room.messages.get(sender=self.user)
+
+        services.edit_message(first, "Hello, updated price list attached")
+        services.delete_for_everyone(mine)
+
+        # The seller's old message is not unread again for the buyer...
+        _, response = self.inbox_queries()
+        self.assertEqual(response.context['conversations'][0].unread_count, 0)
+        first.refresh_from_db()
+        self.assertFalse(services.has_unread(services.get_participant(room.id, self.user), [first]))
+        # ...and the seller keeps the read tick on it
+        self.assertGreater(first.seq, services.other_read_seq(room, seller.id))
+        self.assertLessEqual(first.created_seq, services.other_read_seq(room, seller.id))
+        self.client.force_login(seller)
+        response = self.client.get(reverse('chat_room', args=[self.user.id]))
+        self.assertContains(response, 'fa-check-double', count=3)
+
+    def test_mark_read_moves_watermark_only(self):
+        room = self.add_conversation(1)
+        seller = room.participant_2
+        services.mark_read(room, self.user, seq=2)
+        services.mark_read(room, self.user, seq=1)  # Never moves backwards
+
+        participant = room.participants.get(user=self.user)
+        self.assertEqual(participant.last_read_seq, 2)
+        self.assertEqual(services.other_read_seq(room, seller.id), 2)
+
+        before = list(room.messages.values_list('id', 'updated_at'))
+        services.mark_read(room, self.user)
+        self.assertEqual(list(room.messages.values_list('id', 'updated_at')), before)
+        self.assertEqual(room.participants.get(user=self.user).last_read_seq, 4)
+
+    def test_presence_costs_no_queries(self):
+        room = self.add_conversation(1)
+        get_presence().connect(room.participant_2_id)
+        try:
+            with self.assertNumQueries(0):
+                self.assertEqual(online_user_ids([room.participant_2_id]), {room.participant_2_id})
+            _, response = self.inbox_queries()
+            self.assertTrue(response.context['conversations'][0].is_online)
+        finally:
+            get_presence().disconnect(room.participant_2_id)
+
+
+class SyncTests(TestCase):
+
+    def setUp(self):
+        self.buyer = User.objects.create(username='buyer')
+        self.seller = User.objects.create(username='seller')
+        self.room, _ = ChatRoom.between(self.buyer, self.seller)
+        self.msgs = services.post_messages(self.room, self.seller, [f"Lot {i}" for i in range(5)])
+        self.client.force_login(self.buyer)
+        self.url = reverse('api_sync_messages', args=[self.room.id])
+
+    def sync(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_since_cursor(self):
+        data = self.sync(after=3)
+        self.assertEqual([change['seq'] for change in data['changes']], [4, 5])
+        self.assertEqual((data['cursor'], data['has_more']), (5, False))
+
+        data = self.sync(after=5)
+        self.assertEqual((data['changes'], data['cursor'], data['has_more']), ([], 5, False))
+
+    def test_pages_until_has_more_is_false(self):
+        seen, after, pages = [], 0, 0
+        while True:
+            data = self.sync(after=after, limit=2)
+            seen += [change['content'] for change in data['changes']]
+            after, pages = data['cursor'], pages + 1
+            if not data['has_more']:
+                break
+        self.assertEqual(seen, [f"Lot {i}" for i in range(5)])
+        self.assertEqual(pages, 3)
+
+    @override_settings(CHAT_SYNC_BATCH_SIZE=3)
+    def test_limit_is_capped(self):
+        data = self.sync(after=0, limit=100)
+        self.assertEqual((len(data['changes']), data['has_more']), (3, True))
+
+    def test_edits_come_back_as_changes(self):
+        services.edit_message(self.msgs[0], "Lot 0, 60kg bags")
+        data = self.sync(after=5)
+        self.assertEqual([(c['id'], c['content'], c['is_edited']) for c in data['changes']],
+                         [(self.msgs[0].id, "Lot 0, 60kg bags", True)])
+
+    def test_marks_what_it_returned_as_read(self):
+        self.sync(after=0, limit=2)
+        self.assertEqual(self.room.participants.get(user=self.buyer).last_read_seq, 2)
+
+    def test_rejects_bad_cursor_and_strangers(self):
+        self.assertEqual(self.client.get(self.url, {'after': 'x'}).status_code, 400)
+        self.client.force_login(User.objects.create(username='stranger'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+@override_settings(CHAT_HISTORY_PAGE_SIZE=3)
+class HistoryTests(TestCase):
+
+    def setUp(self):
+        self.buyer = User.objects.create(username='buyer')
+        self.seller = User.objects.create(username='seller')
+        self.room, _ = ChatRoom.between(self.buyer, self.seller)
+        self.msgs = services.post_messages(self.room, self.seller, [f"Lot {i}" for i in range(8)])
+        # One timestamp for all, so only the id tie-break orders the pages
+        Message.objects.update(timestamp=timezone.now())
+        self.client.force_login(self.buyer)
+        self.url = reverse('chat_history', args=[self.room.id])
+
+    def pages(self):
+        pages, before = [], None
+        while True:
+            response = self.client.get(self.url, {'before': before} if before else {})
+            self.assertEqual(response.status_code, 200)
+            pages.append([msg.id for msg in response.context['chat_messages']])
+            before = response['X-Next-Cursor']
+            if not before:
+                return pages
+
+    def test_before_cursor_walks_back_in_capped_pages(self):
+        ids = [msg.id for msg in self.msgs]
+        # Each page is oldest first; pages go from newest to oldest
+        self.assertEqual(self.pages(), [ids[5:8], ids[2:5], ids[0:2]])
+
+    def test_cleared_watermark_applies(self):
+        services.clear_history(services.get_participant(self.room.id, self.buyer))
+        newer = services.post_messages(self.room, self.seller, ["Still available", "Samples shipped"])
+        self.assertEqual(self.pages(), [[msg.id for msg in newer]])
+
+        self.client.force_login(self.seller)
+        self.assertEqual(sum(len(page) for page in self.pages()), 10)
+
+    def test_strangers_are_denied(self):
+        self.client.force_login(User.objects.create(username='stranger'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class ClearHistoryTests(TestCase):
+
+    def setUp(self):
+        self.buyer = User.objects.create(username='buyer')
+        self.seller = User.objects.create(username='seller')
+        self.room, _ = ChatRoom.between(self.buyer, self.seller)
+        self.old = services.post_messages(self.room, self.seller, ["Hello", "Guji G1, 12 USD"])
+
+    def visible_ids(self, user):
+        participant = services.get_participant(self.room.id, user)
+        return list(participant.visible(self.room.messages.order_by('id')).values_list('id', flat=True))
+
+    def test_clear_hides_for_one_side_only(self):
+        services.hide_message(services.get_participant(self.room.id, self.buyer), self.old[0])
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.client.post(reverse('api_clear_chat', args=[self.room.id])).json(), {'status': 'cleared'})
+
+        buyer = services.get_participant(self.room.id, self.buyer)
+        self.assertEqual((buyer.cleared_before, buyer.hidden_ids), (self.old[-1].id + 1, []))
+        self.assertEqual(self.visible_ids(self.buyer), [])
+        self.assertEqual(self.visible_ids(self.seller), [msg.id for msg in self.old])
+
+        new = services.post_message(self.room, self.seller, "Still interested?")
+        self.assertEqual(self.visible_ids(self.buyer), [new.id])
+
+    def test_clearing_an_empty_room_hides_nothing_later(self):
+        room, _ = ChatRoom.between(self.buyer, User.objects.create(username='roaster'))
+        services.clear_history(services.get_participant(room.id, self.buyer))
+        msg = services.post_message(room, self.buyer, "Hi")
+        participant = services.get_participant(room.id, self.buyer)
+        self.assertEqual(list(participant.visible(room.messages.all())), [msg])
+
+
+class MigrationTestCase(TransactionTestCase):
+    """Migrates back to `migrate_from`, lets the test add rows, then runs `migrate_to`."""
+    migrate_from = migrate_to = None
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate([self.migrate_from])
+        self.old_apps = self.executor.loader.project_state([self.migrate_from]).apps
+
+    def migrate(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate([self.migrate_to])
+        return executor.loader.project_state([self.migrate_to]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+
+class ParticipantWatermarkMigrationTests(MigrationTestCase):
+    migrate_from = ('chat', '0004_message_seq')
+    migrate_to = ('chat', '0005_chat_participant_watermarks')
+
+    def test_hidden_by_becomes_watermarks(self):
+        ChatRoom_ = self.old_apps.get_model('chat', 'ChatRoom')
+        Message_ = self.old_apps.get_model('chat', 'Message')
+        # accounts is not migrated back, so users come from the current model
+        buyer = User.objects.create(username='buyer')
+        seller = User.objects.create(username='seller')
+        room = ChatRoom_.objects.create(participant_1_id=buyer.id, participant_2_id=seller.id)
+        msgs = [Message_.objects.create(room=room, sender_id=seller.id, content=f"m{i}", seq=i) for i in range(1, 6)]
+        # The buyer cleared the first two, then deleted the fourth for themselves
+        for msg in (msgs[0], msgs[1], msgs[3]):
+            msg.hidden_by.add(buyer.id)
+
+        apps = self.migrate()
+        ChatParticipant_ = apps.get_model('chat', 'ChatParticipant')
+        rows = {p.user_id: p for p in ChatParticipant_.objects.filter(room_id=room.id)}
+
+        self.assertEqual((rows[buyer.id].cleared_before, rows[buyer.id].hidden_ids), (msgs[2].id, [msgs[3].id]))
+        self.assertEqual((rows[seller.id].cleared_before, rows[seller.id].hidden_ids), (0, []))
+
+
+class CanonicalRoomTests(TestCase):
+
+    def test_between_finds_the_room_either_way_round(self):
+        buyer = User.objects.create(username='buyer')
+        seller = User.objects.create(username='seller')
+        room, created = ChatRoom.between(seller, buyer)
+        self.assertTrue(created)
+        self.assertEqual((room.participant_1_id, room.participant_2_id), (buyer.id, seller.id))
+
+        self.assertEqual(ChatRoom.between(buyer, seller), (room, False))
+        self.assertEqual(ChatRoom.between(seller, buyer), (room, False))
+        self.assertEqual(room.participants.count(), 2)
+
+    def test_save_stores_reversed_pairs_canonically(self):
+        buyer = User.objects.create(username='buyer')
+        seller = User.objects.create(username='seller')
+        room = ChatRoom.objects.create(participant_1=seller, participant_2=buyer)
+        self.assertEqual((room.participant_1_id, room.participant_2_id), (buyer.id, seller.id))
+        self.assertEqual(ChatRoom.between(seller, buyer), (room, False))
+
+
+class CanonicalRoomMigrationTests(MigrationTestCase):
+    migrate_from = ('chat', '0006_message_history_index')
+    migrate_to = ('chat', '0007_canonical_room_pairs')
+
+    def test_duplicate_rooms_merge_into_the_oldest(self):
+        ChatRoom_ = self.old_apps.get_model('chat', 'ChatRoom')
+        ChatParticipant_ = self.old_apps.get_model('chat', 'ChatParticipant')
+        Message_ = self.old_apps.get_model('chat', 'Message')
+        buyer = User.objects.create(username='buyer')
+        seller = User.objects.create(username='seller')
+        start = timezone.now() - timedelta(days=1)
+
+        # Same pair twice, the newer room stored the other way round
+        keep = ChatRoom_.objects.create(participant_1_id=seller.id, participant_2_id=buyer.id)
+        dup = ChatRoom_.objects.create(participant_1_id=buyer.id, participant_2_id=seller.id)
+        msgs = []
+        for i, room in enumerate([keep, dup, keep, dup]):
+            msg = Message_.objects.create(room=room, sender_id=seller.id, content=f"m{i}", seq=i)
+            Message_.objects.filter(id=msg.id).update(timestamp=start + timedelta(minutes=i))
+            msgs.append(msg)
+        for room in (keep, dup):
+            ChatParticipant_.objects.create(room=room, user_id=seller.id)
+        ChatParticipant_.objects.create(room=keep, user_id=buyer.id)
+        # The buyer cleared the duplicate room up to its first message
+        ChatParticipant_.objects.create(room=dup, user_id=buyer.id, cleared_before=msgs[1].id + 1)
+        for room, count in ((keep, 2), (dup, 3)):
+            Notification.objects.create(recipient_id=buyer.id, room_id=room.id, message="New message", event_count=count)
+
+        apps = self.migrate()
+        ChatRoom_ = apps.get_model('chat', 'ChatRoom')
+        Message_ = apps.get_model('chat', 'Message')
+        ChatParticipant_ = apps.get_model('chat', 'ChatParticipant')
+
+        room = ChatRoom_.objects.get()
+        self.assertEqual((room.id, room.participant_1_id, room.participant_2_id), (keep.id, buyer.id, seller.id))
+        self.assertEqual(room.last_seq, 4)
+        self.assertEqual(
+            list(Message_.objects.filter(room=room).order_by('seq').values_list('id', 'seq')),
+            [(msg.id, seq) for seq, msg in enumerate(msgs, 1)],
+        )
+        participants = {p.user_id: p for p in ChatParticipant_.objects.filter(room=room)}
+        self.assertEqual(set(participants), {buyer.id, seller.id})
+        # Lowest watermark wins; what the buyer had cleared stays hidden for them only
+        self.assertEqual((participants[buyer.id].cleared_before, participants[buyer.id].hidden_ids), (0, [msgs[1].id]))
+        self.assertEqual(participants[seller.id].hidden_ids, [])
+        self.assertEqual(Notification.objects.get().event_count, 5)
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.buyer = User.objects.create(username='buyer')
+        self.seller = User.objects.create(username='seller')
+        self.room, _ = ChatRoom.between(self.buyer, self.seller)
+
+    def test_only_visible_messages_in_own_rooms(self):
+        quote = services.post_message(self.room, self.seller, "<b>Quote</b>: 12 USD per kg, FOB Mombasa")
+        hidden = services.post_message(self.room, self.seller, "Old quote: 14 USD per kg")
+        deleted = services.post_message(self.room, self.buyer, "Counter quote 10 USD per kg")
+        services.delete_for_everyone(deleted)
+        services.hide_message(self.room.participants.get(user=self.buyer), hidden)
+
+        stranger = User.objects.create(username='stranger')
+        other_room, _ = ChatRoom.between(stranger, self.seller)
+        services.post_message(other_room, self.seller, "Private quote 9 USD per kg")
+
+        hits, _ = search_messages(self.buyer, "quote")
+        self.assertEqual([hit.id for hit in hits], [quote.id])
+        self.assertEqual(hits[0].other_user, self.seller)
+        self.assertIn("&lt;b&gt;<mark>Quote</mark>&lt;/b&gt;", hits[0].snippet)
+
+        response = self.client_for(self.buyer).get(reverse('chat_room', args=[self.seller.id]), {'at': hits[0].jump_cursor})
+        self.assertTrue(response.context['jump_mode'])
+        self.assertEqual(response.context['chat_messages'][-1].id, quote.id)
+
+    def client_for(self, user):
+        self.client.force_login(user)
+        return self.client
+
+    def test_tied_hits_page_without_gaps_or_repeats(self):
+        # Same text and time: equal ranks on Postgres, equal timestamps in the fallback
+        msgs = services.post_messages(self.room, self.seller, ["Guji quote, 12 USD per kg"] * 7)
+        Message.objects.update(timestamp=timezone.now())
+
+        seen, after = [], None
+        while True:
+            hits, after = search_messages(self.buyer, "quote", after=after, size=3)
+            seen += [hit.id for hit in hits]
+            if after is None:
+                break
+        self.assertEqual(seen, sorted((msg.id for msg in msgs), reverse=True))
+
+    @skipUnless(connection.vendor == 'postgresql', "tsvector search runs on PostgreSQL only")
+    def test_ranked_cursor_is_exact(self):
+        strong = services.post_message(self.room, self.seller, "Quote: Guji quote, final quote")
+        weak = services.post_messages(self.room, self.seller, ["Guji quote, 12 USD per kg"] * 4)
+
+        hits, cursor = search_messages(self.buyer, "quote", size=2)
+        self.assertEqual(hits[0].id, strong.id)
+        self.assertIsInstance(hits[0].rank, int)
+        self.assertEqual(cursor, f"{hits[1].rank}_{hits[1].id}")
+
+        rest, cursor = search_messages(self.buyer, "quote", after=cursor, size=10)
+        self.assertIsNone(cursor)
+        self.assertEqual([hit.id for hit in hits + rest], [strong.id] + sorted((m.id for m in weak), reverse=True))
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        archive._segment_rows.cache_clear()
+        self.buyer = User.objects.create(username='buyer')
+        self.seller = User.objects.create(username='seller')
+        self.room, _ = ChatRoom.between(self.buyer, self.seller)
+        messages = [services.post_message(self.room, (self.buyer, self.seller)[i % 2], f"Offer {i}") for i in range(9)]
+        old = timezone.now() - timedelta(days=400)
+        for i, message in enumerate(messages[:7]):
+            Message.objects.filter(id=message.id).update(timestamp=old + timedelta(minutes=i))
+        self.ids = [message.id for message in messages]
+
+    def all_pages(self, participant, size):
+        ids, cursor = [], None
+        while True:
+            page, cursor = archive.history_page(participant, before=cursor, size=size)
+            ids += [message.id for message in page]
+            if not cursor:
+                return ids
+
+    def test_clear_covers_a_fully_archived_room(self):
+        call_command('archive_chat_messages', '--days', '0', stdout=open('/dev/null', 'w'))
+        self.assertEqual(self.room.messages.count(), 0)
+
+        participant = self.room.participants.get(user=self.buyer)
+        services.clear_history(participant)
+        participant.refresh_from_db()
+        self.assertEqual(participant.cleared_before, max(self.ids) + 1)
+        self.assertEqual(archive.history_page(participant), ([], None))
+
+    def test_history_reads_through_segments(self):
+        participant = self.room.participants.get(user=self.buyer)
+        services.hide_message(participant, Message.objects.get(id=self.ids[3]))
+        participant.refresh_from_db()
+
+        call_command('archive_chat_messages', '--segment-size', '3', stdout=open('/dev/null', 'w'))
+        self.assertEqual(self.room.messages.count(), 2)
+        self.assertEqual(list(self.room.archive_segments.order_by('id').values_list('message_count', flat=True)), [3, 3, 1])
+
+        expected = [pk for pk in reversed(self.ids) if pk != self.ids[3]]
+        for size in (1, 2, 4, 50):
+            self.assertEqual(self.all_pages(participant, size), expected)
+
+        self.client.force_login(self.buyer)
+        response = self.client.get(reverse('chat_room', args=[self.seller.id]))
+        self.assertContains(response, "Offer 0")
+        self.assertNotContains(response, "Offer 3")
+
+    def test_clear_watermark_skips_segments(self):
+        archive.archive_room(self.room.id, timezone.now() - timedelta(days=180), segment_size=3)
+        participant = self.room.participants.get(user=self.seller)
+        participant.cleared_before = self.ids[6]
+
+        with self.assertNumQueries(4):  # Hot page, segment index, newest segment only, senders
+            page, cursor = archive.history_page(participant, size=10)
+        self.assertEqual([message.id for message in page], self.ids[:5:-1])
+        self.assertIsNone(cursor)
+
+    def test_file_storage(self):
+        with tempfile.TemporaryDirectory() as location, override_settings(
+            CHAT_ARCHIVE_STORAGE='django.core.files.storage.FileSystemStorage',
+            CHAT_ARCHIVE_STORAGE_OPTIONS={'location': location},
+        ):
+            archive.archive_room(self.room.id, timezone.now() - timedelta(days=180))
+            segment = MessageArchiveSegment.objects.get()
+            self.assertTrue(segment.path.endswith('.jsonl.gz'))
+            self.assertEqual(bytes(segment.data), b'')
+
+            participant = self.room.participants.get(user=self.buyer)
+            self.assertEqual(self.all_pages(participant, 4), self.ids[::-1])
+
+
+class AttachmentTests(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.spool = tempfile.TemporaryDirectory()
+        settings = override_settings(
+            CHAT_ATTACHMENT_STORAGE='django.core.files.storage.FileSystemStorage',
+            CHAT_ATTACHMENT_STORAGE_OPTIONS={'location': self.media.name, 'base_url': '/media/'},
+            CHAT_ATTACHMENT_SPOOL_DIR=self.spool.name,
+            CHAT_ATTACHMENT_CHUNK_SIZE=1024,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(self.media.cleanup)
+        self.addCleanup(self.spool.cleanup)
+
+        self.buyer = User.objects.create(username='buyer')
+        self.seller = User.objects.create(username='seller')
+        self.room, _ = ChatRoom.between(self.buyer, self.seller)
+        self.client.force_login(self.seller)
+
+    def upload(self, filename, data):
+        start = self.client.post(reverse('api_start_upload', args=[self.room.id]),
+                                 {'filename': filename, 'size': len(data)}, content_type='application/json')
+        if start.status_code != 201:
+            return start
+        url, offset = start.json()['url'], 0
+        while True:
+            response = self.client.put(url, data[offset:offset + 1024], content_type='application/octet-stream',
+                                       headers={'Upload-Offset': str(offset)})
+            if response.json()['status'] != 'uploading':
+                return response
+            offset = response.json()['offset']
+
+    def stored_files(self):
+        return sorted(os.listdir(os.path.join(self.media.name, 'chat-attachments')))
+
+    def test_resumable_upload_and_dedup(self):
+        data = os.urandom(2500)
+        start = self.client.post(reverse('api_start_upload', args=[self.room.id]),
+                                 {'filename': 'cupping sheet.pdf', 'size': len(data)}, content_type='application/json')
+        url = start.json()['url']
+        self.client.put(url, data[:1024], content_type='application/octet-stream', headers={'Upload-Offset': '0'})
+
+        # A retried or skipped chunk is refused with the offset to resume from
+        stale = self.client.put(url, data[:1024], content_type='application/octet-stream', headers={'Upload-Offset': '2048'})
+        self.assertEqual((stale.status_code, stale.json()['offset']), (409, 1024))
+        self.assertEqual(self.client.get(url).json()['offset'], 1024)
+
+        self.client.put(url, data[1024:2048], content_type='application/octet-stream', headers={'Upload-Offset': '1024'})
+        done = self.client.put(url, data[2048:], content_type='application/octet-stream', headers={'Upload-Offset': '2048'})
+        payload = done.json()['message']
+        self.assertEqual(payload['content'], 'cupping sheet.pdf')
+        self.assertEqual(payload['attachment']['size'], 2500)
+        self.assertEqual(os.listdir(self.spool.name), [])
+
+        # Same bytes from the other side: a new message, the same stored file
+        self.client.force_login(self.buyer)
+        again = self.upload('lab report.pdf', data)
+        first, second = Message.objects.filter(room=self.room).order_by('id')
+        self.assertEqual(again.json()['message']['id'], second.id)
+        self.assertEqual(first.attachment_id, second.attachment_id)
+        self.assertEqual(len(self.stored_files()), 1)
+        with Attachment.objects.get().file.open('rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_chunk_is_written_outside_a_transaction(self):
+        data = os.urandom(1500)
+        self.client.post(reverse('api_start_upload', args=[self.room.id]),
+                         {'filename': 'contract.pdf', 'size': len(data)}, content_type='application/json')
+        upload = AttachmentUpload.objects.get()
+        depth = len(connection.atomic_blocks)
+
+        class Body(io.BytesIO):
+            def __init__(inner, data, racing=None):
+                super().__init__(data)
+                inner.racing = racing
+
+            def read(inner, size=-1):
+                self.assertEqual(len(connection.atomic_blocks), depth)
+                racing, inner.racing = inner.racing, None
+                if racing:
+                    racing()
+                return super().read(size)
+
+        upload = attachments.write_chunk(upload, 0, Body(data[:1024]), 1024)
+        self.assertEqual(AttachmentUpload.objects.get().received, 1024)
+
+        # A retry of the same chunk finishes first while this one is still reading
+        racing = lambda: AttachmentUpload.objects.filter(id=upload.id).update(received=1500)
+        with self.assertRaises(attachments.OffsetMismatch) as caught:
+            attachments.write_chunk(upload, 1024, Body(data[1024:], racing), 476)
+        self.assertEqual(caught.exception.offset, 1500)
+
+    def test_missing_spool_file_is_gone_not_an_error(self):
+        data = os.urandom(1500)
+        start = self.client.post(reverse('api_start_upload', args=[self.room.id]),
+                                 {'filename': 'contract.pdf', 'size': len(data)}, content_type='application/json')
+        os.remove(attachments.spool_path(AttachmentUpload.objects.get()))  # A redeploy wiped the disk
+
+        response = self.client.put(start.json()['url'], data[:1024], content_type='application/octet-stream',
+                                   headers={'Upload-Offset': '0'})
+        self.assertEqual(response.status_code, 410)
+        self.assertFalse(AttachmentUpload.objects.exists())
+        self.assertEqual(self.upload('contract.pdf', data).json()['status'], 'complete')
+
+    def test_rejects_unlisted_types(self):
+        response = self.upload('invoice.exe', b'MZ' * 10)
+        self.assertEqual(response.status_code, 415)
+
+    def test_previews_are_made_by_the_worker(self):
+        from PIL import Image
+        image = io.BytesIO()
+        Image.new('RGB', (1200, 800), 'brown').save(image, 'PNG')
+        self.upload('beans.png', image.getvalue())
+        self.upload('notes.csv', b'grade,score\nAA,86\n')
+
+        self.assertEqual(attachments.make_previews(), 2)
+        photo = Attachment.objects.get(content_type='image/png')
+        self.assertEqual(photo.preview_status, 'ready')
+        with photo.preview.open('rb') as f:
+            self.assertEqual(max(Image.open(f).size), 480)
+        self.assertEqual(Attachment.objects.get(content_type='text/csv').preview_status, 'none')
+
+        response = self.client.get(reverse('chat_room', args=[self.buyer.id]))
+        self.assertContains(response, photo.preview.url)
+
+
+class SupportRoutingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.agents = [User.objects.create(username=f'agent_{i}', role='admin') for i in range(3)]
+
+    def open_ticket(self, content, **guest):
+        # Load counters are bumped on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            return support.open_ticket(content, **guest)
+
+    def test_inquiries_spread_over_agents(self):
+        tickets = [self.open_ticket(f"Inquiry {i}", guest_name=f"Guest {i}") for i in range(6)]
+
+        self.assertEqual(len({ticket.room_id for ticket in tickets}), 6)  # One room per inquiry
+        self.assertEqual(sorted(support.agent_loads().values()), [2, 2, 2])
+        self.assertEqual(tickets[0].room.kind, ChatRoom.TICKET)
+        self.assertEqual(tickets[0].room.messages.get().content, "Inquiry 0")
+
+        # Closing frees capacity, so the next inquiry goes to that agent
+        support.close_ticket(tickets[0])
+        self.assertEqual(self.open_ticket("Inquiry 6").agent_id, tickets[0].agent_id)
+        self.assertEqual(metrics.get_value('support_open_tickets', agent=tickets[0].agent_id), 2)
+
+    def test_routing_reads_counts_from_cache(self):
+        self.open_ticket("Warm up")
+        with self.assertNumQueries(0):
+            support.pick_agent()
+
+    def test_agent_only_ticket_view(self):
+        ticket = self.open_ticket("Need 200kg of AA grade", guest_name="Amina")
+        agent = ticket.agent
+        other = next(a for a in self.agents if a != agent)
+
+        self.client.force_login(other)
+        self.assertRedirects(self.client.get(reverse('support_ticket', args=[ticket.room_id])), reverse('chat_inbox'))
+
+        self.client.force_login(agent)
+        response = self.client.get(reverse('support_ticket', args=[ticket.room_id]))
+        self.assertContains(response, "Ticket #%d" % ticket.id)
+        self.client.post(reverse('close_support_ticket', args=[ticket.room_id]))
+        self.assertEqual(SupportTicket.objects.get(id=ticket.id).status, 'closed')
+
+    def test_staff_get_a_read_only_view(self):
+        ticket = self.open_ticket("Need 200kg of AA grade", guest_name="Amina")
+        staff = User.objects.create(username='ops', is_staff=True)
+        self.client.force_login(staff)
+
+        response = self.client.get(reverse('support_ticket', args=[ticket.room_id]))
+        self.assertContains(response, "Need 200kg of AA grade")
+        self.assertContains(response, 'id="read-only-notice"')
+        self.assertNotContains(response, 'id="chat-form"')
+        self.assertFalse(ticket.room.participants.filter(user=staff).exists())
+
+        self.assertEqual(self.client.get(reverse('api_sync_messages', args=[ticket.room_id])).status_code, 403)
+        self.client.post(reverse('api_send_message', args=[ticket.room_id]), '{"content": "hi"}',
+                         content_type='application/json')
+        self.assertEqual(ticket.room.messages.count(), 1)
+        self.assertEqual(services.inbox(staff), [])
+
+        self.client.force_login(ticket.agent)
+        self.assertContains(self.client.get(reverse('support_ticket', args=[ticket.room_id])), 'id="chat-form"')
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_LAYER,
+    NOTIFICATION_OUTBOX_SYNC=True,
+    PRESENCE_BACKEND='core.presence.MemoryPresence',
+)
+class ChatConsumerPresenceTests(TransactionTestCase):
+
+    def setUp(self):
+        channel_layers.backends.clear()
+        self.buyer = User.objects.create(username='buyer')
+        self.seller = User.objects.create(username='seller')
+        self.room, _ = ChatRoom.between(self.buyer, self.seller)
+
+    def tearDown(self):
+        channel_layers.backends.clear()
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(application, f'/ws/chat/{self.room.id}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_presence_and_typing(self):
+        buyer = await self.connect(self.buyer)
+        self.assertEqual(await buyer.receive_json_from(),
+                         {'type': 'presence', 'user_id': self.seller.id, 'online': False})
+
+        seller = await self.connect(self.seller)
+        self.assertEqual(await seller.receive_json_from(),
+                         {'type': 'presence', 'user_id': self.buyer.id, 'online': True})
+        self.assertEqual(await buyer.receive_json_from(),
+                         {'type': 'presence', 'user_id': self.seller.id, 'online': True})
+
+        await seller.send_json_to({'action': 'typing', 'is_typing': True})
+        event = await buyer.receive_json_from()
+        self.assertEqual((event['type'], event['user_id'], event['is_typing']), ('typing', self.seller.id, True))
+        self.assertTrue(await seller.receive_nothing())  # Not echoed to the typist
+
+        await seller.disconnect()
+        self.assertEqual(await buyer.receive_json_from(),
+                         {'type': 'presence', 'user_id': self.seller.id, 'online': False})
+        self.assertEqual(await database_sync_to_async(online_user_ids)([self.seller.id]), set())
+        await buyer.disconnect()
+
+    @override_settings(RATE_LIMITS={'chat_send_user': '2/m'}, RATELIMIT_WS_MAX_STRIKES=2)
+    async def test_send_flood_is_pushed_back_then_closed(self):
+        await database_sync_to_async(cache.clear)()
+        buyer = await self.connect(self.buyer)
+        await buyer.receive_json_from()  # presence
+
+        for i in range(3):
+            await buyer.send_json_to({'action': 'send', 'content': f"offer {i}", 'client_id': f"c{i}"})
+        received = [await buyer.receive_json_from() for _ in range(3)]
+        self.assertEqual(sorted(event['type'] for event in received), ['message', 'message', 'rate_limited'])
+        rejected = next(event for event in received if event['type'] == 'rate_limited')
+        self.assertEqual(rejected['client_id'], 'c2')
+
+        await buyer.send_json_to({'action': 'send', 'content': "offer 3"})
+        self.assertEqual(await buyer.receive_output(), {'type': 'websocket.close', 'code': 4029})
+        self.assertEqual(await database_sync_to_async(self.room.messages.count)(), 2)
+
+    @override_settings(RATE_LIMITS={'chat_send_user': '2/m', 'chat_send_room': '1/m'})
+    async def test_room_rejection_does_not_use_the_user_limit(self):
+        await database_sync_to_async(cache.clear)()
+        buyer = await self.connect(self.buyer)
+        await buyer.receive_json_from()  # presence
+
+        for i in range(2):
+            await buyer.send_json_to({'action': 'send', 'content': f"offer {i}"})
+        received = [await buyer.receive_json_from() for _ in range(2)]
+        self.assertEqual(sorted(event['type'] for event in received), ['message', 'rate_limited'])
+        self.assertTrue((await database_sync_to_async(consume)('chat_send_user', self.buyer.id))[0])
+        await buyer.disconnect()
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_LAYER,
+    NOTIFICATION_OUTBOX_SYNC=True,
+    PRESENCE_BACKEND='core.presence.MemoryPresence',
+    RATE_LIMITS={},
+)
+class ChatConsumerTests(TransactionTestCase):
+
+    def setUp(self):
+        channel_layers.backends.clear()
+        self.buyer = User.objects.create(username='buyer')
+        self.seller = User.objects.create(username='seller')
+        self.room, _ = ChatRoom.between(self.buyer, self.seller)
+
+    def tearDown(self):
+        channel_layers.backends.clear()
+
+    def communicator(self, user):
+        communicator = WebsocketCommunicator(application, f'/ws/chat/{self.room.id}/')
+        communicator.scope['user'] = user
+        return communicator
+
+    async def connect(self, user):
+        communicator = self.communicator(user)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()  # presence
+        return communicator
+
+    async def test_close_codes(self):
+        self.assertEqual(await self.communicator(AnonymousUser()).connect(), (False, 4401))
+        stranger = await database_sync_to_async(User.objects.create)(username='stranger')
+        self.assertEqual(await self.communicator(stranger).connect(), (False, 4403))
+
+    @override_settings(CHAT_WS_BATCH_SIZE=3, CHAT_WS_FLUSH_MS=60000)
+    async def test_full_batch_is_written_at_once(self):
+        buyer = await self.connect(self.buyer)
+        with mock.patch('chat.services.post_messages', wraps=services.post_messages) as post:
+            for i in range(3):
+                await buyer.send_json_to({'action': 'send', 'content': f"offer {i}", 'client_id': f"c{i}"})
+            events = [await buyer.receive_json_from() for _ in range(3)]
+
+        post.assert_called_once()
+        self.assertEqual([event['client_id'] for event in events], ['c0', 'c1', 'c2'])
+        self.assertEqual([event['seq'] for event in events], [1, 2, 3])
+        await buyer.disconnect()
+
+    @override_settings(CHAT_WS_BATCH_SIZE=20, CHAT_WS_FLUSH_MS=20)
+    async def test_partial_batch_is_written_after_the_delay(self):
+        buyer = await self.connect(self.buyer)
+        with mock.patch('chat.services.post_messages', wraps=services.post_messages) as post:
+            await buyer.send_json_to({'action': 'send', 'content': "Hello"})
+            await buyer.send_json_to({'action': 'send', 'content': "Any Guji left?"})
+            events = [await buyer.receive_json_from() for _ in range(2)]
+
+        post.assert_called_once()
+        self.assertEqual([event['content'] for event in events], ["Hello", "Any Guji left?"])
+        await buyer.disconnect()
+
+    async def test_bad_frames_get_an_error_and_keep_the_socket(self):
+        buyer = await self.connect(self.buyer)
+        for frame in ('[1, 2]', '42', 'not json'):
+            await buyer.send_to(text_data=frame)
+            self.assertEqual(await buyer.receive_json_from(), {'type': 'error', 'error': "Expected a JSON object."})
+        for action in ('edit', 'delete'):
+            await buyer.send_json_to({'action': action, 'message_id': 'abc', 'content': "12 USD"})
+            self.assertEqual((await buyer.receive_json_from())['error'], "message_id must be a number.")
+
+        await buyer.send_json_to({'action': 'send', 'content': "Still here"})
+        self.assertEqual((await buyer.receive_json_from())['type'], 'message')
+        await buyer.disconnect()
+
+    @override_settings(CHAT_WS_FLUSH_MS=10)
+    async def test_failed_flush_reports_the_lost_sends(self):
+        buyer = await self.connect(self.buyer)
+        with mock.patch('chat.services.post_messages', side_effect=RuntimeError("db down")), \
+                self.assertLogs('chat.consumers', 'ERROR'):
+            await buyer.send_json_to({'action': 'send', 'content': "Hello", 'client_id': 'c1'})
+            event = await buyer.receive_json_from()
+
+        self.assertEqual(event, {'type': 'error', 'error': "Messages could not be sent.", 'client_ids': ['c1']})
+        await buyer.disconnect()
+
+
+class SendRateLimitTests(TestCase):
+
+    @override_settings(RATE_LIMITS={'chat_send_user': '3/m', 'chat_send_room': '2/m'})
+    def test_room_bucket_returns_429(self):
+        cache.clear()
+        buyer = User.objects.create(username='buyer')
+        seller = User.objects.create(username='seller')
+        room, _ = ChatRoom.between(buyer, seller)
+        self.client.force_login(buyer)
+        url = reverse('api_send_message', args=[room.id])
+
+        codes = [self.client.post(url, '{"content": "hi"}', content_type='application/json').status_code for _ in range(3)]
+        self.assertEqual(codes, [200, 200, 429])
+
+        # The rejected send didn't count against the buyer's own limit
+        other, _ = ChatRoom.between(buyer, User.objects.create(username='mill'))
+        response = self.client.post(reverse('api_send_message', args=[other.id]), '{"content": "hi"}',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
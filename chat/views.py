@@ -1,63 +1,113 @@
-import random
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
-from .models import ChatRoom, Message
+from .models import AttachmentUpload, ChatParticipant, ChatRoom, Message, SupportTicket
 from django.contrib.auth import get_user_model
 from django.contrib import messages
 from django.http import JsonResponse
+from django.urls import reverse
 from django.template.loader import render_to_string
 import json
+from datetime import datetime, timezone as dt_timezone
 from django.utils import timezone
+from django.conf import settings
+from core.pagination import decode_cursor
+from core.presence import is_online
+from core.ratelimit import consume, ratelimit, refund, too_many_requests
+from . import archive, attachments, services, support
+from .search import search_messages
 
 User = get_user_model()
 
 @login_required
 def chat_inbox(request):
-    # Find all rooms where user is participant
-    rooms = ChatRoom.objects.filter(
-        Q(participant_1=request.user) | Q(participant_2=request.user)
-    ).order_by('-updated_at')
-    
-    return render(request, 'chat/inbox.html', {'rooms': rooms})
+    # One query: other user, last message preview and unread count per room
+    return render(request, 'chat/inbox.html', {'conversations': services.inbox(request.user)})
 
 @login_required
 def chat_room(request, user_id):
     other_user = get_object_or_404(User, id=user_id)
     
-    room = ChatRoom.objects.filter(
-        (Q(participant_1=request.user) & Q(participant_2=other_user)) |
-        (Q(participant_1=other_user) & Q(participant_2=request.user))
-    ).first()
+    room, _ = ChatRoom.between(request.user, other_user)
+    return render_room(request, room, other_user)
 
-    if not room:
-        room = ChatRoom.objects.create(participant_1=request.user, participant_2=other_user)
+def render_room(request, room, other_user, ticket=None):
+    # Latest page only (skip what this user cleared or hid); older pages come from chat_history.
+    # ?at=<cursor> (from search) opens the page that ends at that message instead.
+    jump_to = request.GET.get('at') if decode_cursor(request.GET.get('at')) else None
+    participant = services.get_participant(room.id, request.user)
+    if participant is None and request.user.id in (room.participant_1_id, room.participant_2_id):
+        # Rooms bulk-created without their participant rows
+        participant = ChatParticipant.objects.get_or_create(room=room, user=request.user)[0]
+    # Staff opening someone else's ticket get a read-only view: no participant
+    # row, so they can't sync or post and no inbox entry appears for them
+    read_only = participant is None
+    if read_only:
+        participant = ChatParticipant(room=room, user=request.user)
+    page, next_cursor = archive.history_page(participant, before=jump_to, size=settings.CHAT_HISTORY_PAGE_SIZE)
 
-    # Load messages (exclude ones hidden by this user)
-    chat_messages = room.messages.exclude(hidden_by=request.user).order_by('timestamp')
-    
     # Mark unread messages from other user as read
-    chat_messages.filter(sender=other_user, is_read=False).update(is_read=True)
+    if not read_only:
+        services.mark_read(room, request.user)
 
     return render(request, 'chat/room.html', {
         'room': room, 
-        'chat_messages': chat_messages, 
-        'other_user': other_user
+        'ticket': ticket,
+        'read_only': read_only,
+        'room_url': request.path,
+        'chat_messages': page[::-1],
+        'next_cursor': next_cursor,
+        'jump_mode': bool(jump_to),
+        'other_read_seq': services.other_read_seq(room, request.user.id),
+        'other_user': other_user,
+        'other_online': is_online(other_user.id),
+        'poll_interval_ms': settings.CHAT_POLL_INTERVAL_MS,
+        'heartbeat_ms': settings.PRESENCE_HEARTBEAT_SECONDS * 1000,
+        'typing_timeout_ms': settings.CHAT_TYPING_TIMEOUT_MS,
     })
 
+# --- SEARCH ---
+@login_required
+def chat_search(request):
+    query = request.GET.get('q', '').strip()
+    hits, next_cursor = search_messages(
+        request.user, query, after=request.GET.get('after'), size=settings.CHAT_SEARCH_PAGE_SIZE,
+    )
+    return render(request, 'chat/search.html', {
+        'query': query,
+        'hits': hits,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('after'),
+    })
+
+# --- OLDER HISTORY (HTML fragment for infinite scroll) ---
+@login_required
+def chat_history(request, room_id):
+    participant = services.get_participant(room_id, request.user)
+    if participant is None:
+        return JsonResponse({'status': 'denied'}, status=403)
+
+    # Reads through archived segments once the hot rows run out
+    page, next_cursor = archive.history_page(
+        participant, before=request.GET.get('before'), size=settings.CHAT_HISTORY_PAGE_SIZE,
+    )
+    response = render(request, 'chat/history_page.html', {
+        'chat_messages': page[::-1],
+        'other_read_seq': services.other_read_seq(participant.room, request.user.id),
+    })
+    # Empty header means the start of the conversation was reached
+    response['X-Next-Cursor'] = next_cursor or ''
+    return response
+
+@ratelimit('contact_form', key='ip')
 def contact_admin(request):
     # =================================================
     # SCENARIO 1: USER IS LOGGED IN -> Direct Chat
     # =================================================
     if request.user.is_authenticated:
-        # 1. Find admins
-        admins = User.objects.filter(role='admin', is_active=True)
-        if not admins.exists():
-            admins = User.objects.filter(is_superuser=True, is_active=True)
-        
-        if admins.exists():
-            selected_admin = random.choice(list(admins))
-            return redirect('chat_room', user_id=selected_admin.id)
+        # 1. Least-loaded agent (cached counts, see chat.support)
+        agent_id = support.pick_agent()
+        if agent_id is not None:
+            return redirect('chat_room', user_id=agent_id)
         else:
             messages.error(request, "No support agents are currently available.")
             return redirect('chat_inbox')
@@ -72,33 +122,7 @@ def contact_admin(request):
         phone = request.POST.get('phone')
         body = request.POST.get('message')
 
-        # 2. Find an admin to receive the message
-        admins = list(User.objects.filter(Q(role='admin') | Q(is_superuser=True), is_active=True))
-        
-        if not admins:
-            messages.error(request, "System Error: No support agents available to receive your message.")
-            return redirect('contact_admin') # Redirect back to form
-
-        target_admin = random.choice(admins)
-
-        # 3. Create/Get a generic "Guest User" for the DB
-        # This ensures the message has a sender, but doesn't require real login
-        guest_user, created = User.objects.get_or_create(username="Website_Guest")
-        if created:
-            guest_user.email = "guest@system.local"
-            guest_user.set_unusable_password()
-            guest_user.save()
-
-        # 4. Create Chat Room (Guest User <-> Admin)
-        room = ChatRoom.objects.filter(
-            (Q(participant_1=guest_user) & Q(participant_2=target_admin)) |
-            (Q(participant_1=target_admin) & Q(participant_2=guest_user))
-        ).first()
-
-        if not room:
-            room = ChatRoom.objects.create(participant_1=guest_user, participant_2=target_admin)
-
-        # 5. Format the message
+        # 2. Format the message
         full_message = (
             f"📢 **GUEST INQUIRY**\n"
             f"👤 Name: {name}\n"
@@ -108,50 +132,127 @@ def contact_admin(request):
             f"{body}"
         )
 
-        # 6. Send Message
-        Message.objects.create(room=room, sender=guest_user, content=full_message)
-        room.save() # Update timestamp
+        # 3. One ticket room per inquiry, assigned to the least-loaded agent
+        ticket = support.open_ticket(full_message, guest_name=name, guest_email=email, guest_phone=phone)
+        if ticket is None:
+            messages.error(request, "System Error: No support agents available to receive your message.")
+            return redirect('contact_admin') # Redirect back to form
 
         messages.success(request, f"Thank you, {name}! Your message has been sent. We will contact you via email.")
         return redirect('contact_admin') # Or redirect to home
 
     # If GET request and not logged in, show the form
     return render(request, 'chat/guest_contact.html')
+
+# --- SUPPORT TICKETS (agent side) ---
+@login_required
+def support_ticket(request, room_id):
+    ticket = get_object_or_404(SupportTicket.objects.select_related('room'), room_id=room_id)
+    if not support.can_view(ticket, request.user):
+        return redirect('chat_inbox')
+    guest = User.objects.get(id=services.other_participant_id(ticket.room, ticket.agent_id))
+    return render_room(request, ticket.room, guest, ticket=ticket)
+
+@login_required
+def close_support_ticket(request, room_id):
+    ticket = get_object_or_404(SupportTicket, room_id=room_id)
+    if request.method == 'POST' and support.can_view(ticket, request.user):
+        if support.close_ticket(ticket):
+            messages.success(request, f"Ticket #{ticket.id} closed.")
+    return redirect('support_ticket', room_id=room_id)
     
-# --- AJAX API: SEND MESSAGE ---
+# --- AJAX API: SEND MESSAGE (fallback when the WebSocket is down) ---
 @login_required
+@ratelimit('chat_send_user', key='user')
 def send_message_api(request, room_id):
     if request.method == 'POST':
-        room = get_object_or_404(ChatRoom, id=room_id)
+        participant = services.get_participant(room_id, request.user)
+        if participant is None:
+            return JsonResponse({'status': 'denied'}, status=403)
+        # Room bucket only after the membership check, so outsiders can't drain it
+        allowed, retry_after = consume('chat_send_room', room_id)
+        if not allowed:
+            refund('chat_send_user', request.user.pk)
+            return too_many_requests(request, retry_after)
+        room = participant.room
         data = json.loads(request.body)
         content = data.get('content')
         
         if content:
-            msg = Message.objects.create(room=room, sender=request.user, content=content)
-            room.save() # update timestamp
+            msg = services.post_message(room, request.user, content, data.get('client_id'))
             
             # Return HTML for the single message to append via JS
             return JsonResponse({
                 'status': 'success', 
                 'message_id': msg.id,
                 'content': msg.content,
-                'time': msg.timestamp.strftime("%H:%M")
+                'time': timezone.localtime(msg.timestamp).strftime("%H:%M")
             })
     return JsonResponse({'status': 'error'})
 
+# --- ATTACHMENTS (chunked, resumable upload; see chat.attachments) ---
+@login_required
+@ratelimit('chat_send_user', key='user')
+def start_attachment_upload(request, room_id):
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error'}, status=405)
+    participant = services.get_participant(room_id, request.user)
+    if participant is None:
+        return JsonResponse({'status': 'denied'}, status=403)
+    try:
+        data = json.loads(request.body)
+        upload = attachments.start_upload(participant.room, request.user, data.get('filename'), data.get('size'))
+    except attachments.UploadError as e:
+        return JsonResponse({'status': 'error', 'error': str(e)}, status=e.status)
+    except ValueError:
+        return JsonResponse({'status': 'error'}, status=400)
+
+    return JsonResponse({
+        'status': 'started',
+        'upload_id': str(upload.id),
+        'url': reverse('api_attachment_upload', args=[upload.id]),
+        'offset': 0,
+        'chunk_size': settings.CHAT_ATTACHMENT_CHUNK_SIZE,
+    }, status=201)
+
+@login_required
+def attachment_upload(request, upload_id):
+    # GET: where to resume. PUT: the next chunk, starting at the Upload-Offset header.
+    upload = get_object_or_404(AttachmentUpload, id=upload_id, user=request.user)
+    if request.method == 'GET':
+        return JsonResponse({'status': 'uploading', 'offset': upload.received, 'size': upload.size})
+    if request.method != 'PUT':
+        return JsonResponse({'status': 'error'}, status=405)
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'error': "Upload-Offset header required."}, status=400)
+    try:
+        # Streams from the request; request.body is never read
+        upload = attachments.write_chunk(upload, offset, request, length)
+    except attachments.OffsetMismatch as e:
+        return JsonResponse({'status': 'conflict', 'offset': e.offset}, status=409)
+    except attachments.UploadError as e:
+        return JsonResponse({'status': 'error', 'error': str(e)}, status=e.status)
+
+    if upload.received < upload.size:
+        return JsonResponse({'status': 'uploading', 'offset': upload.received})
+    msg = attachments.finish_upload(upload)
+    return JsonResponse({'status': 'complete', 'message': services.message_payload(msg)})
+
 # --- NEW: CLEAR CHAT HISTORY ---
 @login_required
 def clear_chat_history(request, room_id):
     if request.method == 'POST':
-        room = get_object_or_404(ChatRoom, id=room_id)
         # Check if user is in room
-        if request.user not in [room.participant_1, room.participant_2]:
+        participant = services.get_participant(room_id, request.user)
+        if participant is None:
             return JsonResponse({'status': 'denied'})
             
-        # Add user to hidden_by for ALL messages in this room
-        msgs = room.messages.all()
-        for m in msgs:
-            m.hidden_by.add(request.user)
+        # Move this user's watermark past the newest message (one UPDATE)
+        services.clear_history(participant)
             
         return JsonResponse({'status': 'cleared'})
     return JsonResponse({'status': 'error'})
@@ -166,32 +267,59 @@ def manage_message(request):
         msg = get_object_or_404(Message, id=msg_id)
         
         if action == 'delete_me':
-            msg.hidden_by.add(request.user)
+            participant = services.get_participant(msg.room_id, request.user)
+            if participant is None:
+                return JsonResponse({'status': 'denied'})
+            services.hide_message(participant, msg)
             return JsonResponse({'status': 'hidden'})
             
-        if msg.sender != request.user:
+        if msg.sender_id != request.user.id:
             return JsonResponse({'status': 'denied'})
 
         if action == 'delete_everyone':
-            msg.is_deleted_everyone = True
-            msg.content = "🚫 This message was deleted."
-            msg.save() # This updates 'updated_at' automatically
+            services.delete_for_everyone(msg)
             return JsonResponse({'status': 'deleted', 'new_content': msg.content})
             
         elif action == 'edit':
             new_content = data.get('new_content')
             if new_content:
-                msg.content = new_content
-                msg.is_edited = True
-                msg.save() # This updates 'updated_at' automatically
+                services.edit_message(msg, new_content)
                 return JsonResponse({'status': 'edited', 'new_content': new_content})
 
     return JsonResponse({'status': 'error'})
 
-# --- UPDATED: GET UPDATES (Handles Real-time Edits) ---
+# --- SYNC: every change after a sequence cursor (polling fallback / reconnect catch-up) ---
+@login_required
+def sync_messages(request, room_id):
+    participant = services.get_participant(room_id, request.user)
+    if participant is None:
+        return JsonResponse({'status': 'denied'}, status=403)
+    room = participant.room
+
+    try:
+        after = max(int(request.GET.get('after', 0)), 0)
+        limit = min(max(int(request.GET.get('limit', settings.CHAT_SYNC_BATCH_SIZE)), 1), settings.CHAT_SYNC_BATCH_SIZE)
+    except ValueError:
+        return JsonResponse({'status': 'error'}, status=400)
+
+    msgs, has_more = services.changes_since(participant, after, limit)
+
+    if services.has_unread(participant, msgs):
+        services.mark_read(room, request.user, msgs[-1].seq)
+
+    return JsonResponse({
+        'changes': [dict(services.message_payload(msg), is_me=msg.sender_id == request.user.id) for msg in msgs],
+        'cursor': msgs[-1].seq if msgs else after,
+        'has_more': has_more,
+    })
+
+# --- GET UPDATES (legacy timestamp polling, kept for old open tabs; use sync_messages) ---
 @login_required
 def get_updates(request, room_id):
-    room = get_object_or_404(ChatRoom, id=room_id)
+    participant = services.get_participant(room_id, request.user)
+    if participant is None:
+        return JsonResponse({'status': 'denied'}, status=403)
+    room = participant.room
     
     # We now track "last_check" time instead of just ID
     last_check_str = request.GET.get('last_check', 0)
@@ -201,29 +329,22 @@ def get_updates(request, room_id):
     try:
         last_check_ts = float(last_check_str)
         # Convert JS timestamp (ms) to Python datetime
-        last_check_dt = timezone.datetime.fromtimestamp(last_check_ts, tz=timezone.utc)
-    except:
+        last_check_dt = datetime.fromtimestamp(last_check_ts, tz=dt_timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
         last_check_dt = timezone.now() - timezone.timedelta(seconds=10)
 
     # 1. New Messages (Created recently)
-    new_msgs_qs = room.messages.filter(timestamp__gt=last_check_dt).exclude(hidden_by=request.user).order_by('timestamp')
+    new_msgs_qs = participant.visible(room.messages.filter(timestamp__gt=last_check_dt)).select_related('attachment').order_by('timestamp')
     
     # 2. Updated Messages (Edited/Deleted recently but created long ago)
-    updated_msgs_qs = room.messages.filter(updated_at__gt=last_check_dt, timestamp__lte=last_check_dt).exclude(hidden_by=request.user)
+    updated_msgs_qs = participant.visible(room.messages.filter(updated_at__gt=last_check_dt, timestamp__lte=last_check_dt))
 
-    new_data = []
-    for msg in new_msgs_qs:
-        new_data.append({
-            'id': msg.id,
-            'sender_id': msg.sender.id,
-            'content': msg.content,
-            'time': msg.timestamp.strftime("%H:%M"),
-            'is_me': msg.sender == request.user,
-            'is_deleted': msg.is_deleted_everyone
-        })
-        if msg.sender != request.user:
-            msg.is_read = True
-            msg.save()
+    new_msgs = list(new_msgs_qs)
+    new_data = [dict(services.message_payload(msg), is_me=msg.sender_id == request.user.id) for msg in new_msgs]
+
+    # Moves the read watermark; message rows (and their updated_at) are untouched
+    if services.has_unread(participant, new_msgs):
+        services.mark_read(room, request.user, max(msg.seq for msg in new_msgs))
 
     updated_data = []
     for msg in updated_msgs_qs:
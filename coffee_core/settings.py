@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 
 # --- MIDDLEWARE ---
 MIDDLEWARE = [
+    'core.instrumentation.InstrumentationMiddleware', # First, so every query is counted
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware', # <--- Critical for CSS
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -69,6 +70,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'core.context_processors.user_notifications', # Custom Notifications
+                'core.context_processors.render_timer', # Render time (core.instrumentation)
             ],
         },
     },
@@ -108,8 +110,71 @@ else:
         }
     }
 
+# --- CACHE ---
+# Shared across processes in production (same Redis as Channels); per-process locally
+if 'REDIS_URL' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seller storefront summaries (market.storefront), invalidated by signals
+STOREFRONT_CACHE_TIMEOUT = 60 * 60
+
+# --- SUPPORT ROUTING (chat.support) ---
+SUPPORT_AGENTS_CACHE_SECONDS = 300
+# Open-ticket counts are recounted from the database at least this often
+SUPPORT_LOAD_CACHE_SECONDS = 300
+
+# --- RATE LIMITS (core.ratelimit) ---
+# "<count>/<period>": at most count per fixed window of period
+RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', '1') == '1'
+# Behind Render's proxy the client address comes from X-Forwarded-For: the hop
+# appended by the outermost of this many trusted proxies (1 = the rightmost)
+RATELIMIT_USE_FORWARDED_FOR = 'RENDER' in os.environ
+RATELIMIT_TRUSTED_PROXY_HOPS = int(os.environ.get('RATELIMIT_TRUSTED_PROXY_HOPS', 1))
+RATE_LIMITS = {
+    'chat_send_user': '30/m',
+    'chat_send_room': '120/m',
+    'chat_typing': '30/m',
+    'contact_form': '5/h',
+}
+# Rejected socket sends in a row before the consumer closes with 4029
+RATELIMIT_WS_MAX_STRIKES = 5
+
+# --- PRESENCE (core.presence) ---
+# Online state lives in Redis next to the channel layer; sockets refresh it
+# with heartbeats and users fall offline PRESENCE_TTL seconds after the last one.
+if 'REDIS_URL' in os.environ:
+    PRESENCE_BACKEND = 'core.presence.RedisPresence'
+else:
+    PRESENCE_BACKEND = 'core.presence.MemoryPresence'
+PRESENCE_URL = os.environ.get('REDIS_URL')
+PRESENCE_TTL = 60
+PRESENCE_HEARTBEAT_SECONDS = 25
+# Typing indicators disappear this long after the last keystroke event
+CHAT_TYPING_TIMEOUT_MS = 4000
+
 # --- AUTHENTICATION ---
 AUTH_USER_MODEL = 'accounts.User'
+# request.user comes from the cache (accounts.backends); ModelBackend stays
+# listed so sessions created before the cached backend keep working
+AUTHENTICATION_BACKENDS = [
+    'accounts.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+# Only with a cache every process shares: a LocMem copy in one worker would not
+# see another worker's invalidation, so a suspended user stayed logged in there
+AUTH_USER_CACHE_ENABLED = 'REDIS_URL' in os.environ
+AUTH_USER_CACHE_TIMEOUT = 15 * 60
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'landing_page'
 
@@ -176,3 +241,117 @@ STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
 
 # Chapa
 CHAPA_SECRET_KEY = os.environ.get('CHAPA_SECRET_KEY')
+
+# --- INSTRUMENTATION (core.instrumentation) ---
+# Share of requests and socket events whose SQL is recorded; latency is always recorded
+INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION_ENABLED', '1') == '1'
+INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('INSTRUMENTATION_SAMPLE_RATE', 0.1))
+# One statement repeated this often in a request is reported as a likely N+1
+INSTRUMENTATION_N_PLUS_ONE_THRESHOLD = 10
+# Bearer token for Prometheus scrapes of /metrics; without one only staff can read it
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# --- BACKGROUND WORKERS ---
+# build.sh and the Render web service start none of these. Each long-running
+# one needs its own worker service with the web service's environment:
+#   python manage.py run_notification_worker   (delivers when NOTIFICATION_OUTBOX_SYNC=0)
+#   python manage.py run_upload_worker         (pushes when UPLOAD_SPOOL_SYNC=0)
+#   python manage.py run_attachment_worker     (chat previews, expired uploads)
+# and as scheduled jobs:
+#   python manage.py archive_chat_messages
+#   python manage.py purge_notifications
+
+# --- NOTIFICATION OUTBOX ---
+# Notifications are queued in core.NotificationOutbox and delivered by
+# run_notification_worker. Sync mode delivers them inline, in the request.
+# Sync is the default for now, as a rollout step: with no worker deployed the
+# outbox would never drain. Requests only get faster once a worker runs and
+# NOTIFICATION_OUTBOX_SYNC=0 is set on the web service.
+NOTIFICATION_OUTBOX_SYNC = os.environ.get('NOTIFICATION_OUTBOX_SYNC', '1') == '1'
+NOTIFICATION_OUTBOX_BATCH_SIZE = int(os.environ.get('NOTIFICATION_OUTBOX_BATCH_SIZE', 500))
+
+# --- BACKGROUND UPLOADS ---
+# Seller documents are spooled here and pushed to Cloudinary (core.uploads).
+# Sync mode pushes them in the request, right after the row commits, so the
+# spool file never has to outlive the request. On by default, like
+# NOTIFICATION_OUTBOX_SYNC: with no worker deployed, rows would stay pending
+# and the files would be lost on the next deploy.
+UPLOAD_SPOOL_SYNC = os.environ.get('UPLOAD_SPOOL_SYNC', '1') == '1'
+# With UPLOAD_SPOOL_SYNC=0, run_upload_worker must read the same storage as the
+# web processes: the local directory only works when both run on one machine,
+# so on Render (a disk per service) set UPLOAD_SPOOL_STORAGE to shared storage.
+UPLOAD_SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR', str(BASE_DIR / 'upload_spool' / 'documents'))
+UPLOAD_SPOOL_STORAGE = os.environ.get('UPLOAD_SPOOL_STORAGE', 'django.core.files.storage.FileSystemStorage')
+UPLOAD_SPOOL_STORAGE_OPTIONS = {'location': UPLOAD_SPOOL_DIR} if 'UPLOAD_SPOOL_STORAGE' not in os.environ else {}
+# A claimed row is left to its worker this long (longer than a batch of uploads takes)
+UPLOAD_LEASE_SECONDS = 900
+UPLOAD_MAX_ATTEMPTS = int(os.environ.get('UPLOAD_MAX_ATTEMPTS', 6))
+# Retry n waits base * 2^(n-1) seconds
+UPLOAD_RETRY_BASE_SECONDS = 30
+
+# --- IMAGE PIPELINE (core.images) ---
+# Product photos and logos are resized and re-encoded before they are stored
+IMAGE_MAX_EDGE = int(os.environ.get('IMAGE_MAX_EDGE', 1600))
+# Logos are shown at most 160px wide
+IMAGE_LOGO_MAX_EDGE = 512
+# 'WEBP' falls back to 'JPEG' when Pillow lacks WebP support
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'WEBP')
+IMAGE_TARGET_BYTES = 300 * 1024
+IMAGE_QUALITY_RANGE = (55, 85)
+# Processes for resizing; 0 resizes in the request thread
+IMAGE_PROCESS_WORKERS = int(os.environ.get('IMAGE_PROCESS_WORKERS', 0))
+
+# --- IMAGE DEDUPLICATION (core.imagehash) ---
+# Certificates this close to an earlier one are flagged for admins
+IMAGE_DUPLICATE_DISTANCE = 6
+
+# --- NOTIFICATION HISTORY & RETENTION ---
+NOTIFICATION_PAGE_SIZE = 25
+# Read notifications are purged after this many days, unread ones after the second
+NOTIFICATION_RETENTION_READ_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_READ_DAYS', 30))
+NOTIFICATION_RETENTION_UNREAD_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_UNREAD_DAYS', 180))
+NOTIFICATION_PURGE_BATCH_SIZE = 1000
+
+# --- CHAT WEBSOCKET ---
+# Sends on one socket are buffered this long and written as one batch
+CHAT_WS_FLUSH_MS = 50
+CHAT_WS_BATCH_SIZE = 20
+# Fallback polling interval used by room.html when the socket is down
+CHAT_POLL_INTERVAL_MS = 2000
+# Max changes returned by one sync request (the client loops while has_more)
+CHAT_SYNC_BATCH_SIZE = 100
+# Messages rendered with the room; older pages load as the user scrolls up
+CHAT_HISTORY_PAGE_SIZE = 50
+CHAT_SEARCH_PAGE_SIZE = 20
+
+# --- CHAT ARCHIVE ---
+# `python manage.py archive_chat_messages` moves messages older than this into
+# compressed per-room segments (chat.archive); history pages read through them
+CHAT_ARCHIVE_AFTER_DAYS = int(os.environ.get('CHAT_ARCHIVE_AFTER_DAYS', 180))
+CHAT_ARCHIVE_SEGMENT_SIZE = 1000
+# 'zstd' needs the zstandard package and falls back to gzip without it
+CHAT_ARCHIVE_CODEC = os.environ.get('CHAT_ARCHIVE_CODEC', 'zstd')
+# Storage class for segment payloads; empty keeps them in the database
+CHAT_ARCHIVE_STORAGE = os.environ.get('CHAT_ARCHIVE_STORAGE', '')
+CHAT_ARCHIVE_STORAGE_OPTIONS = {'location': os.environ.get('CHAT_ARCHIVE_LOCATION', str(BASE_DIR / 'chat_archive'))}
+
+# --- CHAT ATTACHMENTS ---
+# Files are uploaded in chunks (chat.attachments) to a local spool, then
+# stored once per sha256 in this storage
+if CLOUDINARY_CLOUD_NAME:
+    CHAT_ATTACHMENT_STORAGE = 'cloudinary_storage.storage.RawMediaCloudinaryStorage'
+    CHAT_ATTACHMENT_STORAGE_OPTIONS = {}
+else:
+    CHAT_ATTACHMENT_STORAGE = 'django.core.files.storage.FileSystemStorage'
+    CHAT_ATTACHMENT_STORAGE_OPTIONS = {'location': str(BASE_DIR / 'media'), 'base_url': MEDIA_URL}
+CHAT_ATTACHMENT_SPOOL_DIR = os.environ.get('CHAT_ATTACHMENT_SPOOL_DIR', str(BASE_DIR / 'upload_spool'))
+CHAT_ATTACHMENT_CHUNK_SIZE = 2 * 1024 * 1024
+CHAT_ATTACHMENT_MAX_BYTES = int(os.environ.get('CHAT_ATTACHMENT_MAX_BYTES', 25 * 1024 * 1024))
+CHAT_ATTACHMENT_TYPES = [
+    'image/jpeg', 'image/png', 'image/webp', 'application/pdf', 'text/csv',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+]
+# Unfinished uploads are dropped by the attachment worker after this long
+CHAT_ATTACHMENT_UPLOAD_TTL_HOURS = 24
+CHAT_ATTACHMENT_PREVIEW_SIZE = 480
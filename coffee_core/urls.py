@@ -25,6 +25,9 @@ urlpatterns = [
     path('roasters/', core_views.marketing_roasters, name='roasters'),
     path('shop-info/', core_views.marketing_shop, name='marketing_shop'),
     path('contact/', core_views.marketing_contact, name='contact'),
+
+    # --- MONITORING ---
+    path('metrics', core_views.prometheus_metrics, name='metrics'),
     
     # --- AUTHENTICATION ---
     path('admin-site/', admin.site.urls), # Renamed to avoid confusion
@@ -75,11 +78,18 @@ urlpatterns = [
     path('messages/', chat_views.chat_inbox, name='chat_inbox'),
     path('messages/<int:user_id>/', chat_views.chat_room, name='chat_room'),
     path('messages/support/', chat_views.contact_admin, name='contact_admin'), 
+    path('messages/search/', chat_views.chat_search, name='chat_search'),
+    path('messages/ticket/<int:room_id>/', chat_views.support_ticket, name='support_ticket'),
+    path('messages/ticket/<int:room_id>/close/', chat_views.close_support_ticket, name='close_support_ticket'),
+    path('messages/room/<int:room_id>/history/', chat_views.chat_history, name='chat_history'),
     # API Routes
     path('api/chat/send/<int:room_id>/', chat_views.send_message_api, name='api_send_message'),
     path('api/chat/manage/', chat_views.manage_message, name='api_manage_message'),
     path('api/chat/get/<int:room_id>/', chat_views.get_updates, name='api_get_updates'),
+    path('api/chat/sync/<int:room_id>/', chat_views.sync_messages, name='api_sync_messages'),
     path('api/chat/clear/<int:room_id>/', chat_views.clear_chat_history, name='api_clear_chat'),
+    path('api/chat/attachments/<int:room_id>/', chat_views.start_attachment_upload, name='api_start_upload'),
+    path('api/chat/uploads/<uuid:upload_id>/', chat_views.attachment_upload, name='api_attachment_upload'),
     
     # --- notifications ---
     path('notifications/read/<int:notif_id>/', mark_notification_read, name='mark_read'),
@@ -0,0 +1,72 @@
+import json
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from .instrumentation import InstrumentedConsumerMixin
+from .presence import get_presence
+from .realtime import unread_counts, user_group
+
+
+class PresenceMixin:
+    """
+    Counts the socket in core.presence while it is open. Clients send
+    {"action": "heartbeat"} every PRESENCE_HEARTBEAT_SECONDS to keep it alive.
+    """
+
+    async def presence_connect(self, user_id):
+        self.presence_user_id = user_id
+        await sync_to_async(get_presence().connect)(user_id)
+
+    async def presence_heartbeat(self):
+        await sync_to_async(get_presence().heartbeat)(self.presence_user_id)
+
+    async def presence_disconnect(self):
+        if getattr(self, 'presence_user_id', None) is not None:
+            await sync_to_async(get_presence().disconnect)(self.presence_user_id)
+
+    async def is_online(self, user_id):
+        return user_id in await sync_to_async(get_presence().online)([user_id])
+
+
+class NotificationConsumer(InstrumentedConsumerMixin, PresenceMixin, AsyncWebsocketConsumer):
+    """
+    Per-user socket that receives `notification.new` events for the badge.
+    Open on every page, so it also carries the user's presence heartbeat.
+    """
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+
+        self.group_name = user_group(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        await self.presence_connect(user.id)
+
+        count = await self.get_unread_count(user.id)
+        await self.send(text_data=json.dumps({'type': 'unread_count', 'unread_count': count}))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.presence_disconnect()
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+        except ValueError:
+            return
+        if data.get('action') == 'heartbeat':
+            await self.presence_heartbeat()
+
+    async def notification_new(self, event):
+        payload = dict(event, type='notification')
+        await self.send(text_data=json.dumps(payload))
+
+    @database_sync_to_async
+    def get_unread_count(self, user_id):
+        return unread_counts([user_id])[user_id]
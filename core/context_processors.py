@@ -1,8 +1,24 @@
+import time
+
+from django.conf import settings
+
 from .models import Notification
 
 def user_notifications(request):
     if request.user.is_authenticated:
         # Get unread notifications
         notifs = Notification.objects.filter(recipient=request.user, is_read=False).order_by('-created_at')
-        return {'notifications': notifs, 'notification_count': notifs.count()}
-    return {'notification_count': 0}
\ No newline at end of file
+        return {
+            'notifications': notifs,
+            'notification_count': notifs.count(),
+            'presence_heartbeat_ms': settings.PRESENCE_HEARTBEAT_SECONDS * 1000,
+        }
+    return {'notification_count': 0}
+
+
+def render_timer(request):
+    # Template rendering starts here; core.instrumentation reports the rest of the request as render time
+    recorder = getattr(request, '_instrumentation', None)
+    if recorder is not None and recorder.render_started is None:
+        recorder.render_started = time.perf_counter()
+    return {}
@@ -0,0 +1,150 @@
+"""
+Near-duplicate detection for uploaded images.
+
+Every product photo, logo and certificate gets a 64-bit dHash: a 9x8
+greyscale thumbnail, one bit per pair of horizontal neighbours. Re-encoded,
+resized or lightly recompressed copies of an image land within a few bits
+of each other. Hashes are kept in core.ImageHash.
+
+Lookups use multi-index hashing. The hash is split into four 16-bit chunks,
+each with its own index. Two hashes within distance d agree on at least one
+chunk to within d // 4 bits. A search therefore only reads rows matching a
+neighbour of one of the query's chunks, then checks the full distance in
+Python.
+
+- When a seller uploads a file byte for byte identical to one of their own
+  stored images (same sha256), the stored Cloudinary asset is reused
+  instead of uploading a copy. dHash is never used for this: different
+  images can share a hash.
+- A certificate within IMAGE_DUPLICATE_DISTANCE of any earlier certificate
+  is linked to it through duplicate_of, so admins see it flagged.
+"""
+import hashlib
+import itertools
+
+from django.apps import apps
+from django.db.models import Q
+
+from . import metrics
+from .images import dhash
+from .models import ImageHash
+
+BITS = 64
+CHUNKS = 4
+CHUNK_BITS = BITS // CHUNKS
+MASK = 2 ** BITS - 1
+
+# kind -> (model, image field)
+KINDS = {
+    'product': ('market.Product', 'image'),
+    'logo': ('market.BusinessProfile', 'logo'),
+    'certificate': ('market.BusinessCertification', 'document_image'),
+}
+
+
+def hash_upload(uploaded):
+    """dHash of an uploaded file, or None when Pillow can't read it (PDFs, for one)."""
+    from PIL import Image, ImageOps
+
+    try:
+        uploaded.seek(0)
+        image = Image.open(uploaded)
+        image.draft('L', (64, 64))
+        value = dhash(ImageOps.exif_transpose(image))
+    except (OSError, Image.DecompressionBombError):
+        value = None
+    uploaded.seek(0)
+    return value
+
+
+def content_hash(uploaded):
+    """sha256 hex digest of an uploaded file's bytes."""
+    digest = hashlib.sha256()
+    uploaded.seek(0)
+    for chunk in uploaded.chunks():
+        digest.update(chunk)
+    uploaded.seek(0)
+    return digest.hexdigest()
+
+
+def distance(a, b):
+    return bin((a ^ b) & MASK).count('1')
+
+
+def chunks(value):
+    return [(value >> (CHUNK_BITS * i)) & (2 ** CHUNK_BITS - 1) for i in range(CHUNKS)]
+
+
+def _signed(value):
+    return value - 2 ** BITS if value >= 2 ** (BITS - 1) else value
+
+
+def _neighbours(chunk, radius):
+    """Every chunk value within `radius` bits of `chunk`."""
+    values = [chunk]
+    for r in range(1, radius + 1):
+        for positions in itertools.combinations(range(CHUNK_BITS), r):
+            flipped = chunk
+            for position in positions:
+                flipped ^= 1 << position
+            values.append(flipped)
+    return values
+
+
+def similar(kind, value, max_distance, owner=None, exclude=None):
+    """
+    ImageHash rows of `kind` within `max_distance` bits of `value`, closest
+    (then oldest) first, each with a .distance attribute.
+    """
+    radius = max_distance // CHUNKS
+    query = Q()
+    for i, chunk in enumerate(chunks(value)):
+        query |= Q(**{f'chunk_{i}__in': _neighbours(chunk, radius)})
+    candidates = ImageHash.objects.filter(query, kind=kind)
+    if owner is not None:
+        candidates = candidates.filter(owner=owner)
+    if exclude is not None:
+        candidates = candidates.exclude(object_id=exclude.pk)
+
+    found = []
+    for row in candidates:
+        row.distance = distance(row.dhash, value)
+        if row.distance <= max_distance:
+            found.append(row)
+    return sorted(found, key=lambda row: (row.distance, row.id))
+
+
+def record(kind, obj, value, owner, sha256=''):
+    chunk_values = {f'chunk_{i}': chunk for i, chunk in enumerate(chunks(value))}
+    ImageHash.objects.update_or_create(
+        kind=kind, object_id=obj.pk,
+        defaults=dict(owner=owner, dhash=_signed(value), sha256=sha256, **chunk_values),
+    )
+
+
+def _objects(kind, rows):
+    found = apps.get_model(KINDS[kind][0]).objects.in_bulk([row.object_id for row in rows])
+    return [(row, found.get(row.object_id)) for row in rows]
+
+
+def reusable_asset(kind, sha256, owner):
+    """
+    The stored image of one of `owner`'s earlier uploads with the same
+    content hash, ready to assign to the new row's field, or None.
+    """
+    field = KINDS[kind][1]
+    rows = ImageHash.objects.filter(owner=owner, kind=kind, sha256=sha256).order_by('id')
+    for row, obj in _objects(kind, rows):
+        asset = getattr(obj, field, None) if obj is not None else None
+        if asset:
+            metrics.incr('images_reused', kind=kind)
+            return asset
+    return None
+
+
+def closest(kind, value, max_distance, exclude=None):
+    """The existing object of `kind` whose image is nearest `value` (the oldest on ties), or None."""
+    for row, obj in _objects(kind, similar(kind, value, max_distance, exclude=exclude)):
+        if obj is not None:
+            return obj
+    return None
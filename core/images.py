@@ -0,0 +1,217 @@
+"""
+Image preprocessing for product photos and business logos.
+
+prepare() runs an uploaded image through the pipeline before it reaches
+Cloudinary:
+
+- it applies the EXIF orientation, then drops EXIF (GPS, camera serials);
+- it downscales to IMAGE_MAX_EDGE. JPEGs are decoded straight at a reduced
+  scale, so a 12 MP photo never gets decoded in full;
+- it re-encodes as WebP, or JPEG when Pillow was built without WebP. The
+  quality is the highest one in IMAGE_QUALITY_RANGE that fits
+  IMAGE_TARGET_BYTES;
+- it returns the width, height and a blurhash placeholder to store next to
+  the image, plus a dHash for core.imagehash.
+
+With IMAGE_PROCESS_WORKERS > 0 the work runs in a process pool. The request
+thread then waits without holding the GIL, so other threads keep serving.
+"""
+import io
+import math
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+ProcessedImage = namedtuple('ProcessedImage', 'file width height blurhash dhash')
+
+CONTENT_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg'}
+
+
+class ImageError(ValueError):
+    pass
+
+
+def prepare(uploaded, max_edge=None):
+    """Processes an UploadedFile. Returns a ProcessedImage whose file is ready for a CloudinaryField."""
+    uploaded.seek(0)
+    data = uploaded.read()
+    options = {
+        'max_edge': max_edge or settings.IMAGE_MAX_EDGE,
+        'target_bytes': settings.IMAGE_TARGET_BYTES,
+        'quality_range': tuple(settings.IMAGE_QUALITY_RANGE),
+        'format': settings.IMAGE_FORMAT,
+    }
+    executor = _executor()
+    if executor is None:
+        content, fmt, width, height, placeholder, digest = process(data, **options)
+    else:
+        content, fmt, width, height, placeholder, digest = executor.submit(process, data, **options).result()
+
+    stem = os.path.splitext(os.path.basename(uploaded.name or 'image'))[0][:100] or 'image'
+    extension = 'webp' if fmt == 'WEBP' else 'jpg'
+    file = SimpleUploadedFile(f"{stem}.{extension}", content, content_type=CONTENT_TYPES[fmt])
+    return ProcessedImage(file, width, height, placeholder, digest)
+
+
+def process(data, max_edge, target_bytes, quality_range, format='WEBP'):
+    """
+    The pipeline itself, on raw bytes so it can run in a pool worker. Returns
+    (content, format, width, height, blurhash, dhash).
+    """
+    from PIL import Image, ImageOps, features
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        # JPEG only: lets the decoder scale down by 1/2..1/8 while reading
+        image.draft('RGB', (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageError(f"Not a usable image: {e}")
+
+    if format == 'WEBP' and not features.check('webp'):
+        format = 'JPEG'
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    if format == 'WEBP' and has_alpha:
+        image = image.convert('RGBA')
+    elif has_alpha:
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+        image = background
+    else:
+        image = image.convert('RGB')
+
+    content = encode(image, format, target_bytes, quality_range)
+    return content, format, image.width, image.height, blurhash(image), dhash(image)
+
+
+def encode(image, format, target_bytes, quality_range):
+    """Highest quality in `quality_range` whose output fits `target_bytes` (the lowest if none does)."""
+    low, high = quality_range
+    best = None
+    while low <= high:
+        quality = (low + high) // 2
+        content = _save(image, format, quality)
+        if len(content) <= target_bytes:
+            best = content
+            low = quality + 1
+        else:
+            high = quality - 1
+    return best if best is not None else _save(image, format, quality_range[0])
+
+
+def _save(image, format, quality):
+    output = io.BytesIO()
+    # No exif= and no info passthrough, so EXIF is gone; the ICC profile keeps colours right
+    options = {'quality': quality, 'icc_profile': image.info.get('icc_profile')}
+    if format == 'JPEG':
+        options.update(optimize=True, progressive=True)
+    else:
+        options.update(method=4)
+    image.save(output, format, **options)
+    return output.getvalue()
+
+
+# --- Blurhash ---
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+def _base83(value, length):
+    return ''.join(BASE83[value // 83 ** (length - i - 1) % 83] for i in range(length))
+
+
+def _to_linear(value):
+    value /= 255
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def _to_srgb(value):
+    value = max(0.0, min(1.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value, exponent):
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def blurhash(image, x_components=4, y_components=3):
+    """Blurhash (https://blurha.sh) of a PIL image, computed on a 32px thumbnail."""
+    small = image.convert('RGB')
+    small.thumbnail((32, 32))
+    width, height = small.size
+    linear = [tuple(_to_linear(c) for c in pixel) for pixel in small.getdata()]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            scale = (1 if i == j == 0 else 2) / (width * height)
+            r = g = b = 0.0
+            for y in range(height):
+                basis_y = math.cos(math.pi * j * y / height)
+                row = y * width
+                for x in range(width):
+                    basis = basis_y * math.cos(math.pi * i * x / width)
+                    pr, pg, pb = linear[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised_max = max(0, min(82, int(max(abs(c) for f in ac for c in f) * 166 - 0.5)))
+        maximum = (quantised_max + 1) / 166
+    else:
+        quantised_max, maximum = 0, 1
+    result += _base83(quantised_max, 1)
+    result += _base83((_to_srgb(dc[0]) << 16) + (_to_srgb(dc[1]) << 8) + _to_srgb(dc[2]), 4)
+    for factor in ac:
+        q = [max(0, min(18, int(math.floor(_sign_pow(c / maximum, 0.5) * 9 + 9.5)))) for c in factor]
+        result += _base83(q[0] * 19 * 19 + q[1] * 19 + q[2], 2)
+    return result
+
+
+def dhash(image):
+    """64-bit difference hash (one bit per pair of neighbours on a 9x8 greyscale thumbnail), unsigned."""
+    from PIL import Image
+
+    pixels = list(image.convert('L').resize((9, 8), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] < pixels[row * 9 + col + 1])
+    return value
+
+
+# --- Process pool ---
+_pool = None
+
+
+def _executor():
+    global _pool
+    if settings.IMAGE_PROCESS_WORKERS <= 0:
+        return None
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=settings.IMAGE_PROCESS_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+@receiver(setting_changed)
+def _image_setting_changed(setting, **kwargs):
+    if setting == 'IMAGE_PROCESS_WORKERS':
+        shutdown_pool()
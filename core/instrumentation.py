@@ -0,0 +1,154 @@
+"""
+Per-view SQL and latency instrumentation.
+
+InstrumentationMiddleware times every request into
+http_request_duration_seconds{view}. A sampled share of requests
+(INSTRUMENTATION_SAMPLE_RATE) also records:
+
+- http_request_queries{view} and http_request_sql_seconds{view};
+- http_render_seconds{view}, from the first context processor call until
+  the view returns (template rendering, including queries run by lazy
+  querysets in the template);
+- n_plus_one_suspected{view, shape}, when one SQL statement runs at least
+  INSTRUMENTATION_N_PLUS_ONE_THRESHOLD times in the request. The shape is a
+  short hash of the SQL; the statement itself is logged with it.
+
+InstrumentedConsumerMixin does the same for Channels consumers, per
+handled message, as ws_event_*{consumer, event}.
+
+Queries are seen through a Django execute wrapper installed on every
+connection. When nothing is being recorded, it costs one ContextVar lookup
+per query. The recorder lives in a ContextVar, so it follows
+database_sync_to_async calls into their worker threads. Everything ends up
+in core.metrics, served in Prometheus format at /metrics.
+"""
+import hashlib
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('instrumentation_recorder', default=None)
+
+
+class Recorder:
+    __slots__ = ('queries', 'sql_seconds', 'statements', 'render_started')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        # Raw SQL (placeholders, not params), so repeats of one ORM call share a key
+        self.statements = Counter()
+        self.render_started = None
+
+
+def _execute(execute, sql, params, many, context):
+    recorder = _current.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.queries += 1
+        recorder.sql_seconds += time.perf_counter() - started
+        recorder.statements[sql] += 1
+
+
+def install(db_connection):
+    if _execute not in db_connection.execute_wrappers:
+        db_connection.execute_wrappers.append(_execute)
+
+
+@receiver(connection_created)
+def _install_on_connect(sender, connection, **kwargs):
+    install(connection)
+
+
+def sampled():
+    if not settings.INSTRUMENTATION_ENABLED:
+        return False
+    rate = settings.INSTRUMENTATION_SAMPLE_RATE
+    return rate >= 1 or random.random() < rate
+
+
+def shape(sql):
+    """Short, stable id for a statement (IN lists of any length count as one shape)."""
+    normalized = re.sub(r'\((?:%s, )+%s\)', '(...)', ' '.join(sql.split()))
+    return hashlib.sha1(normalized.encode()).hexdigest()[:10]
+
+
+def report(recorder, prefix, **labels):
+    metrics.observe(f'{prefix}_queries', recorder.queries, buckets=metrics.COUNT_BUCKETS, **labels)
+    metrics.observe(f'{prefix}_sql_seconds', recorder.sql_seconds, **labels)
+    for sql, count in recorder.statements.items():
+        if count >= settings.INSTRUMENTATION_N_PLUS_ONE_THRESHOLD:
+            statement_shape = shape(sql)
+            metrics.incr('n_plus_one_suspected', shape=statement_shape, **labels)
+            logger.warning("Likely N+1 in %s: %s x [%s] %s", labels, count, statement_shape, sql[:500])
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+class InstrumentationMiddleware:
+    """Goes first in MIDDLEWARE, so session and auth queries are counted too."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        recorder = token = None
+        if sampled():
+            install(connection)
+            recorder = request._instrumentation = Recorder()
+            token = _current.set(recorder)
+        try:
+            response = self.get_response(request)
+        finally:
+            if token is not None:
+                _current.reset(token)
+
+        finished = time.perf_counter()
+        view = view_label(request)
+        metrics.observe('http_request_duration_seconds', finished - started, view=view)
+        metrics.incr('http_requests', view=view, status=f"{response.status_code // 100}xx")
+        if recorder is not None:
+            report(recorder, 'http_request', view=view)
+            if recorder.render_started is not None:
+                metrics.observe('http_render_seconds', finished - recorder.render_started, view=view)
+        return response
+
+
+class InstrumentedConsumerMixin:
+    """Times each message a consumer handles; sampled ones also record their SQL."""
+
+    async def dispatch(self, message):
+        started = time.perf_counter()
+        recorder = token = None
+        if sampled():
+            recorder = Recorder()
+            token = _current.set(recorder)
+        try:
+            await super().dispatch(message)
+        finally:
+            if token is not None:
+                _current.reset(token)
+            labels = {'consumer': type(self).__name__, 'event': message.get('type', '')}
+            metrics.observe('ws_event_duration_seconds', time.perf_counter() - started, **labels)
+            if recorder is not None:
+                report(recorder, 'ws_event', **labels)
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.retention import delete_in_batches, purgeable_notifications, retention_cutoffs
+
+
+class Command(BaseCommand):
+    help = "Deletes read or expired notifications in bounded batches (see NOTIFICATION_RETENTION_* settings)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.NOTIFICATION_PURGE_BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=0, help="Seconds to sleep between batches.")
+        parser.add_argument('--lock-timeout', type=int, default=2000, help="Per-batch lock timeout in ms (Postgres).")
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be deleted.")
+
+    def handle(self, *args, **options):
+        read_cutoff, unread_cutoff = retention_cutoffs()
+        self.stdout.write(
+            f"Purging read notifications older than {read_cutoff:%Y-%m-%d %H:%M} "
+            f"and all notifications older than {unread_cutoff:%Y-%m-%d %H:%M}"
+        )
+
+        queryset = purgeable_notifications()
+        if options['dry_run']:
+            self.stdout.write(f"Dry run: {queryset.count()} notifications would be deleted.")
+            return
+
+        stats = delete_in_batches(
+            queryset,
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            lock_timeout_ms=options['lock_timeout'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {stats['deleted']} notifications in {stats['batches']} batches, "
+            f"{stats['seconds']:.1f}s ({stats['rows_per_second']:.0f} rows/s), "
+            f"{stats['lock_waits']} lock waits."
+        ))
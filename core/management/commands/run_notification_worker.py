@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.outbox import drain_outbox, outbox_stats
+
+
+class Command(BaseCommand):
+    help = "Drains the notification outbox into the Notification table in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to sleep when the outbox is empty.")
+        parser.add_argument('--once', action='store_true', help="Drain what is queued now, then exit.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        interval = options['interval']
+        delivered_total = 0
+
+        stats = outbox_stats()
+        self.stdout.write(f"Notification worker started: {stats['pending']} pending, lag {stats['lag_seconds']:.1f}s")
+
+        try:
+            while True:
+                started = time.monotonic()
+                delivered = drain_outbox(batch_size)
+                delivered_total += delivered
+
+                if delivered:
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(f"Delivered {delivered} notifications in {elapsed * 1000:.0f}ms")
+                    continue
+
+                if options['once']:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f"Worker stopped. Delivered {delivered_total} notifications."))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.uploads import push_pending, upload_stats
+
+
+class Command(BaseCommand):
+    help = "Pushes spooled seller documents to storage, retrying failed uploads with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds to sleep when nothing is due.")
+        parser.add_argument('--once', action='store_true', help="Push what is due now, then exit.")
+
+    def handle(self, *args, **options):
+        attempted_total = 0
+        for label, counts in upload_stats().items():
+            self.stdout.write(f"{label}: {counts['pending']} pending, {counts['failed']} failed")
+
+        try:
+            while True:
+                started = time.monotonic()
+                attempted = push_pending(options['batch_size'])
+                attempted_total += attempted
+
+                if attempted:
+                    self.stdout.write(f"Attempted {attempted} uploads in {time.monotonic() - started:.1f}s")
+                    continue
+
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f"Worker stopped. Attempted {attempted_total} uploads."))
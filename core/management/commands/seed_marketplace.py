@@ -0,0 +1,326 @@
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import timezone
+
+from chat.models import ChatParticipant, ChatRoom, Message
+from core.models import Notification
+from market.models import BusinessCertification, BusinessProfile, Order, Product
+
+User = get_user_model()
+
+ORIGINS = [
+    ('Ethiopia', ['Addis Ababa', 'Jimma', 'Sidama', 'Yirgacheffe', 'Guji', 'Harar']),
+    ('Kenya', ['Nyeri', 'Kiambu', 'Murang\'a']),
+    ('Colombia', ['Huila', 'Nariño', 'Medellín']),
+    ('Brazil', ['Minas Gerais', 'São Paulo']),
+    ('Rwanda', ['Huye', 'Nyamasheke']),
+    ('Germany', ['Hamburg', 'Berlin']),
+    ('United States', ['Seattle', 'Portland', 'New York']),
+]
+REGIONS = ['Yirgacheffe', 'Sidamo', 'Guji', 'Limu', 'Jimma', 'Harar', 'Kaffa', 'Nyeri', 'Huila', 'Cerrado']
+PROCESSES = ['Washed', 'Natural', 'Honey', 'Anaerobic Natural']
+GRADES = ['Grade 1', 'Grade 2', 'Grade 3', 'Specialty', 'Commercial']
+EQUIPMENT = ['Drum Roaster 5kg', 'Hulling Machine', 'Moisture Meter', 'Grinder EK43', 'Drying Bed Kit']
+CERTS = ['Fair Trade', 'USDA Organic', 'Rainforest', 'UTZ', 'Export License', 'Import License']
+# Share of orders per status
+ORDER_STATUSES = [('Pending', 10), ('Accepted', 8), ('Declined', 5), ('Paid', 22), ('Shipped', 20), ('Delivered', 35)]
+LINES = [
+    "Hello, is the {region} lot still available?",
+    "What is your price per kg for {qty}kg?",
+    "Can you share the cupping score and moisture level?",
+    "We can do {price} USD per kg FOB Djibouti.",
+    "Samples ship tomorrow by courier.",
+    "Great, please send the proforma invoice.",
+    "Payment sent, please confirm.",
+    "The container is booked for next week.",
+    "Thanks! The beans arrived in perfect condition.",
+]
+
+
+def zipf_cum_weights(n, alpha):
+    """Cumulative weights for random.choices: item k is picked in proportion to 1 / (k + 1)^alpha."""
+    return list(itertools.accumulate(1 / (rank + 1) ** alpha for rank in range(n)))
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Lets bulk_create keep the generated dates instead of auto_now/auto_now_add."""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the database with synthetic coffee-trade data: sellers, buyers, profiles, "
+        "certificates, products, orders, chat rooms, messages and notifications. "
+        "Sellers, products, buyers and rooms follow power-law popularity, so a few sellers "
+        "get most orders and a few rooms most messages. Rows go in with bulk_create in "
+        "chunks; no images are uploaded. Same --seed, same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sellers', type=int, default=200)
+        parser.add_argument('--buyers', type=int, default=2000)
+        parser.add_argument('--products', type=int, default=3000)
+        parser.add_argument('--orders', type=int, default=50000)
+        parser.add_argument('--rooms', type=int, default=None, help="Buyer-seller chat rooms (default: buyers // 2).")
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--notifications', type=int, default=None,
+                            help="Order notifications for sellers (default: orders // 10).")
+        parser.add_argument('--alpha', type=float, default=1.1, help="Power-law exponent; higher is more skewed.")
+        parser.add_argument('--days', type=int, default=365, help="Spread dates over this many past days.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='seed', help="Username prefix; must not be in use yet.")
+        parser.add_argument('--password', default='coffee-seed', help="Password of every generated user.")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if options['sellers'] < 1 or options['buyers'] < 1:
+            raise CommandError("--sellers and --buyers must be positive.")
+        if options['orders'] and not options['products']:
+            raise CommandError("--orders needs --products.")
+        if User.objects.filter(username__startswith=f"{options['prefix']}_").exists():
+            raise CommandError(f"Users named {options['prefix']}_* already exist; pass another --prefix.")
+
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.span = timedelta(days=options['days']).total_seconds()
+        started = time.perf_counter()
+
+        with explicit_timestamps(
+            Product._meta.get_field('created_at'),
+            Order._meta.get_field('created_at'),
+            BusinessCertification._meta.get_field('uploaded_at'),
+            ChatRoom._meta.get_field('updated_at'),
+            Message._meta.get_field('timestamp'),
+            Message._meta.get_field('updated_at'),
+        ):
+            self.step("Users and profiles", self.create_users)
+            self.step("Certificates", self.create_certificates)
+            self.step("Products", self.create_products)
+            self.step("Orders", self.create_orders)
+            self.step("Chat", self.create_chat)
+
+        self.stdout.write(self.style.SUCCESS(f"Seeded in {time.perf_counter() - started:.1f}s. "
+                                             f"Log in as {options['prefix']}_seller_0 / {options['password']}."))
+
+    def step(self, label, create):
+        started = time.perf_counter()
+        counts = create()
+        summary = ', '.join(f"{count} {name}" for name, count in counts.items())
+        self.stdout.write(f"  {label:<20} {summary} ({time.perf_counter() - started:.1f}s)")
+
+    def past(self, max_seconds=None):
+        return self.now - timedelta(seconds=self.rng.uniform(0, max_seconds or self.span))
+
+    def bulk(self, model, objects):
+        created = 0
+        for chunk in chunked(objects, self.batch_size):
+            model.objects.bulk_create(chunk)
+            created += len(chunk)
+        return created
+
+    # --- Users ---
+    def create_users(self):
+        rng, prefix = self.rng, self.options['prefix']
+        # One hash for everyone; hashing a million passwords would take hours
+        password = make_password(self.options['password'])
+        sellers = [
+            User(username=f"{prefix}_seller_{i}", email=f"{prefix}_seller_{i}@example.com", password=password,
+                 role=User.SELLER, is_verified=rng.random() < 0.85, date_joined=self.past(),
+                 package_tier=rng.choices([User.BASIC, User.PREMIUM, User.PROFESSIONAL], weights=[70, 20, 10])[0])
+            for i in range(self.options['sellers'])
+        ]
+        buyers = [
+            User(username=f"{prefix}_buyer_{i}", email=f"{prefix}_buyer_{i}@example.com", password=password,
+                 role=User.BUYER, date_joined=self.past())
+            for i in range(self.options['buyers'])
+        ]
+        # Kept whole (ids come back from bulk_create): later steps pick from them
+        self.sellers = [user for chunk in chunked(sellers, self.batch_size) for user in User.objects.bulk_create(chunk)]
+        self.buyers = [user for chunk in chunked(buyers, self.batch_size) for user in User.objects.bulk_create(chunk)]
+
+        # bulk_create skips the post_save receiver that normally adds these
+        profiles = [self.seller_profile(seller) for seller in self.sellers]
+        profiles += [BusinessProfile(user=buyer) for buyer in self.buyers]
+        self.profiles = {profile.user_id: profile for chunk in chunked(profiles, self.batch_size)
+                         for profile in BusinessProfile.objects.bulk_create(chunk)}
+        return {'sellers': len(self.sellers), 'buyers': len(self.buyers), 'profiles': len(self.profiles)}
+
+    def seller_profile(self, seller):
+        rng = self.rng
+        country, cities = rng.choice(ORIGINS)
+        region = rng.choice(REGIONS)
+        return BusinessProfile(
+            user=seller,
+            company_name=f"{region} {rng.choice(['Coffee Union', 'Roasters', 'Export PLC', 'Farmers Coop', 'Trading'])} {seller.id}",
+            country=country, city=rng.choice(cities),
+            is_farmer=rng.random() < 0.4, is_roaster=rng.random() < 0.3,
+            is_exporter=rng.random() < 0.3, is_supplier=rng.random() < 0.1,
+            description=f"{rng.choice(PROCESSES)} {region} coffee, {rng.choice(GRADES).lower()}.",
+            core_products=', '.join(rng.sample(REGIONS, 3)),
+        )
+
+    def create_certificates(self):
+        rng = self.rng
+        certs = (
+            BusinessCertification(
+                profile=self.profiles[seller.id], name=name, authority_name=f"{name} Authority",
+                expiry_date=(self.now + timedelta(days=rng.randint(-60, 900))).date(),
+                is_verified=rng.random() < 0.7, uploaded_at=self.past(),
+            )
+            for seller in self.sellers for name in rng.sample(CERTS, rng.randint(0, 3))
+        )
+        return {'certificates': self.bulk(BusinessCertification, certs)}
+
+    # --- Catalogue and orders ---
+    def create_products(self):
+        rng = self.rng
+        owners = rng.choices(self.sellers, cum_weights=zipf_cum_weights(len(self.sellers), self.options['alpha']),
+                             k=self.options['products'])
+        products = []
+        for seller in owners:
+            category = rng.choices(['Green', 'Roasted', 'Ground', 'Equipment'], weights=[50, 30, 12, 8])[0]
+            if category == 'Equipment':
+                name, price = rng.choice(EQUIPMENT), rng.uniform(150, 9000)
+            else:
+                name, price = f"{rng.choice(REGIONS)} {rng.choice(PROCESSES)} {rng.choice(GRADES)}", rng.uniform(3, 25)
+            products.append(Product(
+                seller=seller, name=name, category=category, price=Decimal(f"{price:.2f}"),
+                description=f"{name}. Harvest {self.now.year - rng.randint(0, 2)}, {rng.randint(60, 600)} bags available.",
+                is_active=rng.random() < 0.9, created_at=self.past(),
+            ))
+        # Only what orders need, not a million model instances
+        self.products = [
+            (product.id, product.seller_id, product.name, product.price)
+            for chunk in chunked(products, self.batch_size) for product in Product.objects.bulk_create(chunk)
+        ]
+        return {'products': len(self.products)}
+
+    def create_orders(self):
+        rng, n_orders = self.rng, self.options['orders']
+        product_weights = zipf_cum_weights(len(self.products), self.options['alpha'])
+        buyer_weights = zipf_cum_weights(len(self.buyers), self.options['alpha'])
+        statuses, status_weights = zip(*ORDER_STATUSES)
+        n_notifications = self.options['notifications']
+        notify_rate = (n_notifications if n_notifications is not None else n_orders // 10) / max(1, n_orders)
+        seller_orders = reverse('seller_orders')
+
+        created = notified = 0
+        while created < n_orders:
+            size = min(self.batch_size, n_orders - created)
+            products = rng.choices(self.products, cum_weights=product_weights, k=size)
+            buyers = rng.choices(self.buyers, cum_weights=buyer_weights, k=size)
+            orders, notifications = [], []
+            for (product_id, seller_id, name, price), buyer, status in zip(
+                products, buyers, rng.choices(statuses, weights=status_weights, k=size)
+            ):
+                # Mostly small lots, a few container-sized ones
+                quantity = min(int(rng.paretovariate(1.5)), 500)
+                created_at = self.past()
+                orders.append(Order(buyer=buyer, product_id=product_id, status=status, quantity=quantity,
+                                    total_price=price * quantity, created_at=created_at))
+                if rng.random() < notify_rate:
+                    notifications.append(Notification(
+                        recipient_id=seller_id, sender=buyer, notification_type='order',
+                        message=f"New Order: {quantity}kg of {name}"[:255], link=seller_orders,
+                        is_read=created_at < self.now - timedelta(days=7), created_at=created_at,
+                    ))
+            Order.objects.bulk_create(orders)
+            Notification.objects.bulk_create(notifications)
+            created += size
+            notified += len(notifications)
+        return {'orders': created, 'notifications': notified}
+
+    # --- Chat ---
+    def create_chat(self):
+        rng, alpha = self.rng, self.options['alpha']
+        n_rooms = self.options['rooms'] if self.options['rooms'] is not None else len(self.buyers) // 2
+        n_rooms = min(n_rooms, len(self.buyers) * len(self.sellers))
+        seller_weights = zipf_cum_weights(len(self.sellers), alpha)
+        pairs = set()
+        while len(pairs) < n_rooms:
+            seller = rng.choices(self.sellers, cum_weights=seller_weights)[0]
+            buyer = rng.choice(self.buyers)
+            pairs.add((min(seller.id, buyer.id), max(seller.id, buyer.id)))
+        pairs = sorted(pairs)
+        if not pairs:
+            return {'rooms': 0, 'messages': 0}
+
+        # Chatty rooms: message counts follow the same power law
+        counts = [0] * len(pairs)
+        for index in rng.choices(range(len(pairs)), cum_weights=zipf_cum_weights(len(pairs), alpha), k=self.options['messages']):
+            counts[index] += 1
+        rng.shuffle(counts)
+
+        # Message timestamps per room, so the room's last_seq and updated_at are known up front
+        timelines = []
+        rooms = []
+        for (low, high), count in zip(pairs, counts):
+            started = self.past()
+            seconds = (self.now - started).total_seconds()
+            timeline = sorted(started + timedelta(seconds=rng.uniform(0, seconds)) for _ in range(count))
+            timelines.append(timeline)
+            rooms.append(ChatRoom(participant_1_id=low, participant_2_id=high, last_seq=count,
+                                  updated_at=timeline[-1] if timeline else started))
+        rooms = [room for chunk in chunked(rooms, self.batch_size) for room in ChatRoom.objects.bulk_create(chunk)]
+
+        # Rooms made with bulk_create need their participants added by hand
+        participants, notifications = [], []
+        for room in rooms:
+            for user_id, other_id in ((room.participant_1_id, room.participant_2_id), (room.participant_2_id, room.participant_1_id)):
+                read = room.last_seq if rng.random() < 0.8 else rng.randint(0, room.last_seq)
+                participants.append(ChatParticipant(room=room, user_id=user_id, last_read_seq=read))
+                if read < room.last_seq:
+                    notifications.append(Notification(
+                        recipient_id=user_id, sender_id=other_id, room=room, notification_type='message',
+                        message=f"New message from {self.username(other_id)}",
+                        link=reverse('chat_room', args=[other_id]),
+                        event_count=room.last_seq - read, created_at=room.updated_at,
+                    ))
+        self.bulk(ChatParticipant, participants)
+        self.bulk(Notification, notifications)
+
+        def messages():
+            for room, timeline in zip(rooms, timelines):
+                members = (room.participant_1_id, room.participant_2_id)
+                sender_id = rng.choice(members)
+                for seq, sent_at in enumerate(timeline, start=1):
+                    if rng.random() < 0.4:  # Replies come in runs
+                        sender_id = members[1] if sender_id == members[0] else members[0]
+                    yield Message(
+                        room=room, sender_id=sender_id, seq=seq, created_seq=seq, timestamp=sent_at, updated_at=sent_at,
+                        content=rng.choice(LINES).format(region=rng.choice(REGIONS), qty=rng.choice([60, 300, 1200, 19200]),
+                                                         price=f"{rng.uniform(3, 9):.2f}"),
+                    )
+
+        return {'rooms': len(rooms), 'participants': len(participants),
+                'messages': self.bulk(Message, messages()), 'notifications': len(notifications)}
+
+    def username(self, user_id):
+        if not hasattr(self, 'usernames'):
+            self.usernames = {user.id: user.username for user in self.sellers + self.buyers}
+        return self.usernames[user_id]
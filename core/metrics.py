@@ -0,0 +1,121 @@
+"""
+Tiny in-process metrics registry (counters, gauges and histograms).
+
+Values live in the current process only; workers and web processes each keep
+their own set. render_prometheus() formats them for the /metrics endpoint.
+"""
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = {}
+
+# Seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Things like queries per request
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def incr(name, value=1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """Adds `value` to a histogram. The first observation fixes its buckets."""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': tuple(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+        index = bisect_left(histogram['buckets'], value)
+        if index < len(histogram['counts']):
+            histogram['counts'][index] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+def get_value(name, **labels):
+    key = _key(name, labels)
+    with _lock:
+        if key in _gauges:
+            return _gauges[key]
+        return _counters.get(key, 0)
+
+
+def get_histogram(name, **labels):
+    """{'buckets', 'counts', 'sum', 'count'} (counts per bucket, not cumulative), or None."""
+    with _lock:
+        histogram = _histograms.get(_key(name, labels))
+        return dict(histogram, counts=list(histogram['counts'])) if histogram else None
+
+
+def snapshot():
+    """Returns {'counters': {...}, 'gauges': {...}, 'histograms': {...}} keyed by (name, labels)."""
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'histograms': {key: dict(h, counts=list(h['counts'])) for key, h in _histograms.items()},
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+# --- Prometheus text format ---
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render_prometheus():
+    data = snapshot()
+    lines = []
+    for kind, values in (('counter', data['counters']), ('gauge', data['gauges'])):
+        seen = set()
+        for (name, labels), value in sorted(values.items(), key=lambda item: item[0]):
+            if name not in seen:
+                lines.append(f'# TYPE {name} {kind}')
+                seen.add(name)
+            lines.append(f'{name}{_labels(labels)} {_number(value)}')
+
+    seen = set()
+    for (name, labels), histogram in sorted(data['histograms'].items(), key=lambda item: item[0]):
+        if name not in seen:
+            lines.append(f'# TYPE {name} histogram')
+            seen.add(name)
+        cumulative = 0
+        for bound, count in zip(histogram['buckets'], histogram['counts']):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(labels, le=_number(bound))} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {histogram["count"]}')
+        lines.append(f'{name}_sum{_labels(labels)} {_number(histogram["sum"])}')
+        lines.append(f'{name}_count{_labels(labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_coalesced_room_notifications'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageHash',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('product', 'Product photo'), ('logo', 'Business logo'), ('certificate', 'Certificate')], max_length=20)),
+                ('object_id', models.PositiveIntegerField()),
+                ('dhash', models.BigIntegerField()),
+                ('chunk_0', models.PositiveIntegerField()),
+                ('chunk_1', models.PositiveIntegerField()),
+                ('chunk_2', models.PositiveIntegerField()),
+                ('chunk_3', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'chunk_0'], name='imagehash_chunk_0_idx'), models.Index(fields=['kind', 'chunk_1'], name='imagehash_chunk_1_idx'), models.Index(fields=['kind', 'chunk_2'], name='imagehash_chunk_2_idx'), models.Index(fields=['kind', 'chunk_3'], name='imagehash_chunk_3_idx')],
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='imagehash_object_uniq')],
+            },
+        ),
+    ]
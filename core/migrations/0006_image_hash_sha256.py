@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_image_hashes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagehash',
+            name='sha256',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='imagehash',
+            index=models.Index(fields=['owner', 'kind', 'sha256'], name='imagehash_owner_sha256_idx'),
+        ),
+    ]
@@ -1,5 +1,32 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
+
+# --- BACKGROUND UPLOADS ---
+class SpooledUpload(models.Model):
+    """
+    Upload state for models whose files are pushed to storage by
+    `run_upload_worker` (see core.uploads) instead of inside the request.
+    """
+    PENDING = 'pending'
+    UPLOADED = 'uploaded'
+    FAILED = 'failed'
+    UPLOAD_STATUS = [
+        (PENDING, 'Uploading'),
+        (UPLOADED, 'Uploaded'),
+        (FAILED, 'Upload failed'),
+    ]
+
+    upload_status = models.CharField(max_length=10, choices=UPLOAD_STATUS, default=UPLOADED, db_index=True)
+    upload_attempts = models.PositiveSmallIntegerField(default=0)
+    upload_error = models.TextField(blank=True)
+    next_upload_at = models.DateTimeField(null=True, blank=True)
+    # {field name: {"path": local spool path, "name": original file name}}
+    spooled_files = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        abstract = True
+
 
 # --- NOTIFICATION SYSTEM ---
 class Notification(models.Model):
@@ -15,7 +42,84 @@ class Notification(models.Model):
     message = models.CharField(max_length=255)
     link = models.CharField(max_length=255, blank=True, null=True) # Where clicking takes you
     is_read = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now) # Set from the outbox event time
+
+    # Chat notifications are coalesced: one row per (recipient, room), upserted in place.
+    # For those rows created_at is the time of the latest message.
+    room = models.ForeignKey('chat.ChatRoom', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    event_count = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            # NULL rooms never conflict, so this only applies to chat notifications
+            models.UniqueConstraint(fields=['recipient', 'room'], name='unique_room_notification'),
+        ]
+        indexes = [
+            # History pages: keyset on (created_at, id) per recipient
+            models.Index(fields=['recipient', '-created_at', '-id'], name='notif_recipient_created_idx'),
+            # Retention purge
+            models.Index(fields=['created_at'], name='notif_created_idx'),
+        ]
 
     def __str__(self):
         return f"Notify {self.recipient}: {self.message}"
+
+# --- NOTIFICATION OUTBOX ---
+class NotificationOutbox(models.Model):
+    """
+    Pending notification, written in the same transaction as the change that
+    caused it. The `run_notification_worker` command moves rows into Notification.
+    """
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    notification_type = models.CharField(max_length=20, choices=Notification.TYPES, default='alert')
+    message = models.CharField(max_length=255)
+    link = models.CharField(max_length=255, blank=True, null=True)
+    room = models.ForeignKey('chat.ChatRoom', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Outbox {self.id} -> {self.recipient_id}"
+
+
+# --- IMAGE HASHES ---
+class ImageHash(models.Model):
+    """
+    Perceptual hash (dHash) of a stored image, for near-duplicate lookups in
+    core.imagehash. The 64 bits are also split into four 16-bit chunks, each
+    indexed, so a lookup only reads rows sharing a chunk with the query.
+    sha256 is the digest of the uploaded bytes, for exact-copy lookups.
+    """
+    KINDS = [
+        ('product', 'Product photo'),
+        ('logo', 'Business logo'),
+        ('certificate', 'Certificate'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    object_id = models.PositiveIntegerField()
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    # Stored signed to fit a bigint column
+    dhash = models.BigIntegerField()
+    chunk_0 = models.PositiveIntegerField()
+    chunk_1 = models.PositiveIntegerField()
+    chunk_2 = models.PositiveIntegerField()
+    chunk_3 = models.PositiveIntegerField()
+    # Blank for rows recorded before it was kept
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='imagehash_object_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'chunk_0'], name='imagehash_chunk_0_idx'),
+            models.Index(fields=['kind', 'chunk_1'], name='imagehash_chunk_1_idx'),
+            models.Index(fields=['kind', 'chunk_2'], name='imagehash_chunk_2_idx'),
+            models.Index(fields=['kind', 'chunk_3'], name='imagehash_chunk_3_idx'),
+            models.Index(fields=['owner', 'kind', 'sha256'], name='imagehash_owner_sha256_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}: {self.dhash & (2 ** 64 - 1):016x}"
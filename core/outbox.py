@@ -0,0 +1,155 @@
+"""
+Transactional outbox for notifications.
+
+Views and signals call `enqueue_notification(s)` inside their own transaction,
+so the outbox row commits (or rolls back) together with the change that caused
+it. `drain_outbox` moves a batch into Notification with one `bulk_create`
+and pushes the new rows to the recipients' sockets (see core.realtime).
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import Notification, NotificationOutbox
+from .realtime import publish_notifications
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def _is_sync():
+    return getattr(settings, 'NOTIFICATION_OUTBOX_SYNC', False)
+
+
+def enqueue_notifications(items):
+    """
+    items: iterable of dicts with recipient_id, message and optionally
+    sender_id, notification_type, link, room_id. Only ids are needed, so callers never
+    have to load the related users.
+    """
+    rows = [NotificationOutbox(**item) for item in items]
+    if not rows:
+        return
+    NotificationOutbox.objects.bulk_create(rows)
+    metrics.incr('notification_outbox_enqueued_total', len(rows))
+
+    # Synchronous mode (tests / local dev without a worker): deliver right away
+    if _is_sync():
+        drain_outbox()
+
+
+def enqueue_notification(recipient_id, message, sender_id=None, notification_type='alert', link=None, room_id=None):
+    """Passing room_id makes the notification coalesce per (recipient, room)."""
+    enqueue_notifications([{
+        'recipient_id': recipient_id,
+        'sender_id': sender_id,
+        'notification_type': notification_type,
+        'message': message,
+        'link': link,
+        'room_id': room_id,
+    }])
+
+
+def drain_outbox(batch_size=None):
+    """
+    Delivers up to `batch_size` outbox rows. Returns the number delivered.
+    Rows are locked with SKIP LOCKED so several workers can run side by side.
+    """
+    batch_size = batch_size or getattr(settings, 'NOTIFICATION_OUTBOX_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+    with transaction.atomic():
+        batch = list(
+            NotificationOutbox.objects.select_for_update(skip_locked=True).order_by('id')[:batch_size]
+        )
+        if not batch:
+            metrics.set_gauge('notification_outbox_lag_seconds', 0)
+            return 0
+
+        plain = [row for row in batch if row.room_id is None]
+        coalesced = [row for row in batch if row.room_id is not None]
+
+        created = Notification.objects.bulk_create([
+            Notification(
+                recipient_id=row.recipient_id,
+                sender_id=row.sender_id,
+                notification_type=row.notification_type,
+                message=row.message,
+                link=row.link,
+                created_at=row.created_at,
+            )
+            for row in plain
+        ])
+        if coalesced:
+            created += upsert_room_notifications(coalesced)
+        NotificationOutbox.objects.filter(id__in=[row.id for row in batch]).delete()
+
+        # Push to open sockets once the rows are visible to other connections
+        transaction.on_commit(lambda: publish_notifications(created))
+
+    # Lag = age of the oldest event we just delivered
+    lag = (timezone.now() - batch[0].created_at).total_seconds()
+    metrics.set_gauge('notification_outbox_lag_seconds', lag)
+    metrics.incr('notification_outbox_delivered_total', len(batch))
+    return len(batch)
+
+
+def upsert_room_notifications(rows):
+    """
+    Folds chat-message outbox rows into one notification per (recipient, room)
+    with a single INSERT .. ON CONFLICT statement (Postgres, SQLite >= 3.24).
+    An unread row has its counter bumped; a read one restarts at the new count.
+    Returns the affected notifications.
+    """
+    # Collapse the batch itself first: last row wins for text/sender/time
+    grouped = {}
+    for row in rows:
+        key = (row.recipient_id, row.room_id)
+        count = grouped[key][1] + 1 if key in grouped else 1
+        grouped[key] = (row, count)
+
+    opts = Notification._meta
+    qn = connection.ops.quote_name
+    table = qn(opts.db_table)
+    columns = ['recipient', 'sender', 'room', 'notification_type', 'message', 'link', 'is_read', 'created_at', 'event_count']
+    column_names = [qn(opts.get_field(name).column) for name in columns]
+    col = dict(zip(columns, column_names))
+
+    created_at_field = opts.get_field('created_at')
+    placeholders = []
+    params = []
+    for row, count in grouped.values():
+        placeholders.append(f"({', '.join(['%s'] * len(columns))})")
+        params += [
+            row.recipient_id, row.sender_id, row.room_id, row.notification_type, row.message, row.link,
+            False, created_at_field.get_db_prep_value(row.created_at, connection), count,
+        ]
+
+    sql = (
+        f"INSERT INTO {table} ({', '.join(column_names)}) VALUES {', '.join(placeholders)} "
+        f"ON CONFLICT ({col['recipient']}, {col['room']}) DO UPDATE SET "
+        f"{col['event_count']} = CASE WHEN {table}.{col['is_read']} THEN EXCLUDED.{col['event_count']} "
+        f"ELSE {table}.{col['event_count']} + EXCLUDED.{col['event_count']} END, "
+        f"{col['is_read']} = EXCLUDED.{col['is_read']}, "
+        f"{col['sender']} = EXCLUDED.{col['sender']}, "
+        f"{col['message']} = EXCLUDED.{col['message']}, "
+        f"{col['link']} = EXCLUDED.{col['link']}, "
+        f"{col['created_at']} = EXCLUDED.{col['created_at']}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+    recipients = {recipient_id for recipient_id, _ in grouped}
+    rooms = {room_id for _, room_id in grouped}
+    return [
+        n for n in Notification.objects.filter(recipient_id__in=recipients, room_id__in=rooms)
+        if (n.recipient_id, n.room_id) in grouped
+    ]
+
+
+def outbox_stats():
+    """Current queue depth and age (seconds) of the oldest pending row."""
+    pending = NotificationOutbox.objects.count()
+    oldest = NotificationOutbox.objects.order_by('id').values_list('created_at', flat=True).first()
+    lag = (timezone.now() - oldest).total_seconds() if oldest else 0
+    metrics.set_gauge('notification_outbox_depth', pending)
+    return {'pending': pending, 'lag_seconds': lag}
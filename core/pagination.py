@@ -0,0 +1,46 @@
+"""
+Keyset ("seek") pagination over (<datetime field>, id), newest first.
+
+Cursors are opaque strings of the form "<epoch microseconds>_<id>", so a page
+is always one indexed range scan no matter how deep the user scrolls.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Q
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_cursor(moment, pk):
+    micros = (moment - EPOCH) // timedelta(microseconds=1)
+    return f"{micros}_{pk}"
+
+
+def decode_cursor(cursor):
+    """Returns (datetime, id) or None for a missing/garbled cursor."""
+    try:
+        micros, pk = cursor.split('_', 1)
+        moment = EPOCH + timedelta(microseconds=int(micros))
+        return moment, int(pk)
+    except (AttributeError, ValueError, OverflowError, OSError):
+        return None
+
+
+def keyset_page(queryset, field, before=None, size=25):
+    """
+    Returns (items, next_cursor) for the page that ends just before `before`.
+    next_cursor is None when there are no older rows.
+    """
+    position = decode_cursor(before) if before else None
+    if position:
+        moment, pk = position
+        queryset = queryset.filter(Q(**{f'{field}__lt': moment}) | Q(**{field: moment, 'id__lt': pk}))
+
+    items = list(queryset.order_by(f'-{field}', '-id')[:size + 1])
+    next_cursor = None
+    if len(items) > size:
+        items = items[:size]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.id)
+    return items, next_cursor
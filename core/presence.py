@@ -0,0 +1,127 @@
+"""
+Who is online, kept outside the database.
+
+Each user has one counter key ("presence:<id>") holding their number of open
+sockets. Consumers bump it on connect, drop it on disconnect and refresh its
+TTL on every client heartbeat, so a crashed worker's users fall offline once
+PRESENCE_TTL passes without a heartbeat. Reading presence for a whole inbox
+is one MGET.
+
+PRESENCE_BACKEND picks the store: RedisPresence in production, MemoryPresence
+for tests and single-process development.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+KEY_PREFIX = 'presence:'
+
+
+def presence_key(user_id):
+    return f"{KEY_PREFIX}{user_id}"
+
+
+class RedisPresence:
+
+    def __init__(self, url, ttl):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def connect(self, user_id):
+        key = presence_key(user_id)
+        pipe = self.client.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def heartbeat(self, user_id):
+        key = presence_key(user_id)
+        # SET NX revives a key that already expired (missed heartbeats)
+        pipe = self.client.pipeline()
+        pipe.set(key, 1, ex=self.ttl, nx=True)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def disconnect(self, user_id):
+        key = presence_key(user_id)
+        if self.client.decr(key) <= 0:
+            self.client.delete(key)
+
+    def online(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        values = self.client.mget([presence_key(user_id) for user_id in user_ids])
+        return {user_id for user_id, value in zip(user_ids, values) if value and int(value) > 0}
+
+
+class MemoryPresence:
+    """Same semantics as RedisPresence in a process-local dict."""
+
+    def __init__(self, url=None, ttl=60):
+        self.ttl = ttl
+        self.counts = {}  # user_id -> (connections, expires_at)
+        self.lock = threading.Lock()
+
+    def _live(self, user_id):
+        count, expires_at = self.counts.get(user_id, (0, 0))
+        return count if expires_at > time.monotonic() else 0
+
+    def connect(self, user_id):
+        with self.lock:
+            self.counts[user_id] = (self._live(user_id) + 1, time.monotonic() + self.ttl)
+
+    def heartbeat(self, user_id):
+        with self.lock:
+            self.counts[user_id] = (self._live(user_id) or 1, time.monotonic() + self.ttl)
+
+    def disconnect(self, user_id):
+        with self.lock:
+            count = self._live(user_id) - 1
+            if count > 0:
+                self.counts[user_id] = (count, self.counts[user_id][1])
+            else:
+                self.counts.pop(user_id, None)
+
+    def online(self, user_ids):
+        with self.lock:
+            return {user_id for user_id in user_ids if self._live(user_id) > 0}
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_presence():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            backend = import_string(settings.PRESENCE_BACKEND)
+            _backend = backend(url=settings.PRESENCE_URL, ttl=settings.PRESENCE_TTL)
+        return _backend
+
+
+def reset_presence():
+    """Drops the cached backend (tests switch PRESENCE_BACKEND with override_settings)."""
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+def online_user_ids(user_ids):
+    return get_presence().online(user_ids)
+
+
+def is_online(user_id):
+    return user_id in online_user_ids([user_id])
+
+
+@receiver(setting_changed)
+def _presence_setting_changed(setting, **kwargs):
+    if setting.startswith('PRESENCE_'):
+        reset_presence()
@@ -0,0 +1,138 @@
+"""
+Fixed-window rate limiting on top of the Django cache.
+
+Each (scope, key) pair gets a counter per `period`-long window, so
+RATE_LIMITS = {'chat_send_user': '30/m'} allows 30 sends per clock minute.
+The counter is created with cache.add() and bumped with cache.incr(), both
+atomic on Redis and LocMem, so concurrent requests from several workers can
+never all pass on the same count. A burst that straddles two windows can get
+up to twice the rate through; that is the price of needing no locking.
+
+Views use the @ratelimit decorator (429 + Retry-After). Consumers call
+aconsume() and decide how to push back. Rejections are counted in
+core.metrics as `ratelimit_rejected{scope=...}`.
+"""
+import math
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+from . import metrics
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'30/m' -> (30, 60). Also accepts '10/5m'."""
+    count, period = rate.split('/')
+    multiplier = int(period[:-1]) if len(period) > 1 else 1
+    return int(count), multiplier * PERIODS[period[-1]]
+
+
+def _window_key(scope, key, period, now):
+    return f"rl:{scope}:{key}:{int(now // period)}"
+
+
+def consume(scope, key, cost=1):
+    """
+    Counts `cost` against the current window. Returns (allowed,
+    retry_after_seconds). Scopes missing from RATE_LIMITS are unlimited.
+    """
+    rate = settings.RATE_LIMITS.get(scope)
+    if not rate or not settings.RATELIMIT_ENABLED:
+        return True, 0
+    capacity, period = parse_rate(rate)
+    now = time.time()
+    cache_key = _window_key(scope, key, period, now)
+
+    # No-op when the window's counter exists already
+    cache.add(cache_key, 0, timeout=math.ceil(period) + 1)
+    try:
+        used = cache.incr(cache_key, cost)
+    except ValueError:
+        # Expired between add() and incr()
+        cache.add(cache_key, cost, timeout=math.ceil(period) + 1)
+        used = cost
+
+    if used > capacity:
+        # A rejected request takes nothing, so a smaller one may still fit
+        refund(scope, key, cost, now=now)
+        metrics.incr('ratelimit_rejected', scope=scope)
+        return False, period - now % period
+    return True, 0
+
+
+def refund(scope, key, cost=1, now=None):
+    """Gives back what consume() counted, e.g. when a later check rejects the same request."""
+    rate = settings.RATE_LIMITS.get(scope)
+    if not rate or not settings.RATELIMIT_ENABLED:
+        return
+    _, period = parse_rate(rate)
+    try:
+        cache.decr(_window_key(scope, key, period, now or time.time()), cost)
+    except ValueError:
+        pass  # The window has already expired
+
+
+aconsume = sync_to_async(consume)
+arefund = sync_to_async(refund)
+
+
+def client_ip(request):
+    """
+    The caller's address. Behind proxies, each one appends the address it got
+    the request from to X-Forwarded-For, and anything to the left of that
+    came from the client and can be forged. So the key is the entry the
+    outermost of our RATELIMIT_TRUSTED_PROXY_HOPS proxies added, counted
+    from the right.
+    """
+    if settings.RATELIMIT_USE_FORWARDED_FOR:
+        hops = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+        if hops:
+            return hops[-min(settings.RATELIMIT_TRUSTED_PROXY_HOPS, len(hops))]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def request_key(request, key, args, kwargs):
+    if callable(key):
+        return key(request, *args, **kwargs)
+    if key == 'ip':
+        return client_ip(request)
+    if key == 'user':
+        return request.user.pk
+    # 'user_or_ip': signed-in users get their own bucket, guests share by address
+    if request.user.is_authenticated:
+        return f"u{request.user.pk}"
+    return f"ip{client_ip(request)}"
+
+
+def too_many_requests(request, retry_after):
+    retry_after = max(1, math.ceil(retry_after))
+    if 'application/json' in request.headers.get('Accept', '') or request.content_type == 'application/json' \
+            or request.path.startswith('/api/'):
+        response = JsonResponse({'status': 'rate_limited', 'retry_after': retry_after}, status=429)
+    else:
+        response = HttpResponse("Too many requests. Please wait a moment and try again.", status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def ratelimit(scope, key='user_or_ip', methods=('POST',)):
+    """
+    View decorator. `key` is 'user', 'ip', 'user_or_ip' or a callable taking
+    the view's (request, *args, **kwargs), e.g. a room id for per-room buckets.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method in methods:
+                allowed, retry_after = consume(scope, request_key(request, key, args, kwargs))
+                if not allowed:
+                    return too_many_requests(request, retry_after)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
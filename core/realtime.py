@@ -0,0 +1,61 @@
+"""
+Pushes notification events to the `user_<id>` channel-layer group that
+core.consumers.NotificationConsumer joins.
+
+Note: InMemoryChannelLayer only reaches sockets served by the same process, so
+with it notifications must be delivered in-process (NOTIFICATION_OUTBOX_SYNC).
+With Redis the separate outbox worker can publish too.
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db.models import Count
+
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+
+def user_group(user_id):
+    return f"user_{user_id}"
+
+
+def unread_counts(user_ids):
+    rows = (
+        Notification.objects.filter(recipient_id__in=user_ids, is_read=False)
+        .values('recipient_id')
+        .annotate(n=Count('id'))
+        .values_list('recipient_id', 'n')
+    )
+    counts = dict(rows)
+    return {user_id: counts.get(user_id, 0) for user_id in user_ids}
+
+
+def notification_event(notification, unread_count):
+    return {
+        'type': 'notification.new',
+        'id': notification.id,
+        'notification_type': notification.notification_type,
+        'message': notification.message,
+        'link': notification.link or '',
+        'created_at': notification.created_at.isoformat(),
+        'event_count': notification.event_count,
+        'unread_count': unread_count,
+    }
+
+
+def publish_notifications(notifications):
+    """Sends each new notification (with a fresh unread badge count) to its recipient."""
+    layer = get_channel_layer()
+    if layer is None or not notifications:
+        return
+
+    counts = unread_counts({n.recipient_id for n in notifications})
+    send = async_to_sync(layer.group_send)
+    for notification in notifications:
+        try:
+            send(user_group(notification.recipient_id), notification_event(notification, counts[notification.recipient_id]))
+        except Exception:
+            # Real-time push is best effort; the row is already stored
+            logger.exception("Failed to publish notification %s", notification.id)
@@ -0,0 +1,81 @@
+"""
+Notification retention: which rows may be purged, and a batched deleter that
+never holds locks on more than `batch_size` rows at a time.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metrics
+from .models import Notification
+
+
+def retention_cutoffs(now=None):
+    now = now or timezone.now()
+    return (
+        now - timedelta(days=settings.NOTIFICATION_RETENTION_READ_DAYS),
+        now - timedelta(days=settings.NOTIFICATION_RETENTION_UNREAD_DAYS),
+    )
+
+
+def purgeable_notifications(now=None):
+    """Read notifications past the read window, and anything past the unread window."""
+    read_cutoff, unread_cutoff = retention_cutoffs(now)
+    return Notification.objects.filter(
+        Q(is_read=True, created_at__lt=read_cutoff) | Q(created_at__lt=unread_cutoff)
+    )
+
+
+def _set_lock_timeout(ms):
+    # Postgres only: fail fast instead of queueing behind another writer
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL lock_timeout = %s", [f"{int(ms)}ms"])
+
+
+def delete_in_batches(queryset, batch_size=1000, pause=0, lock_timeout_ms=2000, max_retries=5):
+    """
+    Deletes `queryset` in id-bounded chunks, one short transaction each.
+
+    Returns a dict with deleted, seconds, rows_per_second, batches and
+    lock_waits (batches that hit the lock timeout and were retried).
+    """
+    stats = {'deleted': 0, 'batches': 0, 'lock_waits': 0, 'seconds': 0.0, 'rows_per_second': 0.0}
+    model = queryset.model
+    started = time.monotonic()
+    retries = 0
+
+    while True:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+
+        try:
+            with transaction.atomic():
+                _set_lock_timeout(lock_timeout_ms)
+                deleted, _ = model.objects.filter(id__in=ids).delete()
+        except OperationalError:
+            # lock_timeout (Postgres) / "database is locked" (SQLite): back off and retry
+            stats['lock_waits'] += 1
+            metrics.incr('notification_purge_lock_waits_total')
+            retries += 1
+            if retries > max_retries:
+                raise
+            time.sleep(min(0.1 * 2 ** retries, 5))
+            continue
+
+        retries = 0
+        stats['deleted'] += deleted
+        stats['batches'] += 1
+        if pause:
+            time.sleep(pause)
+
+    stats['seconds'] = time.monotonic() - started
+    if stats['seconds'] > 0:
+        stats['rows_per_second'] = stats['deleted'] / stats['seconds']
+    metrics.incr('notification_purge_deleted_total', stats['deleted'])
+    return stats
@@ -1,58 +1,77 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from market.models import Order
-from chat.models import Message
-from .models import Notification
+from chat.models import ChatRoom, Message
+from chat.services import other_participant_id, room_link
+from chat import support
+from accounts.models import User
+from .outbox import enqueue_notification
 from django.urls import reverse
 
 @receiver(post_save, sender=Order)
 def order_notification(sender, instance, created, **kwargs):
-    print(f"--- SIGNAL FIRED: Order #{instance.id} ---") # Debug Line 1
-    
+    # Order.save() already loaded the product (for total_price), so only ids are read here
+    product = instance.product
+
     if created:
-        print("--- NEW ORDER DETECTED ---") # Debug Line 2
         # 1. NEW ORDER -> Notify Seller
-        Notification.objects.create(
-            recipient=instance.product.seller,
-            sender=instance.buyer,
+        enqueue_notification(
+            recipient_id=product.seller_id,
+            sender_id=instance.buyer_id,
             notification_type='order',
-            message=f"New Order: {instance.quantity}kg of {instance.product.name}",
+            message=f"New Order: {instance.quantity}kg of {product.name}",
             link=reverse('seller_orders')
         )
-        print(f"--- NOTIFICATION CREATED FOR SELLER: {instance.product.seller.username} ---") # Debug Line 3
-        
     else:
         # 2. STATUS CHANGE -> Notify Buyer
         msg = None
         if instance.status == 'Accepted':
-            msg = f"Order Accepted! The seller is preparing {instance.product.name}."
+            msg = f"Order Accepted! The seller is preparing {product.name}."
         elif instance.status == 'Shipped':
-            msg = f"On the way! Your order for {instance.product.name} has been Shipped."
+            msg = f"On the way! Your order for {product.name} has been Shipped."
         elif instance.status == 'Delivered':
-            msg = f"Delivered! Your coffee {instance.product.name} has arrived."
+            msg = f"Delivered! Your coffee {product.name} has arrived."
         elif instance.status == 'Declined':
-            msg = f"Order Declined. Please check your order for {instance.product.name}."
+            msg = f"Order Declined. Please check your order for {product.name}."
             
         if msg:
-            Notification.objects.create(
-                recipient=instance.buyer,
-                sender=instance.product.seller,
+            enqueue_notification(
+                recipient_id=instance.buyer_id,
+                sender_id=product.seller_id,
                 notification_type='order',
                 message=msg,
                 link=reverse('buyer_orders')
             )
-            print(f"--- NOTIFICATION CREATED FOR BUYER: {instance.buyer.username} ---") 
             
 @receiver(post_save, sender=Message)
 def message_notification(sender, instance, created, **kwargs):
     if created:
-        room = instance.room
-        recipient = room.participant_2 if instance.sender == room.participant_1 else room.participant_1
-        
-        Notification.objects.create(
-            recipient=recipient,
-            sender=instance.sender,
+        if Message.room.is_cached(instance) and Message.sender.is_cached(instance):
+            room, username = instance.room, instance.sender.username
+        else:
+            # Created from ids: one joined read instead of lazy-loading room and sender
+            row = Message.objects.filter(pk=instance.pk).values(
+                'room__participant_1_id', 'room__participant_2_id', 'room__kind', 'sender__username',
+            ).get()
+            room = ChatRoom(
+                id=instance.room_id, participant_1_id=row['room__participant_1_id'],
+                participant_2_id=row['room__participant_2_id'], kind=row['room__kind'],
+            )
+            username = row['sender__username']
+
+        # Coalesced: one unread notification per (recipient, room) with a counter
+        enqueue_notification(
+            recipient_id=other_participant_id(room, instance.sender_id),
+            sender_id=instance.sender_id,
             notification_type='message',
-            message=f"New message from {instance.sender.username}",
-            link=reverse('chat_room', args=[instance.sender.id])
-        )
\ No newline at end of file
+            message=f"New message from {username}",
+            link=room_link(room, instance.sender_id),
+            room_id=instance.room_id,
+        )
+
+@receiver(post_save, sender=User)
+def support_agents_changed(sender, instance, update_fields=None, **kwargs):
+    # Logins only touch last_login; anything else may change who is an agent
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    support.user_changed(instance)
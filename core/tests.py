@@ -1,3 +1,605 @@
-from django.test import TestCase
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from channels.db import database_sync_to_async
+from channels.layers import channel_layers
+from channels.testing import WebsocketCommunicator
+from unittest import mock
+
+from cloudinary import CloudinaryResource
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.urls import reverse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from accounts.forms import SellerRegisterForm
+from accounts.models import User, VerificationDoc
+from chat.models import ChatParticipant, ChatRoom, Message
+from market.models import BusinessProfile, Order, Product
+from coffee_core.asgi import application
+from .outbox import drain_outbox, enqueue_notification
+from . import metrics, uploads
+from .models import Notification, NotificationOutbox
+from .instrumentation import InstrumentationMiddleware
+from .presence import MemoryPresence, RedisPresence
+from .ratelimit import client_ip, consume, parse_rate, ratelimit, refund
+from .retention import delete_in_batches, purgeable_notifications
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER, NOTIFICATION_OUTBOX_SYNC=True)
+class NotificationConsumerTests(TransactionTestCase):
+
+    def setUp(self):
+        channel_layers.backends.clear()
+        self.user = User.objects.create(username='buyer')
+
+    def tearDown(self):
+        channel_layers.backends.clear()
+
+    def communicator(self, user):
+        communicator = WebsocketCommunicator(application, '/ws/notifications/')
+        communicator.scope['user'] = user
+        return communicator
+
+    async def test_anonymous_is_rejected(self):
+        from django.contrib.auth.models import AnonymousUser
+        communicator = self.communicator(AnonymousUser())
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+    async def test_new_notification_is_pushed(self):
+        communicator = self.communicator(self.user)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'unread_count', 'unread_count': 0})
+
+        await database_sync_to_async(enqueue_notification)(self.user.id, "Order Accepted!", link='/market/my-orders/')
+
+        event = await communicator.receive_json_from()
+        self.assertEqual(event['type'], 'notification')
+        self.assertEqual(event['message'], "Order Accepted!")
+        self.assertEqual(event['unread_count'], 1)
+        await communicator.disconnect()
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=1.0)
+    async def test_events_are_instrumented(self):
+        metrics.reset()
+        communicator = self.communicator(self.user)
+        await communicator.connect()
+        await communicator.receive_json_from()
+        await communicator.disconnect()
+
+        labels = {'consumer': 'NotificationConsumer', 'event': 'websocket.connect'}
+        self.assertEqual(metrics.get_histogram('ws_event_duration_seconds', **labels)['count'], 1)
+        self.assertGreaterEqual(metrics.get_histogram('ws_event_queries', **labels)['sum'], 1)  # The unread count
+
+    async def test_other_users_do_not_receive_push(self):
+        other = await database_sync_to_async(User.objects.create)(username='seller')
+        communicator = self.communicator(other)
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        await database_sync_to_async(enqueue_notification)(self.user.id, "Not for you")
+
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+
+if os.environ.get('TEST_REDIS_URL'):
+    @override_settings(CHANNEL_LAYERS={'default': {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {'hosts': [os.environ['TEST_REDIS_URL']]},
+    }}, NOTIFICATION_OUTBOX_SYNC=True)
+    class RedisNotificationConsumerTests(NotificationConsumerTests):
+        """Same checks against a real Redis (set TEST_REDIS_URL to run)."""
+
+
+@override_settings(NOTIFICATION_OUTBOX_SYNC=False)
+class NotificationOutboxTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.buyer = User.objects.create(username='buyer')
+        self.seller = User.objects.create(username='seller')
+
+    def test_enqueue_writes_outbox_row_only(self):
+        enqueue_notification(self.buyer.id, "Order Accepted!", sender_id=self.seller.id, notification_type='order')
+
+        row = NotificationOutbox.objects.get()
+        self.assertEqual((row.recipient_id, row.sender_id, row.message), (self.buyer.id, self.seller.id, "Order Accepted!"))
+        self.assertFalse(Notification.objects.exists())
+
+    def test_outbox_row_rolls_back_with_the_change(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            enqueue_notification(self.buyer.id, "Order Accepted!")
+            raise RuntimeError
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_worker_drains_in_batches(self):
+        for i in range(5):
+            enqueue_notification(self.buyer.id, f"Update {i}")
+
+        call_command('run_notification_worker', '--once', '--batch-size', '2', stdout=StringIO())
+
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertEqual(
+            list(Notification.objects.order_by('id').values_list('message', flat=True)),
+            [f"Update {i}" for i in range(5)],
+        )
+        self.assertEqual(metrics.get_value('notification_outbox_delivered_total'), 5)
+
+    @override_settings(NOTIFICATION_OUTBOX_SYNC=True)
+    def test_sync_mode_delivers_inline(self):
+        enqueue_notification(self.buyer.id, "Order Accepted!")
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertEqual(Notification.objects.get().message, "Order Accepted!")
+
+    def test_lag_is_age_of_oldest_delivered_row(self):
+        enqueue_notification(self.buyer.id, "Old news")
+        event_time = timezone.now() - timedelta(seconds=90)
+        NotificationOutbox.objects.update(created_at=event_time)
+
+        self.assertEqual(drain_outbox(), 1)
+        self.assertGreaterEqual(metrics.get_value('notification_outbox_lag_seconds'), 90)
+        self.assertEqual(Notification.objects.get().created_at, event_time)
+
+        self.assertEqual(drain_outbox(), 0)
+        self.assertEqual(metrics.get_value('notification_outbox_lag_seconds'), 0)
+
+    def test_message_created_from_ids_is_notified(self):
+        room, _ = ChatRoom.between(self.buyer, self.seller)
+        Message.objects.create(room_id=room.id, sender_id=self.buyer.id, content="Hello")
+
+        row = NotificationOutbox.objects.get()
+        self.assertEqual((row.recipient_id, row.room_id), (self.seller.id, room.id))
+        self.assertEqual(row.message, "New message from buyer")
+        self.assertEqual(row.link, reverse('chat_room', args=[self.buyer.id]))
+
+
+@override_settings(NOTIFICATION_OUTBOX_SYNC=False)
+class CoalescedNotificationTests(TestCase):
+
+    def setUp(self):
+        self.buyer = User.objects.create(username='buyer')
+        self.seller = User.objects.create(username='seller')
+        self.room, _ = ChatRoom.between(self.buyer, self.seller)
+
+    def send(self, text, at):
+        enqueue_notification(
+            self.seller.id, text, sender_id=self.buyer.id, notification_type='message', room_id=self.room.id,
+        )
+        NotificationOutbox.objects.update(created_at=at)
+        drain_outbox()
+
+    def test_second_message_updates_the_same_row(self):
+        first_at = timezone.now() - timedelta(minutes=5)
+        self.send("Is the Guji lot available?", first_at)
+        self.send("Also, what is the moisture?", first_at + timedelta(minutes=2))
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.event_count, 2)
+        self.assertEqual(notification.message, "Also, what is the moisture?")
+        self.assertEqual(notification.created_at, first_at + timedelta(minutes=2))
+        self.assertFalse(notification.is_read)
+
+    def test_message_after_read_resets_the_row(self):
+        self.send("Hello", timezone.now() - timedelta(minutes=5))
+        self.send("Hello again", timezone.now() - timedelta(minutes=4))
+        Notification.objects.update(is_read=True)
+
+        self.send("Are you there?", timezone.now())
+
+        notification = Notification.objects.get()
+        self.assertEqual((notification.event_count, notification.is_read), (1, False))
+        self.assertEqual(notification.message, "Are you there?")
+
+    def test_one_batch_collapses_before_the_upsert(self):
+        for text in ("One", "Two", "Three"):
+            enqueue_notification(self.seller.id, text, sender_id=self.buyer.id, notification_type='message', room_id=self.room.id)
+        enqueue_notification(self.buyer.id, "Reply", sender_id=self.seller.id, notification_type='message', room_id=self.room.id)
+
+        self.assertEqual(drain_outbox(), 4)
+        rows = {n.recipient_id: n for n in Notification.objects.all()}
+        self.assertEqual((rows[self.seller.id].event_count, rows[self.seller.id].message), (3, "Three"))
+        self.assertEqual(rows[self.buyer.id].event_count, 1)
+
+
+@override_settings(NOTIFICATION_RETENTION_READ_DAYS=30, NOTIFICATION_RETENTION_UNREAD_DAYS=180)
+class NotificationRetentionTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='buyer')
+        self.now = timezone.now()
+
+    def notify(self, days_old, is_read=False, **fields):
+        return Notification.objects.create(
+            recipient=self.user, message="Order update", is_read=is_read,
+            created_at=self.now - timedelta(days=days_old), **fields,
+        )
+
+    def test_cutoffs(self):
+        keep = [self.notify(29, is_read=True), self.notify(179), self.notify(1)]
+        purge = [self.notify(31, is_read=True), self.notify(181), self.notify(400, is_read=True)]
+
+        self.assertEqual(
+            set(purgeable_notifications(self.now).values_list('id', flat=True)), {n.id for n in purge},
+        )
+        call_command('purge_notifications', stdout=StringIO())
+        self.assertEqual(set(Notification.objects.values_list('id', flat=True)), {n.id for n in keep})
+
+    def test_dry_run_deletes_nothing(self):
+        self.notify(400)
+        out = StringIO()
+        call_command('purge_notifications', '--dry-run', stdout=out)
+        self.assertIn("1 notifications would be deleted", out.getvalue())
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_batch_boundaries(self):
+        for size, batches in ((7, 3), (6, 2), (0, 0)):
+            with self.subTest(rows=size):
+                for _ in range(size):
+                    self.notify(400)
+                kept = self.notify(1)
+                stats = delete_in_batches(purgeable_notifications(self.now), batch_size=3)
+                self.assertEqual((stats['deleted'], stats['batches']), (size, batches))
+                self.assertEqual(list(Notification.objects.values_list('id', flat=True)), [kept.id])
+                kept.delete()
+
+    @override_settings(NOTIFICATION_PAGE_SIZE=2)
+    def test_pages_continue_across_equal_timestamps(self):
+        # Five rows share a created_at, so only the id tie-break separates pages
+        tied = [self.notify(2) for _ in range(5)]
+        Notification.objects.update(created_at=tied[0].created_at)
+        newest = self.notify(0)
+        self.client.force_login(self.user)
+
+        seen, before = [], None
+        while True:
+            response = self.client.get(reverse('all_notifications'), {'before': before} if before else {})
+            seen += [n.id for n in response.context['all_notifs']]
+            before = response.context['next_cursor']
+            if before is None:
+                break
+        self.assertEqual(seen, [newest.id] + sorted((n.id for n in tied), reverse=True))
+
+    def test_garbled_cursor_starts_over(self):
+        self.notify(0)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('all_notifications'), {'before': 'not-a-cursor'})
+        self.assertEqual(len(response.context['all_notifs']), 1)
+
+
+class PresenceBackendTests(SimpleTestCase):
+    backend_class = MemoryPresence
+
+    def backend(self, ttl=60):
+        return self.backend_class(url=None, ttl=ttl)
+
+    def test_online_while_any_socket_is_open(self):
+        presence = self.backend()
+        presence.connect(1)
+        presence.connect(1)
+        presence.connect(2)
+        self.assertEqual(presence.online([1, 2, 3]), {1, 2})
+
+        presence.disconnect(1)
+        self.assertEqual(presence.online([1, 2, 3]), {1, 2})
+        presence.disconnect(1)
+        self.assertEqual(presence.online([1, 2, 3]), {2})
+
+    def test_missed_heartbeats_expire(self):
+        presence = self.backend(ttl=0)
+        presence.connect(1)
+        self.assertEqual(presence.online([1]), set())
+
+    def test_heartbeat_revives_expired_key(self):
+        presence = self.backend(ttl=0)
+        presence.connect(1)
+        presence.ttl = 60
+        presence.heartbeat(1)
+        self.assertEqual(presence.online([1]), {1})
+
+
+if os.environ.get('TEST_REDIS_URL'):
+    class RedisPresenceBackendTests(PresenceBackendTests):
+        """Same checks against a real Redis (set TEST_REDIS_URL to run)."""
+
+        def backend(self, ttl=60):
+            presence = RedisPresence(os.environ['TEST_REDIS_URL'], max(ttl, 1))
+            presence.client.delete(*[f"presence:{i}" for i in (1, 2, 3)])
+            return presence
+
+        def test_missed_heartbeats_expire(self):
+            presence = self.backend()
+            presence.connect(1)
+            presence.client.expire('presence:1', 0)
+            self.assertEqual(presence.online([1]), set())
+
+        def test_heartbeat_revives_expired_key(self):
+            presence = self.backend()
+            presence.connect(1)
+            presence.client.delete('presence:1')
+            presence.heartbeat(1)
+            self.assertEqual(presence.online([1]), {1})
+
+
+@override_settings(RATELIMIT_ENABLED=True, RATE_LIMITS={'test': '3/m'})
+class RateLimitTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('30/m'), (30, 60))
+        self.assertEqual(parse_rate('10/5m'), (10, 300))
+
+    def test_bucket_drains_and_refills(self):
+        with mock.patch('core.ratelimit.time.time', return_value=1000.0):
+            self.assertEqual([consume('test', 'a')[0] for _ in range(4)], [True, True, True, False])
+            self.assertTrue(consume('test', 'b')[0])  # Separate bucket per key
+            self.assertAlmostEqual(consume('test', 'a')[1], 20.0)  # The window ends at 1020
+        with mock.patch('core.ratelimit.time.time', return_value=1020.0):
+            self.assertEqual([consume('test', 'a')[0] for _ in range(4)], [True, True, True, False])
+        self.assertEqual(metrics.get_value('ratelimit_rejected', scope='test'), 3)
+
+    def test_interleaved_calls_cannot_overshoot(self):
+        results = []
+
+        class Interleaving:
+            """The cache, with other workers' calls landing right after this call's first round trip."""
+            def __init__(self, others):
+                self.others = others
+
+            def __getattr__(self, name):
+                def call(*args, **kwargs):
+                    result = getattr(cache, name)(*args, **kwargs)
+                    others, self.others = self.others, None
+                    if others:
+                        others()
+                    return result
+                return call
+
+        others = lambda: results.extend(consume('test', 'a')[0] for _ in range(3))
+        with mock.patch('core.ratelimit.cache', Interleaving(others)):
+            results.append(consume('test', 'a')[0])
+        self.assertEqual(results, [True, True, True, False])
+
+    def test_refund(self):
+        consume('test', 'a', cost=3)
+        self.assertFalse(consume('test', 'a', cost=1)[0])
+        refund('test', 'a', cost=2)
+        self.assertEqual([consume('test', 'a')[0] for _ in range(3)], [True, True, False])
+
+    def test_decorator_returns_429(self):
+        view = ratelimit('test', key='ip')(lambda request: HttpResponse("ok"))
+        factory = RequestFactory()
+        responses = [view(factory.post('/contact/', REMOTE_ADDR='10.0.0.1')) for _ in range(4)]
+        self.assertEqual([r.status_code for r in responses], [200, 200, 200, 429])
+        self.assertIn('Retry-After', responses[-1])
+        self.assertEqual(view(factory.get('/contact/', REMOTE_ADDR='10.0.0.1')).status_code, 200)  # GETs are free
+
+    @override_settings(RATELIMIT_USE_FORWARDED_FOR=True, RATELIMIT_TRUSTED_PROXY_HOPS=1)
+    def test_spoofed_forwarded_for_does_not_reset_the_bucket(self):
+        view = ratelimit('test', key='ip')(lambda request: HttpResponse("ok"))
+        factory = RequestFactory()
+        # The client forges a new first hop each time; the proxy appends the real address
+        responses = [
+            view(factory.post('/contact/', REMOTE_ADDR='10.0.0.9', HTTP_X_FORWARDED_FOR=f'1.2.3.{i}, 203.0.113.7'))
+            for i in range(4)
+        ]
+        self.assertEqual([r.status_code for r in responses], [200, 200, 200, 429])
+        self.assertEqual(client_ip(factory.post('/', HTTP_X_FORWARDED_FOR='203.0.113.7')), '203.0.113.7')
+
+    @override_settings(RATELIMIT_USE_FORWARDED_FOR=True, RATELIMIT_TRUSTED_PROXY_HOPS=2)
+    def test_trusted_hops_count_from_the_right(self):
+        factory = RequestFactory()
+        request = factory.post('/', HTTP_X_FORWARDED_FOR='1.2.3.4, 203.0.113.7, 10.1.0.5')
+        self.assertEqual(client_ip(request), '203.0.113.7')
+        self.assertEqual(client_ip(factory.post('/', HTTP_X_FORWARDED_FOR='203.0.113.7')), '203.0.113.7')
+
+
+def fake_cloudinary_upload(file, **options):
+    public_id = f"{options['folder']}/{os.path.splitext(file.name)[0]}"
+    return CloudinaryResource(public_id=public_id, resource_type='image', type='upload')
+
+
+class SpoolMixin:
+
+    def setUp(self):
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        overrides = override_settings(UPLOAD_SPOOL_DIR=spool.name, UPLOAD_SPOOL_STORAGE_OPTIONS={'location': spool.name},
+                                      UPLOAD_MAX_ATTEMPTS=2, UPLOAD_SPOOL_SYNC=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.spool_dir = spool.name
+
+    def register_seller(self):
+        form = SellerRegisterForm(
+            data={'username': 'roastery', 'email': 'r@example.com', 'package_tier': 'basic',
+                  'password1': 'Sidamo-2025!', 'password2': 'Sidamo-2025!'},
+            files={'business_license': SimpleUploadedFile('license.pdf', b'%PDF-1.4 license'),
+                   'id_card': SimpleUploadedFile('id.jpg', b'\xff\xd8 id card')},
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        return form.save()
+
+
+class BackgroundUploadTests(SpoolMixin, TestCase):
+
+    def test_registration_does_not_upload(self):
+        with mock.patch('cloudinary.models.uploader.upload_resource') as upload:
+            user = self.register_seller()
+        upload.assert_not_called()
+
+        doc = VerificationDoc.objects.get(user=user)
+        self.assertEqual(doc.upload_status, 'pending')
+        self.assertIsNone(doc.business_license)
+        self.assertEqual(len(os.listdir(self.spool_dir)), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with mock.patch('cloudinary.models.uploader.upload_resource', side_effect=fake_cloudinary_upload):
+                self.assertEqual(uploads.push_pending(), 1)
+
+        doc.refresh_from_db()
+        self.assertEqual(doc.upload_status, 'uploaded')
+        self.assertEqual(doc.business_license.public_id, 'legal_docs/licenses/license')
+        self.assertEqual(doc.id_card.public_id, 'legal_docs/ids/id')
+        self.assertEqual((doc.spooled_files, os.listdir(self.spool_dir)), ({}, []))
+
+    def test_failures_back_off_then_fail(self):
+        user = self.register_seller()
+        with mock.patch('cloudinary.models.uploader.upload_resource', side_effect=ConnectionError("timeout")):
+            uploads.push_pending()
+            doc = VerificationDoc.objects.get(user=user)
+            self.assertEqual((doc.upload_status, doc.upload_attempts), ('pending', 1))
+            self.assertIn("timeout", doc.upload_error)
+
+            self.assertEqual(uploads.push_pending(), 0)  # Not due yet
+            VerificationDoc.objects.update(next_upload_at=None)
+            uploads.push_pending()
+
+        doc.refresh_from_db()
+        self.assertEqual(doc.upload_status, 'failed')
+        self.assertEqual(len(doc.spooled_files), 2)  # Kept for a retry from the admin
+        self.assertEqual(uploads.requeue(VerificationDoc.objects.all()), 1)
+
+    def test_sync_mode_pushes_after_commit(self):
+        with override_settings(UPLOAD_SPOOL_SYNC=True), \
+                mock.patch('cloudinary.models.uploader.upload_resource', side_effect=fake_cloudinary_upload):
+            with self.captureOnCommitCallbacks(execute=True):
+                user = self.register_seller()
+        doc = VerificationDoc.objects.get(user=user)
+        self.assertEqual(doc.upload_status, 'uploaded')
+        self.assertEqual(doc.id_card.public_id, 'legal_docs/ids/id')
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_sync_mode_failure_waits_for_a_requeue(self):
+        with override_settings(UPLOAD_SPOOL_SYNC=True):
+            with mock.patch('cloudinary.models.uploader.upload_resource', side_effect=ConnectionError("timeout")), \
+                    self.captureOnCommitCallbacks(execute=True):
+                user = self.register_seller()
+            doc = VerificationDoc.objects.get(user=user)
+            self.assertEqual((doc.upload_status, doc.upload_attempts), ('failed', 1))  # Nothing would retry it
+
+            with mock.patch('cloudinary.models.uploader.upload_resource', side_effect=fake_cloudinary_upload), \
+                    self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(uploads.requeue(VerificationDoc.objects.all()), 1)
+        doc.refresh_from_db()
+        self.assertEqual(doc.upload_status, 'uploaded')
+
+    def test_claimed_rows_are_leased(self):
+        user = self.register_seller()
+        self.assertEqual(len(uploads.claim(VerificationDoc, 20)), 1)
+        self.assertEqual(uploads.push_pending(), 0)  # Another worker holds the lease
+
+        later = timezone.now() + timedelta(seconds=settings.UPLOAD_LEASE_SECONDS + 1)
+        self.assertEqual([doc.user_id for doc in uploads.claim(VerificationDoc, 20, now=later)], [user.id])
+
+
+class UploadWorkerTransactionTests(SpoolMixin, TransactionTestCase):
+
+    def test_uploads_run_outside_a_transaction(self):
+        self.register_seller()
+
+        def upload(file, **options):
+            self.assertFalse(connection.in_atomic_block)
+            return fake_cloudinary_upload(file, **options)
+
+        with mock.patch('cloudinary.models.uploader.upload_resource', side_effect=upload) as patched:
+            self.assertEqual(uploads.push_pending(), 1)
+        self.assertEqual(patched.call_count, 2)
+        self.assertEqual(VerificationDoc.objects.get().upload_status, 'uploaded')
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+
+@override_settings(INSTRUMENTATION_SAMPLE_RATE=1.0, INSTRUMENTATION_N_PLUS_ONE_THRESHOLD=5)
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_repeated_queries_are_flagged(self):
+        def view(request):
+            for user_id in range(6):
+                list(User.objects.filter(id=user_id))
+            User.objects.count()
+            return HttpResponse("ok")
+
+        with self.assertLogs('core.instrumentation', 'WARNING') as logs:
+            InstrumentationMiddleware(view)(RequestFactory().get('/report/'))
+
+        self.assertEqual(metrics.get_histogram('http_request_queries', view='unresolved')['sum'], 7)
+        self.assertEqual(metrics.get_histogram('http_request_duration_seconds', view='unresolved')['count'], 1)
+        self.assertEqual(len(logs.records), 1)
+        suspected = [labels for (name, labels) in metrics.snapshot()['counters'] if name == 'n_plus_one_suspected']
+        self.assertEqual(len(suspected), 1)
+
+    def test_sampling_keeps_latency_only(self):
+        with override_settings(INSTRUMENTATION_SAMPLE_RATE=0.0):
+            self.client.get(reverse('about'))
+        self.assertEqual(metrics.get_histogram('http_request_duration_seconds', view='about')['count'], 1)
+        self.assertIsNone(metrics.get_histogram('http_request_queries', view='about'))
+
+    def test_render_time_and_prometheus_endpoint(self):
+        self.client.get(reverse('landing_page'))
+        self.assertEqual(metrics.get_histogram('http_render_seconds', view='landing_page')['count'], 1)
+
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with override_settings(METRICS_TOKEN='scrape-me'):
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="landing_page",le="+Inf"} 1', body)
+        self.assertIn('http_requests{status="2xx",view="landing_page"} 1', body)
+
+
+class SeedMarketplaceTests(TestCase):
+    def seed(self, **counts):
+        options = {'sellers': 5, 'buyers': 20, 'products': 30, 'orders': 200, 'rooms': 8, 'messages': 120, 'seed': 7}
+        options.update(counts)
+        call_command('seed_marketplace', stdout=StringIO(), **options)
+
+    def test_counts_and_consistency(self):
+        self.seed()
+        self.assertEqual(User.objects.filter(role=User.SELLER).count(), 5)
+        self.assertEqual(BusinessProfile.objects.count(), 25)
+        self.assertEqual(Product.objects.count(), 30)
+        self.assertEqual(Order.objects.count(), 200)
+        self.assertEqual(ChatParticipant.objects.count(), 16)
+        for room in ChatRoom.objects.annotate(top=Max('messages__seq'), total=Count('messages')):
+            self.assertLessEqual(room.participant_1_id, room.participant_2_id)
+            self.assertEqual((room.top or 0, room.total), (room.last_seq, room.last_seq))
+        for notification in Notification.objects.filter(notification_type='message').select_related('room'):
+            read = ChatParticipant.objects.get(room=notification.room, user=notification.recipient).last_read_seq
+            self.assertEqual(notification.event_count, notification.room.last_seq - read)
+        self.assertFalse(Product.objects.filter(image__isnull=False).exists())
+
+    def test_same_seed_same_data(self):
+        self.seed()
+        first = list(Order.objects.order_by('id').values_list('product__name', 'quantity', 'status'))
+        Order.objects.all().delete()
+        User.objects.all().delete()
+        self.seed()
+        second = list(Order.objects.order_by('id').values_list('product__name', 'quantity', 'status'))
+        self.assertEqual(first, second)
+
+    def test_refuses_to_seed_twice(self):
+        self.seed(orders=0, messages=0, rooms=0)
+        with self.assertRaises(CommandError):
+            self.seed()
@@ -0,0 +1,186 @@
+"""
+Background uploads for seller documents (VerificationDoc, BusinessCertification).
+
+Forms call spool() to copy the uploaded files into the spool storage
+(UPLOAD_SPOOL_STORAGE) and mark the row pending, so the request commits
+without talking to Cloudinary, then schedule() once the row is saved.
+
+In sync mode (UPLOAD_SPOOL_SYNC, the default while no worker is deployed)
+schedule() pushes the files right after the row commits, still in the
+request. A failed sync push is marked failed at once, since nothing would
+retry it, and the admin can requeue it (which pushes again in sync mode).
+
+Otherwise `run_upload_worker` calls push_pending(). It claims due rows in a short transaction by leasing them (next_upload_at
+moves UPLOAD_LEASE_SECONDS ahead), then uploads with no transaction open.
+Each spooled file goes through the model's own CloudinaryField, so the
+folder and resource_type options still apply, and the spool copy is
+deleted once the row is saved. If a worker dies mid-batch, its rows become
+due again when the lease runs out.
+
+A failed worker push is retried UPLOAD_MAX_ATTEMPTS times with exponential
+backoff, after which the row is marked failed with the last error. The
+admin review queue shows the state and can requeue failed rows.
+
+The worker must be able to read what the web processes spooled. The
+default storage is the local UPLOAD_SPOOL_DIR, which only works when both
+run on one machine (or share a disk). On hosts where every service has
+its own disk, such as Render, point UPLOAD_SPOOL_STORAGE at storage they
+share.
+"""
+import logging
+import os
+import uuid
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .models import SpooledUpload
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_MODELS = ['accounts.VerificationDoc', 'market.BusinessCertification']
+
+
+def spool_storage():
+    return import_string(settings.UPLOAD_SPOOL_STORAGE)(**settings.UPLOAD_SPOOL_STORAGE_OPTIONS)
+
+
+def spool(instance, **files):
+    """
+    Copies uploaded files (field name -> UploadedFile) to the spool storage
+    and marks `instance` pending. The caller saves the instance.
+    """
+    storage = spool_storage()
+    spooled = dict(instance.spooled_files or {})
+    for field, uploaded in files.items():
+        extension = os.path.splitext(uploaded.name)[1].lower()[:10]
+        path = storage.save(f"{uuid.uuid4().hex}{extension}", uploaded)
+        spooled[field] = {'path': path, 'name': uploaded.name}
+        setattr(instance, field, None)
+
+    instance.spooled_files = spooled
+    instance.upload_status = SpooledUpload.PENDING
+    instance.upload_attempts = 0
+    instance.upload_error = ''
+    instance.next_upload_at = None
+
+
+def schedule(instance):
+    """Call once a spooled row is saved. In sync mode the push runs as soon as the row commits."""
+    if settings.UPLOAD_SPOOL_SYNC:
+        model, pk = type(instance), instance.pk
+        transaction.on_commit(lambda: push_now(model, [pk]))
+
+
+def push_now(model, ids):
+    for row in claim(model, len(ids), ids=ids):
+        push(row, retry=False)
+
+
+def requeue(queryset):
+    """Gives failed rows a fresh set of attempts (admin action)."""
+    model = queryset.model
+    ids = list(queryset.filter(upload_status=SpooledUpload.FAILED).values_list('id', flat=True))
+    requeued = model.objects.filter(id__in=ids).update(
+        upload_status=SpooledUpload.PENDING, upload_attempts=0, next_upload_at=None,
+    )
+    if settings.UPLOAD_SPOOL_SYNC and ids:
+        transaction.on_commit(lambda: push_now(model, ids))
+    return requeued
+
+
+def backoff(attempts):
+    return timedelta(seconds=settings.UPLOAD_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+
+
+def push(instance, retry=True):
+    """
+    Uploads every spooled file of a claimed row. Returns True when all are
+    stored. Call it outside a transaction: the uploads are remote calls.
+    With retry=False a failure marks the row failed straight away.
+    """
+    storage = spool_storage()
+    spooled = dict(instance.spooled_files)
+    label = instance._meta.label
+    try:
+        for field, entry in list(spooled.items()):
+            remaining = {name: other for name, other in spooled.items() if name != field}
+            with storage.open(entry['path'], 'rb') as f:
+                setattr(instance, field, UploadedFile(f, name=entry['name'], size=storage.size(entry['path'])))
+                # CloudinaryField.pre_save uploads and swaps in the stored resource,
+                # so the save below only writes the public id
+                instance._meta.get_field(field).pre_save(instance, False)
+            instance.spooled_files = remaining
+            instance.save(update_fields=[field, 'spooled_files'])
+            spooled = remaining
+            transaction.on_commit(lambda path=entry['path']: storage.delete(path))
+    except Exception as e:
+        setattr(instance, field, None)
+        instance.spooled_files = spooled
+        instance.upload_attempts += 1
+        instance.upload_error = f"{type(e).__name__}: {e}"[:1000]
+        if not retry or instance.upload_attempts >= settings.UPLOAD_MAX_ATTEMPTS:
+            instance.upload_status = SpooledUpload.FAILED
+            instance.next_upload_at = None
+            metrics.incr('uploads_failed', model=label)
+        else:
+            instance.next_upload_at = timezone.now() + backoff(instance.upload_attempts)
+        instance.save(update_fields=['upload_status', 'upload_attempts', 'upload_error', 'next_upload_at'])
+        logger.warning("Upload of %s %s failed (attempt %s): %s", label, instance.pk, instance.upload_attempts, e)
+        return False
+
+    instance.upload_status = SpooledUpload.UPLOADED
+    instance.upload_error = ''
+    instance.next_upload_at = None
+    instance.save(update_fields=['upload_status', 'upload_error', 'next_upload_at'])
+    metrics.incr('uploads_pushed', model=label)
+    return True
+
+
+def claim(model, batch_size, now=None, ids=None):
+    """
+    Leases up to `batch_size` due rows of `model` (only `ids`, if given) and
+    returns them. The lock (SKIP LOCKED, so several workers can run side by
+    side) is only held while the lease is written.
+    """
+    now = now or timezone.now()
+    due = model.objects.filter(upload_status=SpooledUpload.PENDING)
+    if ids is not None:
+        due = due.filter(id__in=ids)
+    with transaction.atomic():
+        ids = list(
+            due.select_for_update(skip_locked=True)
+            .filter(Q(next_upload_at__isnull=True) | Q(next_upload_at__lte=now))
+            .order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        model.objects.filter(id__in=ids).update(next_upload_at=now + timedelta(seconds=settings.UPLOAD_LEASE_SECONDS))
+    return list(model.objects.filter(id__in=ids).order_by('id'))
+
+
+def push_pending(batch_size=20):
+    """Pushes up to `batch_size` due rows per model. Returns how many rows were attempted."""
+    attempted = 0
+    for label in UPLOAD_MODELS:
+        rows = claim(apps.get_model(label), batch_size)
+        for row in rows:
+            push(row)
+        attempted += len(rows)
+    return attempted
+
+
+def upload_stats():
+    stats = {}
+    for label in UPLOAD_MODELS:
+        queryset = apps.get_model(label).objects.exclude(upload_status=SpooledUpload.UPLOADED)
+        stats[label] = {
+            'pending': queryset.filter(upload_status=SpooledUpload.PENDING).count(),
+            'failed': queryset.filter(upload_status=SpooledUpload.FAILED).count(),
+        }
+    return stats
@@ -1,14 +1,23 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Count, Sum, Q
+from django.db.models import Count, Prefetch, Sum
 from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseForbidden
+import hmac
 import json
-import random  
 
 # --- IMPORTS ---
+from . import metrics, uploads
 from .models import Notification
-from chat.models import ChatRoom, Message
+from .outbox import enqueue_notification
+from .pagination import keyset_page
+from .ratelimit import ratelimit
+from .retention import delete_in_batches
+from accounts.models import VerificationDoc
+from chat import support
 # We use BusinessProfile and BusinessCertification now (per your previous fix)
 from market.models import Product, Order, BusinessProfile, BusinessCertification
 
@@ -18,6 +27,7 @@ User = get_user_model()
 # 1. MARKETING & PUBLIC VIEWS
 # ==========================================
 
+@ratelimit('contact_form', key='ip')
 def marketing_contact(request):
     if request.method == 'POST':
         name = request.POST.get('name')
@@ -26,26 +36,6 @@ def marketing_contact(request):
         country = request.POST.get('Category-2')
         body = request.POST.get('field')
 
-        admins = list(User.objects.filter(Q(role='admin') | Q(is_superuser=True), is_active=True))
-
-        if not admins:
-            messages.error(request, "System Error: No support agents available.")
-            return redirect('contact')
-
-        target_admin = random.choice(admins)
-        guest_user, created = User.objects.get_or_create(username="Website_Guest")
-        if created:
-            guest_user.set_unusable_password()
-            guest_user.save()
-
-        room = ChatRoom.objects.filter(
-            (Q(participant_1=guest_user) & Q(participant_2=target_admin)) |
-            (Q(participant_1=target_admin) & Q(participant_2=guest_user))
-        ).first()
-
-        if not room:
-            room = ChatRoom.objects.create(participant_1=guest_user, participant_2=target_admin)
-
         full_message = (
             f"📢 **NEW CONTACT INQUIRY** <br>"
             f"👤 Name: {name} <br>"
@@ -56,8 +46,11 @@ def marketing_contact(request):
             f"{body}"
         )
 
-        Message.objects.create(room=room, sender=guest_user, content=full_message)
-        room.save()
+        # One ticket room per inquiry, assigned to the least-loaded agent
+        ticket = support.open_ticket(full_message, guest_name=name, guest_email=email, guest_phone=phone, source='marketing')
+        if ticket is None:
+            messages.error(request, "System Error: No support agents available.")
+            return redirect('contact')
 
         messages.success(request, f"Thank you, {name}! Your message has been sent to our support team.")
         return redirect('contact')
@@ -130,6 +123,7 @@ def admin_dashboard(request):
         'total_revenue': total_revenue,
         'chart_labels': json.dumps(labels),
         'chart_values': json.dumps(values),
+        'support_queues': support.queue_depths(),
     }
     return render(request, 'admin_panel/dashboard.html', context)
 
@@ -150,83 +144,96 @@ def admin_users(request):
         if user_id and action in ['suspend', 'unsuspend', 'approve_identity', 'revoke_identity']:
             target_user = get_object_or_404(User, id=user_id)
 
-            if action == 'suspend':
-                target_user.is_active = False
-                target_user.save()
-                messages.warning(request, f"User {target_user.username} suspended.")
-                # Notify
-                Notification.objects.create(
-                    recipient=target_user,
-                    message="Your account has been suspended by the administrator.",
-                    link="#"
-                )
-                
-            elif action == 'unsuspend':
-                target_user.is_active = True
-                target_user.save()
-                messages.success(request, f"User {target_user.username} restored.")
-                # Notify
-                Notification.objects.create(
-                    recipient=target_user,
-                    message="Your account has been reactivated.",
-                    link="/account/business-profile/"
-                )
-
-            elif action == 'approve_identity':
-                target_user.is_verified = True
-                target_user.save()
-                messages.success(request, f"Identity verified for {target_user.username}.")
-                # Notify
-                Notification.objects.create(
-                    recipient=target_user,
-                    message="Your identity verification has been Approved! You are now a Verified user.",
-                    link="/account/business-profile/"
-                )
-                
-            elif action == 'revoke_identity':
-                target_user.is_verified = False
-                target_user.save()
-                messages.warning(request, f"Identity verification revoked for {target_user.username}.")
-                # Notify
-                Notification.objects.create(
-                    recipient=target_user,
-                    message="Your identity verification status has been revoked. Please check your documents.",
-                    link="/account/business-profile/"
-                )
+            with transaction.atomic():
+                if action == 'suspend':
+                    target_user.is_active = False
+                    target_user.save()
+                    messages.warning(request, f"User {target_user.username} suspended.")
+                    # Notify
+                    enqueue_notification(
+                        recipient_id=target_user.id,
+                        message="Your account has been suspended by the administrator.",
+                        link="#"
+                    )
+                    
+                elif action == 'unsuspend':
+                    target_user.is_active = True
+                    target_user.save()
+                    messages.success(request, f"User {target_user.username} restored.")
+                    # Notify
+                    enqueue_notification(
+                        recipient_id=target_user.id,
+                        message="Your account has been reactivated.",
+                        link="/account/business-profile/"
+                    )
+
+                elif action == 'approve_identity':
+                    target_user.is_verified = True
+                    target_user.save()
+                    messages.success(request, f"Identity verified for {target_user.username}.")
+                    # Notify
+                    enqueue_notification(
+                        recipient_id=target_user.id,
+                        message="Your identity verification has been Approved! You are now a Verified user.",
+                        link="/account/business-profile/"
+                    )
+                    
+                elif action == 'revoke_identity':
+                    target_user.is_verified = False
+                    target_user.save()
+                    messages.warning(request, f"Identity verification revoked for {target_user.username}.")
+                    # Notify
+                    enqueue_notification(
+                        recipient_id=target_user.id,
+                        message="Your identity verification status has been revoked. Please check your documents.",
+                        link="/account/business-profile/"
+                    )
+
+        # --- Upload retries (see core.uploads) ---
+        elif action == 'retry_identity_upload':
+            uploads.requeue(VerificationDoc.objects.filter(user_id=user_id))
+            messages.info(request, "Identity documents queued for another upload attempt.")
+
+        elif action == 'retry_cert_upload':
+            uploads.requeue(BusinessCertification.objects.filter(id=request.POST.get('cert_id')))
+            messages.info(request, "Certificate queued for another upload attempt.")
 
         # --- B. Certificate Actions ---
         elif action in ['verify_cert', 'reject_cert']:
             cert_id = request.POST.get('cert_id')
             # Use BusinessCertification (New Model Name)
-            cert = get_object_or_404(BusinessCertification, id=cert_id)
-            cert_owner = cert.profile.user # Get the user to notify
-
-            if action == 'verify_cert':
-                cert.is_verified = True
-                cert.save()
-                messages.success(request, f"Certificate '{cert.name}' approved.")
-                # Notify
-                Notification.objects.create(
-                    recipient=cert_owner,
-                    message=f"Your document '{cert.name}' has been Verified by Admin.",
-                    link="/account/business-profile/"
-                )
-
-            elif action == 'reject_cert':
-                cert.is_verified = False
-                cert.save()
-                messages.warning(request, f"Certificate '{cert.name}' rejected.")
-                # Notify
-                Notification.objects.create(
-                    recipient=cert_owner,
-                    message=f"Your document '{cert.name}' was rejected. Please upload a valid copy.",
-                    link="/account/business-profile/"
-                )
+            cert = get_object_or_404(BusinessCertification.objects.select_related('profile'), id=cert_id)
+            cert_owner_id = cert.profile.user_id # Get the user to notify
+
+            with transaction.atomic():
+                if action == 'verify_cert':
+                    cert.is_verified = True
+                    cert.save()
+                    messages.success(request, f"Certificate '{cert.name}' approved.")
+                    # Notify
+                    enqueue_notification(
+                        recipient_id=cert_owner_id,
+                        message=f"Your document '{cert.name}' has been Verified by Admin.",
+                        link="/account/business-profile/"
+                    )
+
+                elif action == 'reject_cert':
+                    cert.is_verified = False
+                    cert.save()
+                    messages.warning(request, f"Certificate '{cert.name}' rejected.")
+                    # Notify
+                    enqueue_notification(
+                        recipient_id=cert_owner_id,
+                        message=f"Your document '{cert.name}' was rejected. Please upload a valid copy.",
+                        link="/account/business-profile/"
+                    )
 
         return redirect('admin_users')
 
     # GET Request: Optimized Query
-    users = User.objects.select_related('business_profile', 'verification_doc').prefetch_related('business_profile__certificates').all().order_by('-date_joined')
+    users = User.objects.select_related('business_profile', 'verification_doc').prefetch_related(
+        Prefetch('business_profile__certificates', queryset=BusinessCertification.objects.select_related('duplicate_of__profile__user'))
+    ).all().order_by('-date_joined')
     
     return render(request, 'admin_panel/users.html', {'users': users})
 
@@ -273,8 +280,17 @@ def mark_notification_read(request, notif_id):
 
 @login_required
 def all_notifications(request):
-    all_notifs = Notification.objects.filter(recipient=request.user).order_by('-created_at')
-    return render(request, 'core/notifications.html', {'all_notifs': all_notifs})
+    all_notifs, next_cursor = keyset_page(
+        Notification.objects.filter(recipient=request.user),
+        'created_at',
+        before=request.GET.get('before'),
+        size=settings.NOTIFICATION_PAGE_SIZE,
+    )
+    return render(request, 'core/notifications.html', {
+        'all_notifs': all_notifs,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('before'),
+    })
 
 @login_required
 def mark_all_read(request):
@@ -284,6 +300,21 @@ def mark_all_read(request):
 
 @login_required
 def delete_all_notifications(request):
-    Notification.objects.filter(recipient=request.user).delete()
+    # Bounded batches so a huge history never locks a big range at once
+    delete_in_batches(Notification.objects.filter(recipient=request.user), batch_size=settings.NOTIFICATION_PURGE_BATCH_SIZE)
     messages.warning(request, "All notifications cleared.")
     return redirect('all_notifications')
+
+# ==========================================
+# 4. MONITORING
+# ==========================================
+
+def prometheus_metrics(request):
+    """core.metrics in Prometheus text format. Counts are per process; scrape each one."""
+    token = settings.METRICS_TOKEN
+    authorized = request.user.is_staff or (
+        token and hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
+    )
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,4 +1,6 @@
 from django.contrib import admin
+from core import uploads
+from . import storefront
 from .models import Product, Order, BusinessProfile, BusinessCertification
 
 # 1. Product & Order
@@ -22,10 +24,19 @@ class BusinessProfileAdmin(admin.ModelAdmin):
 # 3. Certifications (Admin Verification)
 @admin.register(BusinessCertification)
 class CertificationAdmin(admin.ModelAdmin):
-    list_display = ('name', 'profile', 'is_verified', 'expiry_date')
-    list_filter = ('is_verified', 'name')
-    actions = ['verify_documents']
+    list_display = ('name', 'profile', 'is_verified', 'upload_status', 'duplicate_of', 'expiry_date')
+    list_filter = ('is_verified', 'upload_status', ('duplicate_of', admin.EmptyFieldListFilter), 'name')
+    list_select_related = ('profile__user', 'duplicate_of__profile__user')
+    readonly_fields = ('upload_status', 'upload_attempts', 'upload_error', 'next_upload_at', 'spooled_files', 'duplicate_of')
+    actions = ['verify_documents', 'retry_uploads']
 
     def verify_documents(self, request, queryset):
         queryset.update(is_verified=True)
+        # .update() skips the signals that keep storefronts fresh
+        for user_id in set(queryset.values_list('profile__user_id', flat=True)):
+            storefront.invalidate(user_id)
     verify_documents.short_description = "Mark selected documents as Verified"
+
+    def retry_uploads(self, request, queryset):
+        self.message_user(request, f"Requeued {uploads.requeue(queryset)} failed uploads.")
+    retry_uploads.short_description = "Retry failed uploads"
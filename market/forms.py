@@ -32,3 +32,8 @@ class CertificationForm(forms.ModelForm):
             'authority_name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'e.g. Fairtrade International'}),
             'document_image': forms.FileInput(attrs={'class': 'form-control'}),
         }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Blank on the model only while the upload worker is pushing the file
+        self.fields['document_image'].required = True
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:13
+
+import cloudinary.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='businesscertification',
+            name='next_upload_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='businesscertification',
+            name='spooled_files',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='businesscertification',
+            name='upload_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='businesscertification',
+            name='upload_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='businesscertification',
+            name='upload_status',
+            field=models.CharField(choices=[('pending', 'Uploading'), ('uploaded', 'Uploaded'), ('failed', 'Upload failed')], db_index=True, default='uploaded', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='businesscertification',
+            name='document_image',
+            field=cloudinary.models.CloudinaryField(blank=True, max_length=255, null=True, verbose_name='image'),
+        ),
+    ]
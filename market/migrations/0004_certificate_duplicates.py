@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0003_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='businesscertification',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='market.businesscertification'),
+        ),
+    ]
@@ -1,9 +1,12 @@
 from django.db import models
 from django.conf import settings
+from django.db import transaction
 from cloudinary.models import CloudinaryField
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
+from core.models import SpooledUpload
+
 # NOTE: User model is imported from settings.AUTH_USER_MODEL via ForeignKey
 
 class Product(models.Model):
@@ -19,6 +22,10 @@ class Product(models.Model):
     category = models.CharField(max_length=50, choices=CATEGORY_CHOICES, default='Green')
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = CloudinaryField('image', folder='products', blank=True, null=True)
+    # Recorded by core.images when the photo is processed
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    image_blurhash = models.CharField(max_length=64, blank=True)
     description = models.TextField()
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -35,6 +42,8 @@ class Order(models.Model):
         ('Shipped', 'Shipped'),
         ('Delivered', 'Delivered'),
     ]
+    # Orders that count as sales
+    SUCCESSFUL_STATUSES = ['Paid', 'Shipped', 'Delivered']
 
     buyer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -45,7 +54,9 @@ class Order(models.Model):
 
     def save(self, *args, **kwargs):
         self.total_price = self.product.price * self.quantity
-        super().save(*args, **kwargs)
+        # post_save queues notifications in the outbox; keep both in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
 class BusinessProfile(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='business_profile')
@@ -59,6 +70,9 @@ class BusinessProfile(models.Model):
     # Details
     company_name = models.CharField(max_length=100, blank=True)
     logo = CloudinaryField('image', folder='business_logos', blank=True, null=True)
+    logo_width = models.PositiveIntegerField(null=True, blank=True)
+    logo_height = models.PositiveIntegerField(null=True, blank=True)
+    logo_blurhash = models.CharField(max_length=64, blank=True)
     country = models.CharField(max_length=100, blank=True)
     city = models.CharField(max_length=100, blank=True)
     description = models.TextField(blank=True, max_length=500)
@@ -67,7 +81,7 @@ class BusinessProfile(models.Model):
     def __str__(self):
         return f"Profile: {self.user.username}"
 
-class BusinessCertification(models.Model):
+class BusinessCertification(SpooledUpload):
     CERT_CHOICES = [
         ('Fair Trade', 'Fair Trade International'),
         ('USDA Organic', 'USDA Organic'),
@@ -82,11 +96,14 @@ class BusinessCertification(models.Model):
 
     profile = models.ForeignKey(BusinessProfile, on_delete=models.CASCADE, related_name='certificates')
     name = models.CharField(max_length=50, choices=CERT_CHOICES)
-    document_image = CloudinaryField('image', folder='business_certs')
+    # Empty until the upload worker has pushed the spooled file
+    document_image = CloudinaryField('image', folder='business_certs', blank=True, null=True)
     authority_name = models.CharField(max_length=100)
     expiry_date = models.DateField(null=True, blank=True)
     is_verified = models.BooleanField(default=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # Set by core.imagehash when the image is a near copy of an earlier certificate
+    duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
 
     def __str__(self):
         return f"{self.name} - {self.profile.user.username}"
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import BusinessCertification, BusinessProfile, Order, Product
+from .storefront import invalidate
+
+
+# --- STOREFRONT CACHE (market.storefront) ---
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def invalidate_seller(sender, instance, **kwargs):
+    invalidate(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=BusinessProfile)
+def invalidate_profile(sender, instance, **kwargs):
+    invalidate(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=BusinessCertification)
+def invalidate_certificate(sender, instance, **kwargs):
+    # Not instance.profile: on a cascading delete the profile row is already gone
+    user_id = BusinessProfile.objects.filter(id=instance.profile_id).values_list('user_id', flat=True).first()
+    if user_id:
+        invalidate(user_id)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    invalidate(instance.seller_id)
+
+
+@receiver([post_save, post_delete], sender=Order)
+def invalidate_order(sender, instance, created=False, **kwargs):
+    # New carts don't count; any later save may move the order in or out of the successful statuses
+    if created and instance.status not in Order.SUCCESSFUL_STATUSES:
+        return
+    if Order.product.is_cached(instance):
+        invalidate(instance.product.seller_id)
+        return
+    seller_id = Product.objects.filter(id=instance.product_id).values_list('seller_id', flat=True).first()
+    if seller_id:
+        invalidate(seller_id)
@@ -0,0 +1,76 @@
+"""
+Cached storefront summaries for the public seller page.
+
+storefront(seller_id) returns everything public_business_profile renders:
+the seller, their BusinessProfile, active products, verified certificates
+and the order and product counts. The first request builds it with a
+handful of queries and caches it per seller. Later requests are a single
+cache get.
+
+market.signals deletes the entry when the seller, their profile, a
+certificate or a product changes, or when one of their orders is saved in
+(or moves out of) a successful status. Bulk .update() calls skip those
+signals and must call invalidate() themselves (see the certification admin
+action).
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404
+
+from core import metrics
+from .models import BusinessCertification, BusinessProfile, Order, Product
+
+# Bump when the cached models or the summary's shape change
+CACHE_VERSION = 1
+
+
+def storefront_key(seller_id):
+    return f"storefront:v{CACHE_VERSION}:{seller_id}"
+
+
+def invalidate(seller_id):
+    key = storefront_key(seller_id)
+    cache.delete(key)
+    # Again after commit, so a page built from the old rows meanwhile can't stick
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def get_profile(user):
+    """The user's BusinessProfile, from the (cached) user when it was loaded with it."""
+    try:
+        return user.business_profile
+    except BusinessProfile.DoesNotExist:
+        # Users created before the post_save receiver existed
+        return BusinessProfile.objects.get_or_create(user=user)[0]
+
+
+def build(seller_id):
+    seller = get_user_model().objects.select_related('business_profile').filter(id=seller_id).first()
+    if seller is None:
+        return None
+    profile = get_profile(seller)
+    return {
+        'seller': seller,
+        'profile': profile,
+        'products': list(Product.objects.filter(seller=seller, is_active=True)),
+        'certs': list(BusinessCertification.objects.filter(profile=profile, is_verified=True)),
+        'successful_orders': Order.objects.filter(
+            product__seller=seller, status__in=Order.SUCCESSFUL_STATUSES,
+        ).count(),
+        'product_count_all': Product.objects.filter(seller=seller).count(),
+    }
+
+
+def storefront(seller_id):
+    """The seller's storefront summary (a dict); raises Http404 for unknown sellers."""
+    key = storefront_key(seller_id)
+    summary = cache.get(key)
+    if summary is None:
+        metrics.incr('storefront_cache_misses')
+        summary = build(seller_id)
+        if summary is None:
+            raise Http404("No such seller.")
+        cache.set(key, summary, settings.STOREFRONT_CACHE_TIMEOUT)
+    return summary
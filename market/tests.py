@@ -1,3 +1,222 @@
-from django.test import TestCase
+import io
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.admin.sites import site
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from core import imagehash, images
+from core.models import ImageHash
+from core.tests import fake_cloudinary_upload
+from . import storefront
+from .models import BusinessCertification, Order, Product
+
+User = get_user_model()
+
+
+def photo_bytes(size=(400, 200), orientation=None, format='JPEG'):
+    gradient = Image.radial_gradient('L').resize(size)
+    image = Image.merge('RGB', (gradient, gradient.rotate(90), Image.new('L', size, 60)))
+    image.paste((200, 200, 200), (0, 0, size[0] // 4, size[1] // 4))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    exif[0x010F] = 'PhoneMaker'
+    output = io.BytesIO()
+    image.save(output, format, exif=exif.tobytes())
+    return output.getvalue()
+
+
+class ImagePipelineTests(TestCase):
+
+    def test_orients_downscales_and_strips_exif(self):
+        # Orientation 6: stored landscape, displayed portrait
+        upload = SimpleUploadedFile('lot 7.jpeg', photo_bytes(orientation=6))
+        with override_settings(IMAGE_MAX_EDGE=100):
+            processed = images.prepare(upload)
+
+        self.assertEqual((processed.width, processed.height), (50, 100))
+        self.assertEqual(len(processed.blurhash), 28)  # 4x3 components
+        output = Image.open(processed.file)
+        self.assertEqual(output.size, (50, 100))
+        self.assertEqual(dict(output.getexif()), {})
+        self.assertEqual(processed.file.name, f"lot 7.{output.format.lower().replace('jpeg', 'jpg')}")
+
+    def test_quality_targets_byte_budget(self):
+        noisy = Image.effect_noise((600, 600), 80).convert('RGB')
+        loose = images.encode(noisy, 'JPEG', 10 ** 7, (55, 85))
+        tight = images.encode(noisy, 'JPEG', len(loose) // 2, (55, 85))
+        self.assertLess(len(tight), len(loose))
+
+    def test_rejects_non_images(self):
+        with self.assertRaises(images.ImageError):
+            images.prepare(SimpleUploadedFile('lot.jpg', b'not an image'))
+
+    @override_settings(IMAGE_PROCESS_WORKERS=1)
+    def test_process_pool(self):
+        self.addCleanup(images.shutdown_pool)
+        processed = images.prepare(SimpleUploadedFile('lot.png', photo_bytes(format='PNG')))
+        self.assertEqual((processed.width, processed.height), (400, 200))
+
+    def test_product_upload_is_processed_before_storage(self):
+        seller = User.objects.create_user('roastery', password='x', role='seller', is_verified=True)
+        self.client.force_login(seller)
+        photo = SimpleUploadedFile('lot.jpg', photo_bytes(size=(3000, 2000)))
+        with override_settings(IMAGE_MAX_EDGE=1200), \
+                mock.patch('cloudinary.models.uploader.upload_resource', side_effect=fake_cloudinary_upload) as upload:
+            self.client.post(reverse('seller_products'), {
+                'action': 'add', 'name': 'Yirgacheffe', 'category': 'Green',
+                'price': '12.50', 'description': 'Washed', 'image': photo,
+            })
+
+        stored = upload.call_args.args[0]
+        self.assertEqual(Image.open(stored).size, (1200, 800))
+        product = Product.objects.get()
+        self.assertEqual((product.image_width, product.image_height), (1200, 800))
+        self.assertTrue(product.image_blurhash)
+
+
+class ImageHashTests(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user('roastery', password='x', role='seller', is_verified=True)
+        self.client.force_login(self.seller)
+
+    def flip(self, value, *bits):
+        for bit in bits:
+            value ^= 1 << bit
+        return value
+
+    def test_multi_index_lookup(self):
+        base = 0x0123456789ABCDEF
+        near = self.flip(base, 0, 1, 17, 40, 41, 60)  # 6 bits, spread over all four chunks
+        far = self.flip(base, *range(0, 64, 6))  # 11 bits
+        for object_id, value in enumerate([near, far], start=1):
+            imagehash.record('product', Product(pk=object_id), value, self.seller)
+
+        with self.assertNumQueries(1):
+            found = imagehash.similar('product', base, 6)
+        self.assertEqual([(row.object_id, row.distance) for row in found], [(1, 6)])
+        self.assertEqual(imagehash.similar('product', base, 5), [])
+        self.assertEqual(ImageHash.objects.get(object_id=1).chunk_0, near & 0xFFFF)
+
+    def add_product(self, photo):
+        return self.client.post(reverse('seller_products'), {
+            'action': 'add', 'name': 'Sidamo', 'category': 'Green',
+            'price': '9.00', 'description': 'Natural', 'image': photo,
+        })
+
+    def test_identical_product_photo_reuses_asset(self):
+        data = photo_bytes(size=(800, 600))
+        with mock.patch('cloudinary.models.uploader.upload_resource', side_effect=fake_cloudinary_upload) as upload:
+            self.add_product(SimpleUploadedFile('lot.jpg', data))
+            self.add_product(SimpleUploadedFile('lot-again.jpg', data))
+        self.assertEqual(upload.call_count, 1)
+        first, second = Product.objects.order_by('id')
+        self.assertEqual(second.image.public_id, first.image.public_id)
+
+        # Another seller's identical photo is stored separately
+        other = User.objects.create_user('mill', password='x', role='seller', is_verified=True)
+        self.client.force_login(other)
+        with mock.patch('cloudinary.models.uploader.upload_resource', side_effect=fake_cloudinary_upload) as upload:
+            self.add_product(SimpleUploadedFile('lot.jpg', data))
+        self.assertEqual(upload.call_count, 1)
+
+    def test_same_dhash_different_file_is_uploaded(self):
+        data = photo_bytes(size=(800, 600))
+        resaved = io.BytesIO()
+        Image.open(io.BytesIO(data)).save(resaved, 'JPEG', quality=95)
+        copy = resaved.getvalue()
+        self.assertEqual(imagehash.hash_upload(io.BytesIO(data)), imagehash.hash_upload(io.BytesIO(copy)))
+
+        with mock.patch('cloudinary.models.uploader.upload_resource', side_effect=fake_cloudinary_upload) as upload:
+            self.add_product(SimpleUploadedFile('lot.jpg', data))
+            self.add_product(SimpleUploadedFile('lot-resaved.jpg', copy))
+        self.assertEqual(upload.call_count, 2)
+        self.assertEqual(
+            [row.sha256 for row in ImageHash.objects.order_by('id')],
+            [imagehash.content_hash(SimpleUploadedFile('a', data)), imagehash.content_hash(SimpleUploadedFile('b', copy))],
+        )
+
+    def upload_cert(self, data):
+        return self.client.post(reverse('business_profile'), {
+            'upload_cert': '1', 'name': 'Fair Trade', 'authority_name': 'FLO',
+            'document_image': SimpleUploadedFile('cert.jpg', data),
+        })
+
+    def test_duplicate_certificates_are_flagged(self):
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        data = photo_bytes(size=(600, 800))
+        with override_settings(UPLOAD_SPOOL_DIR=spool.name, UPLOAD_SPOOL_STORAGE_OPTIONS={'location': spool.name},
+                               UPLOAD_SPOOL_SYNC=False):
+            self.upload_cert(data)
+            original = BusinessCertification.objects.get()
+            self.assertIsNone(original.duplicate_of)
+            self.assertEqual(original.upload_status, 'pending')
+
+            # Once stored, the same seller's copy reuses the asset and skips the spool
+            BusinessCertification.objects.filter(id=original.id).update(
+                document_image='business_certs/cert', upload_status='uploaded', spooled_files={},
+            )
+            self.upload_cert(data)
+            again = BusinessCertification.objects.latest('id')
+            self.assertEqual(again.duplicate_of, original)
+            self.assertEqual(again.upload_status, 'uploaded')
+            self.assertEqual(again.document_image.public_id, 'business_certs/cert')
+
+            # A re-encoded copy from another seller is flagged, not reused
+            recompressed = io.BytesIO()
+            Image.open(io.BytesIO(data)).resize((300, 400)).save(recompressed, 'JPEG', quality=40)
+            other = User.objects.create_user('mill', password='x', role='seller', is_verified=True)
+            self.client.force_login(other)
+            self.upload_cert(recompressed.getvalue())
+            copy = BusinessCertification.objects.latest('id')
+            self.assertEqual(copy.duplicate_of, original)
+            self.assertEqual(copy.upload_status, 'pending')
+
+
+class StorefrontCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user('roastery', password='x', role='seller', is_verified=True)
+        self.buyer = User.objects.create_user('cafe', password='x')
+        self.product = Product.objects.create(seller=self.seller, name='Guji', price='10.00', description='Natural')
+        self.url = reverse('public_business_profile', args=[self.seller.id])
+
+    def test_warm_page_skips_the_database(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual([p.name for p in response.context['products']], ['Guji'])
+        self.assertEqual(self.client.get(reverse('public_business_profile', args=[999])).status_code, 404)
+
+    def test_changes_invalidate(self):
+        self.assertEqual(storefront.storefront(self.seller.id)['successful_orders'], 0)
+
+        order = Order.objects.create(buyer=self.buyer, product=self.product)
+        with self.assertNumQueries(0):
+            storefront.storefront(self.seller.id)  # A new pending order leaves the cache alone
+        order.status = 'Paid'
+        order.save()
+        self.assertEqual(storefront.storefront(self.seller.id)['successful_orders'], 1)
+
+        Product.objects.create(seller=self.seller, name='Sidamo', price='9.00', description='Washed')
+        self.assertEqual(storefront.storefront(self.seller.id)['product_count_all'], 2)
+
+        profile = self.seller.business_profile
+        profile.company_name = 'Guji Highlands'
+        profile.save()
+        self.assertEqual(storefront.storefront(self.seller.id)['profile'].company_name, 'Guji Highlands')
+
+        cert = BusinessCertification.objects.create(profile=profile, name='Fair Trade', authority_name='FLO')
+        self.assertEqual(storefront.storefront(self.seller.id)['certs'], [])
+        admin = site._registry[BusinessCertification]
+        admin.verify_documents(RequestFactory().post('/'), BusinessCertification.objects.filter(id=cert.id))
+        self.assertEqual(storefront.storefront(self.seller.id)['certs'], [cert])
@@ -2,6 +2,7 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Sum, Q, Value, DecimalField, Count
 from django.db.models.functions import Coalesce 
 from django.contrib.auth import get_user_model
@@ -9,8 +10,10 @@ import json
 
 # Import Models
 from .models import Product, Order, BusinessProfile, BusinessCertification
-from core.models import Notification 
+from core import imagehash, images, uploads
+from core.outbox import enqueue_notifications
 from .forms import CertificationForm 
+from . import storefront
 # pyment
 from django.conf import settings
 import stripe
@@ -98,14 +101,32 @@ def seller_products(request):
         action = request.POST.get('action')
         
         if action == 'add':
-            Product.objects.create(
-                seller=request.user,
-                name=request.POST.get('name'),
-                category=request.POST.get('category'),
-                price=request.POST.get('price'),
-                description=request.POST.get('description'),
-                image=request.FILES.get('image')
-            )
+            photo = {}
+            if 'image' in request.FILES:
+                try:
+                    content = imagehash.content_hash(request.FILES['image'])
+                    processed = images.prepare(request.FILES['image'])
+                except images.ImageError:
+                    messages.error(request, "That photo could not be read. Please upload a JPEG, PNG or WebP image.")
+                    return redirect('seller_products')
+                photo = {
+                    # Same file as one of the seller's listings: point at that asset instead of uploading again
+                    'image': imagehash.reusable_asset('product', content, request.user) or processed.file,
+                    'image_width': processed.width,
+                    'image_height': processed.height,
+                    'image_blurhash': processed.blurhash,
+                }
+            with transaction.atomic():
+                product = Product.objects.create(
+                    seller=request.user,
+                    name=request.POST.get('name'),
+                    category=request.POST.get('category'),
+                    price=request.POST.get('price'),
+                    description=request.POST.get('description'),
+                    **photo
+                )
+                if photo:
+                    imagehash.record('product', product, processed.dhash, request.user, content)
             messages.success(request, "Product listed.")
             
         elif action == 'remove':
@@ -147,7 +168,7 @@ def seller_orders(request):
 # ==========================
 @login_required
 def business_profile(request):
-    profile, created = BusinessProfile.objects.get_or_create(user=request.user)
+    profile = storefront.get_profile(request.user)
     cert_form = CertificationForm()
 
     # --- 1. HANDLE FORMS ---
@@ -166,9 +187,20 @@ def business_profile(request):
             profile.is_supplier = 'is_supplier' in request.POST
 
             if 'logo' in request.FILES:
-                profile.logo = request.FILES['logo']
+                try:
+                    content = imagehash.content_hash(request.FILES['logo'])
+                    processed = images.prepare(request.FILES['logo'], max_edge=settings.IMAGE_LOGO_MAX_EDGE)
+                except images.ImageError:
+                    messages.error(request, "That logo could not be read. Please upload a JPEG, PNG or WebP image.")
+                    return redirect('business_profile')
+                profile.logo = imagehash.reusable_asset('logo', content, request.user) or processed.file
+                profile.logo_width, profile.logo_height = processed.width, processed.height
+                profile.logo_blurhash = processed.blurhash
             
-            profile.save()
+            with transaction.atomic():
+                profile.save()
+                if 'logo' in request.FILES:
+                    imagehash.record('logo', profile, processed.dhash, request.user, content)
             messages.success(request, "Profile updated successfully.")
             return redirect('business_profile')
 
@@ -177,8 +209,27 @@ def business_profile(request):
             if cert_form.is_valid():
                 cert = cert_form.save(commit=False)
                 cert.profile = profile 
-                cert.save()
-                messages.success(request, "Document uploaded successfully.")
+                document = cert_form.cleaned_data['document_image']
+                digest = imagehash.hash_upload(document)
+                content = imagehash.content_hash(document)
+                with transaction.atomic():
+                    existing = imagehash.reusable_asset('certificate', content, request.user)
+                    if existing:
+                        cert.document_image = existing
+                    else:
+                        # Pushed to Cloudinary after commit, or by run_upload_worker
+                        uploads.spool(cert, document_image=document)
+                    if digest is not None:
+                        cert.duplicate_of = imagehash.closest('certificate', digest, settings.IMAGE_DUPLICATE_DISTANCE)
+                    cert.save()
+                    if not existing:
+                        uploads.schedule(cert)
+                    if digest is not None:
+                        imagehash.record('certificate', cert, digest, request.user, content)
+                if existing:
+                    messages.success(request, "Document received. It matches one you uploaded before and is ready for review.")
+                else:
+                    messages.success(request, "Document received. It will appear for review once the upload finishes.")
                 return redirect('business_profile')
             else:
                 messages.error(request, "Error uploading document.")
@@ -278,8 +329,8 @@ def business_profile(request):
 
 @login_required
 def view_business_profile(request, user_id):
-    user_obj = get_object_or_404(User, id=user_id)
-    profile, created = BusinessProfile.objects.get_or_create(user=user_obj)
+    user_obj = get_object_or_404(User.objects.select_related('business_profile'), id=user_id)
+    profile = storefront.get_profile(user_obj)
 
     # The SAME analytics logic you already have
     now = timezone.now()
@@ -402,25 +453,8 @@ def business_directory(request):
     return render(request, 'market/business_directory.html', context)
 
 def public_business_profile(request, seller_id):
-    seller = get_object_or_404(User, id=seller_id)
-    profile = get_object_or_404(BusinessProfile, user=seller)
-    
-    products = Product.objects.filter(seller=seller, is_active=True)
-    certs = BusinessCertification.objects.filter(profile=profile, is_verified=True)
-    
-    valid_status = ['Paid', 'Shipped', 'Delivered']
-    successful_orders = Order.objects.filter(product__seller=seller, status__in=valid_status).count()
-    product_count_all = Product.objects.filter(seller=seller).count()
-
-    
-    context = {
-        'seller': seller,
-        'profile': profile,
-        'products': products,
-        'certs': certs,
-        'successful_orders': successful_orders,
-        'product_count_all': product_count_all,
-    }
+    # Seller, profile, products, verified certs and counts: one cache get when warm
+    context = storefront.storefront(seller_id)
     return render(request, 'market/public_profile.html', context)
 
 
@@ -430,13 +464,13 @@ def public_business_profile(request, seller_id):
 # ==========================
 @login_required
 def create_order(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
+    product = get_object_or_404(Product.objects.select_related('seller'), id=product_id)
     
     if not product.seller.is_verified:
         messages.error(request, "Seller not verified.")
         return redirect('product_list')
 
-    if request.user == product.seller:
+    if request.user.id == product.seller_id:
         messages.warning(request, "You cannot buy your own product.")
         return redirect('product_detail', product_id=product.id)
 
@@ -486,34 +520,36 @@ def buyer_orders(request):
 
 @login_required
 def payment_page(request, order_id):
-    order = get_object_or_404(Order, id=order_id, buyer=request.user)
+    order = get_object_or_404(Order.objects.select_related('product'), id=order_id, buyer=request.user)
     
     if request.method == 'POST':
         if order.status == 'Paid':
             return redirect('buyer_orders')
             
-        order.status = 'Paid'
-        order.save()
-        
-        # --- ADD NOTIFICATIONS HERE TOO ---
-        # 1. Notify Buyer
-        Notification.objects.create(
-            recipient=request.user,
-            sender=order.product.seller,
-            notification_type='order',
-            message=f"Payment Successful: {order.product.name} ({order.quantity}kg)",
-            link=reverse('buyer_orders')
-        )
-        
-        # 2. Notify Seller
-        Notification.objects.create(
-            recipient=order.product.seller,
-            sender=request.user,
-            notification_type='order',
-            message=f"New Sale! {request.user.username} bought {order.quantity}kg.",
-            link=reverse('seller_orders')
-        )
-        # ----------------------------------
+        with transaction.atomic():
+            order.status = 'Paid'
+            order.save()
+            
+            # --- ADD NOTIFICATIONS HERE TOO ---
+            enqueue_notifications([
+                # 1. Notify Buyer
+                {
+                    'recipient_id': request.user.id,
+                    'sender_id': order.product.seller_id,
+                    'notification_type': 'order',
+                    'message': f"Payment Successful: {order.product.name} ({order.quantity}kg)",
+                    'link': reverse('buyer_orders'),
+                },
+                # 2. Notify Seller
+                {
+                    'recipient_id': order.product.seller_id,
+                    'sender_id': request.user.id,
+                    'notification_type': 'order',
+                    'message': f"New Sale! {request.user.username} bought {order.quantity}kg.",
+                    'link': reverse('seller_orders'),
+                },
+            ])
+            # ----------------------------------
 
         messages.success(request, "Payment successful!")
         return redirect('buyer_orders')
@@ -589,30 +625,32 @@ def chapa_checkout(request, order_id):
 
 @login_required
 def payment_success(request, order_id):
-    order = get_object_or_404(Order, id=order_id, buyer=request.user)
+    order = get_object_or_404(Order.objects.select_related('product'), id=order_id, buyer=request.user)
 
     if order.status == 'Paid':
         messages.info(request, "Order already processed.")
         return redirect('buyer_orders')
 
-    order.status = 'Paid'
-    order.save()
-
-    Notification.objects.create(
-        recipient=request.user,
-        sender=order.product.seller,
-        notification_type='order',
-        message=f"Payment Successful: You ordered {order.quantity}kg of {order.product.name}.",
-        link=reverse('buyer_orders')  # Clicking takes them to their order list
-    )
+    with transaction.atomic():
+        order.status = 'Paid'
+        order.save()
 
-    Notification.objects.create(
-        recipient=order.product.seller,
-        sender=request.user,
-        notification_type='order',
-        message=f"New Sale! {request.user.username} bought {order.quantity}kg of {order.product.name} (${order.total_price}).",
-        link=reverse('seller_orders') # Clicking takes them to their seller dashboard
-    )
+        enqueue_notifications([
+            {
+                'recipient_id': request.user.id,
+                'sender_id': order.product.seller_id,
+                'notification_type': 'order',
+                'message': f"Payment Successful: You ordered {order.quantity}kg of {order.product.name}.",
+                'link': reverse('buyer_orders'),  # Clicking takes them to their order list
+            },
+            {
+                'recipient_id': order.product.seller_id,
+                'sender_id': request.user.id,
+                'notification_type': 'order',
+                'message': f"New Sale! {request.user.username} bought {order.quantity}kg of {order.product.name} (${order.total_price}).",
+                'link': reverse('seller_orders'),  # Clicking takes them to their seller dashboard
+            },
+        ])
     
     messages.success(request, "Payment confirmed! Order placed successfully.")
     return redirect('buyer_orders')